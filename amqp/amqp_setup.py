@@ -4,13 +4,20 @@ from os import environ
 import sys
 import os
 import logging
+import threading
+import contextlib
 # sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../stripe')))
 # from amqp.config import Config
 from config import Config
 import time
 
-# Configure logging
-logging.basicConfig(level=logging.WARNING)
+try:
+    from common import tracing
+except ImportError:
+    # The standalone topology container (amqp/Dockerfile) ships without the common package
+    tracing = None
+
+# Importing services configure logging (common.log); only the standalone run below sets it up here
 logger = logging.getLogger(__name__)
 
 # Connection settings
@@ -27,6 +34,16 @@ EXCHANGES = {
     "payment": "topic"          # For payment/refund events
 }
 
+# Seconds to wait after a failed declaration before a publish tries again
+TOPOLOGY_RETRY_AFTER = float(os.getenv("AMQP_TOPOLOGY_RETRY_AFTER", 30))
+# Seconds a publish waits for another thread's declaration to finish
+TOPOLOGY_WAIT = float(os.getenv("AMQP_TOPOLOGY_WAIT", 2))
+
+# Set once the exchanges and queues have been declared by this process
+_topology_declared = False
+_topology_failed_at = None
+_topology_lock = threading.Lock()
+
 """
 This function creates a channel (connection) and establishes connection with AMQP server
 """
@@ -54,9 +71,9 @@ def get_rabbitmq_connection(max_retries=10, retry_delay=5):
     return None
     
     
-def create_channel():
+def create_channel(max_retries=10):
     """Create a channel and ensure all exchanges exist"""
-    connection = get_rabbitmq_connection()
+    connection = get_rabbitmq_connection(max_retries=max_retries)
     if not connection:
         return None, None
         
@@ -93,9 +110,9 @@ def create_queue(channel, exchange_name, queue_name, routing_key):
         return False
 
 
-def setup_all_queues():
+def setup_all_queues(max_retries=10):
     """Set up all queues needed by the system"""
-    connection, channel = create_channel()
+    connection, channel = create_channel(max_retries=max_retries)
     if not channel:
         return False
     
@@ -120,24 +137,84 @@ def setup_all_queues():
         return False
 
 
+def _backing_off():
+    return _topology_failed_at is not None and time.monotonic() - _topology_failed_at < TOPOLOGY_RETRY_AFTER
+
+
+def ensure_topology():
+    """
+    Declare the exchanges and queues once per process, on first use rather than
+    at import. Makes a single connection attempt, like ping(); after a failure
+    nothing is tried again for TOPOLOGY_RETRY_AFTER seconds. While one thread
+    is declaring, the others wait up to TOPOLOGY_WAIT seconds for its outcome
+    and return False if it has not finished by then.
+    """
+    global _topology_declared, _topology_failed_at
+    if _topology_declared:
+        return True
+    if _backing_off():
+        return False
+    if not _topology_lock.acquire(timeout=TOPOLOGY_WAIT):
+        return False
+    try:
+        # The thread that held the lock may have just declared the topology, or failed to
+        if not _topology_declared and not _backing_off():
+            _topology_declared = setup_all_queues(max_retries=1)
+            _topology_failed_at = None if _topology_declared else time.monotonic()
+    finally:
+        _topology_lock.release()
+    return _topology_declared
+
+
+def _publish_span(exchange_name, routing_key):
+    """Producer span around a publish, whose traceparent travels in the message headers"""
+    if tracing is None:
+        return contextlib.nullcontext()
+    return tracing.span(f"{routing_key} publish", "producer",
+                        attributes={"messaging.destination": exchange_name,
+                                    "messaging.routing_key": routing_key})
+
+
 def publish_message(exchange_name, routing_key, message):
     """Publish a message to an exchange"""
-    try:
-        connection = get_rabbitmq_connection()
-        if not connection:
-            raise Exception("No RabbitMQ connection available")
+    with _publish_span(exchange_name, routing_key):
+        try:
+            # Publishing to an exchange that does not exist yet closes the channel and drops the message
+            if not ensure_topology():
+                raise Exception("AMQP topology is not declared, message not published")
+            # One attempt: the caller is serving a request and a retry loop would hold it for up to 50s
+            connection = get_rabbitmq_connection(max_retries=1)
+            if not connection:
+                raise Exception("No RabbitMQ connection available")
 
-        channel = connection.channel()
-        channel.basic_publish(
-            exchange=exchange_name,
-            routing_key=routing_key,
-            body=message,
-            properties=pika.BasicProperties(delivery_mode=2)  # Make message persistent
-        )
-        logger.info(f"Message published to exchange '{exchange_name}' with routing key '{routing_key}': {message}")
-        connection.close()
-    except Exception as e:
-        logger.error(f"Failed to publish message: {str(e)}")
+            channel = connection.channel()
+            channel.basic_publish(
+                exchange=exchange_name,
+                routing_key=routing_key,
+                body=message,
+                properties=pika.BasicProperties(
+                    delivery_mode=2,  # Make message persistent
+                    headers=tracing.message_headers() if tracing is not None else None
+                )
+            )
+            logger.info("Message published to exchange '%s' with routing key '%s'", exchange_name, routing_key)
+            connection.close()
+        except Exception as e:
+            logger.error(f"Failed to publish message: {str(e)}")
+            if tracing is not None:
+                tracing.current().set_error(e)
+
+def ping(timeout=2):
+    """A single quick connection attempt, for health checks; raises when the broker is unreachable"""
+    connection = pika.BlockingConnection(
+        pika.ConnectionParameters(
+            host=amqp_host,
+            port=amqp_port,
+            connection_attempts=1,
+            socket_timeout=timeout,
+            blocked_connection_timeout=timeout,
+        ))
+    connection.close()
 
 def check_setup():
     """Check if the RabbitMQ setup is working"""
@@ -148,10 +225,8 @@ def check_setup():
     connection.close()
     return True
 
-# Initialize when module is imported
-setup_all_queues()
-
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
     # Run the setup
     if setup_all_queues():
         logger.info("AMQP setup completed successfully. Keeping service alive...")
@@ -0,0 +1,102 @@
+"""
+Compare Flask's default JSON provider against common.json_provider on GET /order sized bodies.
+
+No database needed: rows shaped like the orders table are generated in memory, then
+
+  default  format each row with .isoformat() -> jsonify() (stdlib json)
+  fast     rows passed with their datetime values as-is -> jsonify() (orjson when installed)
+
+are timed end to end, including building the response object.
+
+  python benchmarks/bench_json.py --rows 100000
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import statistics
+from datetime import datetime, timedelta
+
+from flask import Flask, jsonify
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+from common import json_provider
+
+
+def make_rows(count):
+    rng = random.Random(42)
+    start = datetime(2024, 1, 1)
+    return [(
+        f"pi_{rng.getrandbits(96):024x}",
+        f"cust{rng.randrange(count // 10 + 1):010d}",
+        sorted(rng.sample(range(1, 800), rng.randint(6, 9))),
+        rng.choice(["pending", "processing", "completed", "refunded"]),
+        start + timedelta(seconds=rng.randrange(365 * 86400), microseconds=rng.randrange(1000000)),
+    ) for _ in range(count)]
+
+
+def render_default(rows):
+    # What the handlers did before: convert every timestamp, then the stdlib encoder
+    return jsonify({
+        "code": 200,
+        "data": [{
+            "order_id": row[0],
+            "customer_id": row[1],
+            "parts_list": row[2],
+            "status": row[3],
+            "timestamp": row[4].isoformat()
+        } for row in rows]
+    }).get_data()
+
+
+def render_fast(rows):
+    return jsonify({
+        "code": 200,
+        "data": [{
+            "order_id": row[0],
+            "customer_id": row[1],
+            "parts_list": row[2],
+            "status": row[3],
+            "timestamp": row[4]
+        } for row in rows]
+    }).get_data()
+
+
+def timed(app, fn, rows, repeat):
+    samples = []
+    with app.app_context():
+        body = fn(rows)  # warm up
+        for _ in range(repeat):
+            started = time.perf_counter()
+            body = fn(rows)
+            samples.append((time.perf_counter() - started) * 1000)
+    return samples, body
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows)
+    default_app = Flask("default")
+    fast_app = json_provider.init_app(Flask("fast"))
+
+    results = {
+        "default": timed(default_app, render_default, rows, args.repeat),
+        "fast": timed(fast_app, render_fast, rows, args.repeat),
+    }
+    if results["default"][1] != results["fast"][1]:
+        print("warning: the two providers produced different bodies")
+
+    backend = "orjson" if json_provider.orjson is not None else "stdlib fallback"
+    print(f"{args.rows} rows, {args.repeat} runs each, fast provider using {backend}")
+    for name, (samples, body) in results.items():
+        print(f"  {name:<8} median {statistics.median(samples):8.1f} ms   "
+              f"min {min(samples):8.1f} ms   body {len(body) / 1024 / 1024:.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Compare rendering a list response in Python against rendering it in Postgres.
+
+Builds a temporary orders-shaped table, then times both paths end to end:
+
+  python    fetchall() -> format rows into dicts -> json.dumps()
+  postgres  json_build_object/json_agg ... ::text -> raw bytes (DatabasePool.fetch_json)
+
+Usage (DB_* variables as for the services; any reachable database works):
+
+  DB_HOST=localhost DB_NAME=order_db python benchmarks/bench_pg_json.py --rows 100000
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+from common.db import DatabasePool
+
+DB_PARAMS = {
+    "dbname": os.getenv("DB_NAME", "order_db"),
+    "user": os.getenv("DB_USER", "postgres"),
+    "password": os.getenv("DB_PASSWORD", "password"),
+    "host": os.getenv("DB_HOST", "localhost"),
+    "port": os.getenv("DB_PORT", "5432")
+}
+
+SETUP = """
+    CREATE TEMP TABLE bench_orders AS
+    SELECT 'order-' || n AS order_id,
+           'customer-' || (n %% 1000) AS customer_id,
+           jsonb_build_array(n %% 97, n %% 89, n %% 83, n %% 79) AS parts_list,
+           'pending'::varchar(50) AS status,
+           now()::timestamp - (n || ' seconds')::interval AS timestamp
+    FROM generate_series(1, %s) AS n
+"""
+
+PYTHON_QUERY = "SELECT order_id, customer_id, parts_list, status, timestamp FROM bench_orders"
+
+POSTGRES_QUERY = """
+    SELECT json_build_object('code', 200, 'data', json_agg(json_build_object(
+        'order_id', order_id,
+        'customer_id', customer_id,
+        'parts_list', parts_list,
+        'status', status,
+        'timestamp', timestamp
+    )))::text
+    FROM bench_orders
+"""
+
+
+def render_in_python(cursor):
+    cursor.execute(PYTHON_QUERY)
+    data = [{
+        "order_id": row[0],
+        "customer_id": row[1],
+        "parts_list": row[2],
+        "status": row[3],
+        "timestamp": row[4].isoformat()
+    } for row in cursor.fetchall()]
+    return json.dumps({"code": 200, "data": data}).encode()
+
+
+def render_in_postgres(db_pool):
+    return db_pool.fetch_json(POSTGRES_QUERY)
+
+
+def timed(fn, repeat):
+    samples = []
+    size = 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        body = fn()
+        samples.append((time.perf_counter() - started) * 1000)
+        size = len(body)
+    return samples, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    # One connection, so the temp table is visible to both paths
+    db_pool = DatabasePool("bench_pg_json", DB_PARAMS, minconn=1, maxconn=1)
+    with db_pool.connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(SETUP, (args.rows,))
+
+        # Warm up shared buffers so the first timed run is not penalised
+        with conn.cursor() as cursor:
+            render_in_python(cursor)
+        results = {"python": timed(lambda: render_in_python(conn.cursor()), args.repeat)}
+
+    results["postgres"] = timed(lambda: render_in_postgres(db_pool), args.repeat)
+    db_pool.close()
+
+    print(f"{args.rows} rows, {args.repeat} runs each")
+    for name, (samples, size) in results.items():
+        print(f"  {name:<9} median {statistics.median(samples):8.1f} ms   "
+              f"min {min(samples):8.1f} ms   body {size / 1024 / 1024:.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Time how long each service takes to import, i.e. what every worker pays before serving.
+
+Each service module is imported in a fresh interpreter under `python -X importtime`:
+
+  wall      wall-clock time of the whole run, interpreter start included
+  import    the cumulative import time Python reports for the service module
+
+followed by the slowest modules the service imports directly, from the last
+run. Importing must not touch the broker (AMQP topology is declared on first
+use); the data services do run their migrations at import, so point DB_* at a
+database for those.
+
+  python benchmarks/bench_startup.py --repeat 5 --top 8 stripe email_service
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '../'))
+
+# service -> (directory it runs from, module its server imports)
+SERVICES = {
+    "customer": ("customer", "app"),
+    "order": ("order", "app"),
+    "delivery": ("delivery", "app"),
+    "recommendation": ("recommendation", "app"),
+    "cart": ("cart", "cart"),
+    "make_purchase": ("make_purchase", "makePurchase"),
+    "scenario3": ("scenario3", "makeRefunds"),
+    "stripe": ("stripe", "app"),
+    "email_service": (".", "email_service.app"),
+}
+
+
+def parse_importtime(stderr, module):
+    """
+    Cumulative µs of module and (name, cumulative µs) of the modules it imported
+    directly, from -X importtime output. Each import is printed after the imports
+    it triggered, indented two spaces per level.
+    """
+    children = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue  # the header line
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 1:
+            children.append((name.strip(), int(cumulative)))
+        elif depth == 0:
+            if name.strip() == module:
+                return int(cumulative), children
+            children = []
+    return 0, children
+
+
+def import_once(service):
+    directory, module = SERVICES[service]
+    # Appended like the services' own sys.path entries, so the stripe/ directory doesn't shadow the stripe library
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [os.getenv("PYTHONPATH"), ROOT])))
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=os.path.join(ROOT, directory), env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    wall_ms = (time.perf_counter() - started) * 1000
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    return (wall_ms,) + parse_importtime(result.stderr, module)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("services", nargs="*", help=f"any of {', '.join(SERVICES)} (default: all)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--top", type=int, default=5)
+    args = parser.parse_args()
+    unknown = set(args.services) - set(SERVICES)
+    if unknown:
+        parser.error(f"unknown services: {', '.join(sorted(unknown))}")
+
+    print(f"{args.repeat} runs each")
+    for service in args.services or SERVICES:
+        walls, totals = [], []
+        try:
+            for _ in range(args.repeat):
+                wall_ms, total_us, imports = import_once(service)
+                walls.append(wall_ms)
+                totals.append(total_us / 1000)
+        except RuntimeError as e:
+            print(f"  {service:<15} failed: {e}")
+            continue
+        print(f"  {service:<15} wall median {statistics.median(walls):7.1f} ms   "
+              f"import median {statistics.median(totals):7.1f} ms")
+        for name, cumulative in sorted(imports, key=lambda item: -item[1])[:args.top]:
+            print(f"      {cumulative / 1000:7.1f} ms  {name}")
+
+
+if __name__ == "__main__":
+    main()
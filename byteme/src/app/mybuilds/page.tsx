@@ -5,11 +5,49 @@ import axios from "axios";
 import BuildCard from "@/components/BuildCard";
 import { useAuth } from "@/lib/auth-context";
 
+// Builds are fetched one keyset page at a time; "Load more" follows the `next` cursor
+const PAGE_SIZE = 12;
+
 export default function MyBuilds() {
     const { user, loading: authLoading } = useAuth(); // Use the loading state from useAuth
-    const [data, setData] = useState(null);
+    const [builds, setBuilds] = useState<any[]>([]);
+    const [nextCursor, setNextCursor] = useState<string | null>(null);
     const [loading, setLoading] = useState(true);
+    const [loadingMore, setLoadingMore] = useState(false);
     const [error, setError] = useState<string | null>(null);
+
+    const fetchData = async (cursor: string | null = null) => {
+      if (!user) return;
+
+      const options = {
+        method: "GET",
+        url: `http://localhost:8000/recommendation-route/recommendation/customer/${user.uid}`,
+        params: cursor ? { limit: PAGE_SIZE, cursor } : { limit: PAGE_SIZE },
+      };
+
+      try {
+        const response = await axios.request(options);
+        const page = response.data.data || [];
+        setBuilds((previous) => (cursor ? [...previous, ...page] : page));
+        setNextCursor(response.data.next || null);
+      } catch (error: unknown) {
+        // Handle errors
+        if (error instanceof Error) {
+          setError(error.message);
+        } else {
+          setError("An unexpected error occurred");
+        }
+      } finally {
+        setLoading(false);
+        setLoadingMore(false);
+      }
+    };
+
+    const loadMore = () => {
+      if (!nextCursor || loadingMore) return;
+      setLoadingMore(true);
+      fetchData(nextCursor);
+    };
   
     useEffect(() => {
       if (authLoading) {
@@ -22,27 +60,6 @@ export default function MyBuilds() {
         return;
       }
   
-      const fetchData = async () => {
-        const options = {
-          method: "GET",
-          url: `http://localhost:8000/recommendation-route/recommendation/customer/${user.uid}`,
-        };
-  
-        try {
-          const response = await axios.request(options);
-          setData(response.data);
-        } catch (error: unknown) {
-          // Handle errors
-          if (error instanceof Error) {
-            setError(error.message);
-          } else {
-            setError("An unexpected error occurred");
-          }
-        } finally {
-          setLoading(false);
-        }
-      };
-  
       fetchData();
     }, [user, authLoading]); // Dependency on both `user` and `authLoading`
   
@@ -60,7 +77,7 @@ export default function MyBuilds() {
       </div>
 
       <div className="grid grid-cols-1 md:grid-cols-2 lg:grid-cols-3 gap-6">
-        {data.data.map((rec) => (
+        {builds.map((rec) => (
           <BuildCard
             key={rec.recommendation_id}
             title={rec.name}
@@ -70,6 +87,18 @@ export default function MyBuilds() {
           />
         ))}
       </div>
+
+      {nextCursor && (
+        <div className="flex justify-center mt-8">
+          <button
+            onClick={loadMore}
+            disabled={loadingMore}
+            className="px-4 py-2 bg-gray-700 text-white rounded hover:bg-gray-600 transition-colors disabled:opacity-50"
+          >
+            {loadingMore ? "Loading..." : "Load more"}
+          </button>
+        </div>
+      )}
     </div>
   );
 }
@@ -15,37 +15,55 @@ interface Order {
     parts_list: any[]; // Adjust type as needed
 }
 
+// Orders are fetched one keyset page at a time; "Load more" follows the `next` cursor
+const PAGE_SIZE = 20;
+
 const MyOrdersPage = () => {
     const [orders, setOrders] = useState<Order[]>([]);
     const [loading, setLoading] = useState(true);
     const [error, setError] = useState<string | null>(null);
+    const [nextCursor, setNextCursor] = useState<string | null>(null);
+    const [loadingMore, setLoadingMore] = useState(false);
     const router = useRouter();
 
-    // Fetch orders for the logged-in user
-    const fetchOrders = async () => {
+    // Fetch a page of orders for the logged-in user; without a cursor this starts from the newest
+    const fetchOrders = async (cursor: string | null = null) => {
         try {
             const userId = localStorage.getItem('user_id');
             if (!userId) {
                 throw new Error('User not logged in');
             }
 
-            const response = await fetch(`http://localhost:5002/order/customers/${userId}`);
+            const params = new URLSearchParams({ limit: String(PAGE_SIZE) });
+            if (cursor) {
+                params.set('cursor', cursor);
+            }
+            const response = await fetch(`http://localhost:5002/order/customers/${userId}?${params}`);
 
             if (!response.ok) {
                 throw new Error('Failed to fetch orders');
             }
 
             const data = await response.json();
-            setOrders(data.data || []);
+            const page: Order[] = data.data || [];
+            setOrders((previous) => (cursor ? [...previous, ...page] : page));
+            setNextCursor(data.next || null);
             setError(null);
         } catch (error) {
             console.error('Error fetching orders:', error);
             setError(error instanceof Error ? error.message : 'An unknown error occurred');
         } finally {
             setLoading(false);
+            setLoadingMore(false);
         }
     };
 
+    const loadMore = () => {
+        if (!nextCursor || loadingMore) return;
+        setLoadingMore(true);
+        fetchOrders(nextCursor);
+    };
+
     useEffect(() => {
         fetchOrders();
     }, []);
@@ -112,7 +130,7 @@ const MyOrdersPage = () => {
         return (
             <div className="p-4 text-red-400">
                 <p>Error: {error}</p>
-                <button onClick={fetchOrders} className="mt-2 p-2 bg-blue-600 text-white rounded">
+                <button onClick={() => fetchOrders()} className="mt-2 p-2 bg-blue-600 text-white rounded">
                     Retry
                 </button>
             </div>
@@ -191,6 +209,18 @@ const MyOrdersPage = () => {
                             </Card>
                         );
                     })}
+
+                    {nextCursor && (
+                        <div className="flex justify-center">
+                            <button
+                                onClick={loadMore}
+                                disabled={loadingMore}
+                                className="px-4 py-2 bg-gray-700 text-white rounded hover:bg-gray-600 transition-colors disabled:opacity-50"
+                            >
+                                {loadingMore ? 'Loading...' : 'Load more'}
+                            </button>
+                        </div>
+                    )}
                 </div>
             )}
         </div>
@@ -1,13 +1,29 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
 from flask_cors import CORS
-import psycopg2
 import os
+import sys
+import logging
 import uuid
 from datetime import datetime
-from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+# Add the project root to the Python path so the shared common package resolves
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+from common import compression, etag, health, json_provider, log, metrics, profiling, tracing
+from common.db import DatabasePool, PreparedStatement
+from common.migrations import Migration, run_migrations
+from common.streaming import wants_ndjson, ndjson_response
+from common.pagination import InvalidCursor, page_request, fetch_page
+
+# JSON log lines written off the request thread, at LOG_LEVEL
+log.setup("cart")
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 CORS(app)
+# orjson-backed jsonify that also encodes datetime, Decimal and UUID values
+json_provider.init_app(app)
+# gzip/brotli for large responses, negotiated through Accept-Encoding
+compression.init_app(app)
 
 # Database connection parameters
 DB_PARAMS = {
@@ -18,103 +34,161 @@ DB_PARAMS = {
     "port": os.getenv("DB_PORT", "5432"),  # Your host PostgreSQL port
 }
 
-def get_db_connection():
-    """Returns a connection to the database."""
-    conn = psycopg2.connect(**DB_PARAMS)
-    return conn
+# Connections are borrowed from a per-worker pool instead of opened per request
+db_pool = DatabasePool("cart", DB_PARAMS)
+db_pool.init_app(app)
+# Prometheus /metrics: request latency per route and status, connection pool usage
+metrics.init_app(app, pools=[db_pool])
+# Server span per request, continuing the caller's W3C traceparent
+tracing.init_app(app, "cart")
+# cProfile of requests carrying a signed X-Debug-Profile token (or sampled), kept at /debug/profiles
+profiling.init_app(app, "cart")
+# /health and /ready served from a background check of the database every HEALTH_CHECK_INTERVAL seconds
+health_monitor = health.HealthMonitor("cart")
+health_monitor.add_check("database", db_pool.ping)
+health_monitor.init_app(app)
 
-def ensure_database_exists():
-    """Ensures that the cart_db database exists."""
-    try:
-        conn = psycopg2.connect(
-            dbname="postgres", user=DB_PARAMS["user"],
-            password=DB_PARAMS["password"], host=DB_PARAMS["host"], port=DB_PARAMS["port"]
+# Versioned schema changes, applied once at process start instead of probed per request
+MIGRATIONS = [
+    Migration(1, "create carts table", """
+        CREATE TABLE IF NOT EXISTS carts (
+            cart_id UUID PRIMARY KEY,
+            customer_id VARCHAR(100) NOT NULL,
+            name VARCHAR(255) NOT NULL,
+            parts_list INTEGER[] NOT NULL,
+            total_cost NUMERIC(10, 2) NOT NULL,
+            timestamp TIMESTAMP NOT NULL
         )
-        conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT 1 FROM pg_database WHERE datname = 'cart_db'")
-        if not cursor.fetchone():
-            print("Creating database 'cart_db'...")
-            cursor.execute("CREATE DATABASE cart_db")
-            print("Database 'cart_db' created successfully")
-        
-        cursor.close()
-        conn.close()
-    except Exception as e:
-        print(f"Error ensuring database exists: {str(e)}")
-        raise
+    """),
+    # Serves /cart/customer/<id>; built concurrently so writes keep flowing on large tables
+    Migration(2, "index carts.customer_id", """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_carts_customer_id ON carts (customer_id)
+    """, transactional=False),
+    # Keyset pagination seeks on (customer_id, timestamp, cart_id), newest first
+    Migration(3, "index carts (customer_id, timestamp, cart_id)", """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_carts_customer_timestamp_id
+        ON carts (customer_id, timestamp, cart_id)
+    """, transactional=False),
+    # Covered by the composite index above; dropping it saves a write per insert
+    Migration(4, "drop idx_carts_customer_id", """
+        DROP INDEX CONCURRENTLY IF EXISTS idx_carts_customer_id
+    """, transactional=False),
+]
 
-def ensure_carts_table_exists():
-    """Ensures that the carts table exists in the database."""
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS carts (
-                cart_id UUID PRIMARY KEY,
-                customer_id VARCHAR(100) NOT NULL,
-                name VARCHAR(255) NOT NULL,
-                parts_list INTEGER[] NOT NULL, 
-                total_cost NUMERIC(10, 2) NOT NULL,
-                timestamp TIMESTAMP NOT NULL
-            )
-        """)
-        conn.commit()
-        cursor.close()
-        conn.close()
-        print("Checked for 'carts' table and created it if missing.")
-    except Exception as e:
-        print(f"Error ensuring carts table exists: {str(e)}")
-        raise
+# Create the database, tables and indexes once at process start
+run_migrations(db_pool, MIGRATIONS)
+
+# Hot queries, PREPAREd once per pooled connection and then executed by name
+SELECT_CART = db_pool.prepare("select_cart", f"""
+    SELECT cart_id, customer_id, name, parts_list, total_cost, timestamp, {etag.VERSION_COLUMN}
+    FROM carts
+    WHERE cart_id = %s
+""")
+# Answers If-None-Match without fetching the row
+CART_VERSION = db_pool.prepare("cart_version", f"""
+    SELECT {etag.VERSION_COLUMN} FROM carts WHERE cart_id = %s
+""")
+INSERT_CART = db_pool.prepare("insert_cart", """
+    INSERT INTO carts (
+        cart_id, customer_id, name, parts_list, total_cost, timestamp
+    ) VALUES (%s, %s, %s, %s, %s, %s)
+    RETURNING *
+""")
+
+# Let Postgres build read responses with json_build_object/json_agg and pass the bytes through
+PG_JSON_RENDERING = os.getenv("PG_JSON_RENDERING", "False").lower() in ('true', '1', 't')
 
+# Postgres-side equivalent of format_cart()
+CART_JSON = """
+    json_build_object(
+        'cart_id', cart_id,
+        'customer_id', customer_id,
+        'name', name,
+        'parts_list', parts_list,
+        'total_cost', total_cost::float8,
+        'timestamp', timestamp
+    )
+"""
 
 def transform_parts_list(parts_list):
     """Ensures parts_list is an array of integers."""
     if isinstance(parts_list, list):
         if all(isinstance(part, int) for part in parts_list):  # Check that all parts are integers
-            print(parts_list)
             return parts_list
         else:
             raise ValueError("All items in parts_list must be integers")
     else:
         raise ValueError("parts_list must be an array of integers")
 
+def format_cart(cart):
+    """Converts a carts row into its JSON representation."""
+    return {
+        "cart_id": cart[0],
+        "customer_id": cart[1],
+        "name": cart[2],
+        "parts_list": cart[3],  # Return the parts list as an array
+        "total_cost": cart[4],
+        "timestamp": cart[5]
+    }
+
 def execute_query(query, params):
-    """Executes a database query and returns the results."""
+    """Executes a read-only query (plain SQL or a PreparedStatement) and returns the results."""
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute(query, params)
-        results = cursor.fetchall()
-        cursor.close()
-        conn.close()
-        return results
+        with db_pool.read_cursor() as cursor:
+            if isinstance(query, PreparedStatement):
+                query.execute(cursor, params)
+            else:
+                cursor.execute(query, params)
+            return cursor.fetchall()
+    except Exception as e:
+        raise Exception(f"Database query failed: {str(e)}")
+
+def execute_json_query(query, params):
+    """Executes a query that renders the response body in Postgres and returns it as bytes."""
+    try:
+        return db_pool.fetch_json(query, params)
+    except Exception as e:
+        raise Exception(f"Database query failed: {str(e)}")
+
+def execute_json_row_query(query, params):
+    """Like execute_json_query, for queries that select further columns after the body."""
+    try:
+        return db_pool.fetch_json_row(query, params)
     except Exception as e:
         raise Exception(f"Database query failed: {str(e)}")
 
 # Endpoint to fetch a cart by cart_id
 @app.route("/cart/<string:cart_id>", methods=['GET'])
 def get_cart(cart_id):
-    query = """
-        SELECT cart_id, customer_id, name, parts_list, total_cost, timestamp
-        FROM carts 
-        WHERE cart_id = %s
-    """
-    result = execute_query(query, (cart_id,))
+    # A client revalidating its copy only needs the row version, not the row
+    not_modified = etag.revalidate(db_pool, CART_VERSION, cart_id)
+    if not_modified:
+        return not_modified
+
+    if PG_JSON_RENDERING:
+        row = execute_json_row_query(f"""
+            SELECT json_build_object('code', 200, 'data', {CART_JSON})::text, {etag.VERSION_COLUMN}
+            FROM carts
+            WHERE cart_id = %s
+        """, (cart_id,))
+        if row:
+            return etag.tag(Response(row[0], status=200, mimetype="application/json"), row[1].decode())
+        result = None
+    else:
+        result = execute_query(SELECT_CART, (cart_id,))
     if result:
         cart = result[0]
-        return jsonify({
+        return etag.tag(jsonify({
             "code": 200,
             "data": {
                 "cart_id": cart[0],
                 "customer_id": cart[1],
                 "name": cart[2],
                 "parts_list": cart[3],  # List of parts as an array
-                "total_cost": float(cart[4]),
-                "timestamp": cart[5].isoformat()
+                "total_cost": cart[4],
+                "timestamp": cart[5]
             }
-        }), 200
+        }), cart[6]), 200
     else:
         return jsonify({
             "code": 404,
@@ -137,7 +211,7 @@ def create_cart():
                 }), 400
 
         # Log the incoming data for debugging
-        print("Received data:", data)
+        logger.debug("Received data: %s", log.body(data))
                 
         # Transform parts_list
         try:
@@ -159,29 +233,19 @@ def create_cart():
         current_time = datetime.now()
         
         # Insert new cart into the database
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            INSERT INTO carts (
-                cart_id, customer_id, name, parts_list, total_cost, timestamp
-            ) VALUES (%s, %s, %s, %s, %s, %s)
-            RETURNING *
-            """,
-            (
-                cart_id,
-                data["customer_id"],
-                data["name"],
-                data["parts_list"],
-                data["total_cost"],
-                current_time
+        with db_pool.cursor() as cursor:
+            INSERT_CART.execute(
+                cursor,
+                (
+                    cart_id,
+                    data["customer_id"],
+                    data["name"],
+                    data["parts_list"],
+                    data["total_cost"],
+                    current_time
+                )
             )
-        )
-        
-        new_cart = cursor.fetchone()
-        conn.commit()
-        cursor.close()
-        conn.close()
+            new_cart = cursor.fetchone()
 
         return jsonify({
             "code": 201,
@@ -192,7 +256,7 @@ def create_cart():
                 "name": new_cart[2],
                 "total_cost": new_cart[3],
                 "parts_list": transformed_parts_list,  # Return the parts list as an array
-                "timestamp": new_cart[5].isoformat()
+                "timestamp": new_cart[5]
             }
         }), 201
         
@@ -210,19 +274,45 @@ def get_carts_by_customer(customer_id):
         FROM carts
         WHERE customer_id = %s
     """
-    carts = execute_query(query, (customer_id,))
+    # Keyset pagination when the client passes ?limit= or ?cursor=
+    try:
+        page = page_request()
+    except InvalidCursor as e:
+        return jsonify({
+            "code": 400,
+            "message": str(e)
+        }), 400
+    if page:
+        try:
+            carts, next_cursor = fetch_page(
+                db_pool,
+                "SELECT cart_id, customer_id, name, parts_list, total_cost, timestamp FROM carts",
+                "timestamp", "cart_id", page,
+                cursor_key=lambda cart: (cart[5], cart[0]),
+                filters=["customer_id = %s"], params=[customer_id]
+            )
+        except Exception as e:
+            raise Exception(f"Database query failed: {str(e)}")
+        return jsonify({
+            "code": 200,
+            "data": [format_cart(cart) for cart in carts],
+            "next": next_cursor
+        }), 200
+
+    if PG_JSON_RENDERING:
+        body = execute_json_query(f"""
+            SELECT json_build_object('code', 200, 'data', json_agg({CART_JSON}))::text
+            FROM carts
+            WHERE customer_id = %s
+            HAVING count(*) > 0
+        """, (customer_id,))
+        if body:
+            return Response(body, status=200, mimetype="application/json")
+        carts = None
+    else:
+        carts = execute_query(query, (customer_id,))
     if carts:
-        carts_list = [
-            {
-                "cart_id": cart[0],
-                "customer_id": cart[1],
-                "name": cart[2],
-                "parts_list": cart[3],  # Return the parts list as an array
-                "total_cost": float(cart[4]),
-                "timestamp": cart[5].isoformat()
-            }
-            for cart in carts
-        ]
+        carts_list = [format_cart(cart) for cart in carts]
         return jsonify({
             "code": 200,
             "data": carts_list
@@ -240,19 +330,26 @@ def get_all_carts():
         SELECT cart_id, customer_id, name, parts_list, total_cost, timestamp
         FROM carts
     """
-    carts = execute_query(query, ())
+    # Opt-in streaming: one cart per line from a server-side cursor, constant memory
+    if wants_ndjson():
+        try:
+            return ndjson_response(db_pool.stream(query), format_cart)
+        except Exception as e:
+            raise Exception(f"Database query failed: {str(e)}")
+
+    if PG_JSON_RENDERING:
+        body = execute_json_query(f"""
+            SELECT json_build_object('code', 200, 'data', json_agg({CART_JSON}))::text
+            FROM carts
+            HAVING count(*) > 0
+        """, ())
+        if body:
+            return Response(body, status=200, mimetype="application/json")
+        carts = None
+    else:
+        carts = execute_query(query, ())
     if carts:
-        carts_list = [
-            {
-                "cart_id": cart[0],
-                "customer_id": cart[1],
-                "name": cart[2],
-                "parts_list": cart[3],  # Return the parts list as an array
-                "total_cost": float(cart[4]),
-                "timestamp": cart[5].isoformat()
-            }
-            for cart in carts
-        ]
+        carts_list = [format_cart(cart) for cart in carts]
         return jsonify({
             "code": 200,
             "data": carts_list
@@ -264,11 +361,4 @@ def get_all_carts():
         }), 404
 
 if __name__ == '__main__':
-    try:
-        ensure_database_exists()
-        ensure_carts_table_exists()  # <-- Add this
-    except Exception as e:
-        print(f"Failed to initialize database or table: {str(e)}")
-        exit(1)
-
-    app.run(host='0.0.0.0', port=5009, debug=True)
+    app.run(host='0.0.0.0', port=5009, debug=True)
\ No newline at end of file
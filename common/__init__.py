@@ -0,0 +1,2 @@
+# Common Package
+# Shared helpers (database pooling and friends) used by the ByteMe Flask services
@@ -0,0 +1,163 @@
+"""
+Adaptive admission control for the orchestrator services.
+
+Every route gets its own concurrency limit, adjusted AIMD-style from the
+latency the route actually sees: each request that finishes within
+ADMISSION_LATENCY_TARGET_MS (and without a 5xx) raises the limit by about one
+per limit's worth of completions, a slow or failed one cuts it by
+ADMISSION_BACKOFF. When a downstream (OutSystems, Stripe, another service)
+slows down the limit shrinks, and requests beyond it are answered at once with
+503 and Retry-After instead of parking another worker thread inside a remote
+call. Limits are per worker process.
+
+Settings: ADMISSION_ENABLED (True), ADMISSION_INITIAL_LIMIT / ADMISSION_MAX_LIMIT
+(GUNICORN_THREADS, the most a worker can run at once), ADMISSION_MIN_LIMIT (1),
+ADMISSION_LATENCY_TARGET_MS (5000, a purchase chains several remote calls),
+ADMISSION_BACKOFF (0.7) and ADMISSION_RETRY_AFTER seconds (1).
+"""
+import os
+import time
+import threading
+
+from flask import g, jsonify, request
+
+from .profiling import add_debug_route
+
+ENABLED = os.getenv("ADMISSION_ENABLED", "True").lower() in ('true', '1', 't')
+MAX_LIMIT = int(os.getenv("ADMISSION_MAX_LIMIT", os.getenv("GUNICORN_THREADS", 4)))
+INITIAL_LIMIT = int(os.getenv("ADMISSION_INITIAL_LIMIT", MAX_LIMIT))
+MIN_LIMIT = int(os.getenv("ADMISSION_MIN_LIMIT", 1))
+LATENCY_TARGET = float(os.getenv("ADMISSION_LATENCY_TARGET_MS", 5000)) / 1000
+BACKOFF = float(os.getenv("ADMISSION_BACKOFF", 0.7))
+RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", 1))
+
+# CORS preflights, health probes and the debug endpoints never wait on a downstream;
+# shedding a probe would take a merely busy instance out of rotation
+EXEMPT_METHODS = ("OPTIONS",)
+EXEMPT_PREFIXES = ("/debug/", "/health", "/ready")
+
+
+class AdaptiveLimiter:
+    """
+    A concurrency limit that grows additively while requests finish within
+    latency_target and shrinks multiplicatively when they do not.
+    """
+
+    def __init__(self, latency_target=LATENCY_TARGET, initial=INITIAL_LIMIT,
+                 minimum=MIN_LIMIT, maximum=MAX_LIMIT, backoff=BACKOFF):
+        self.latency_target = latency_target
+        self.minimum = minimum
+        self.maximum = maximum
+        self.backoff = backoff
+        self._limit = float(max(minimum, min(initial, maximum)))
+        self._in_flight = 0
+        # Requests admitted before the last decrease do not cut the limit again
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+        self.admitted = 0
+        self.rejected = 0
+        self.decreases = 0
+
+    @property
+    def limit(self):
+        return int(self._limit)
+
+    def acquire(self):
+        """Admit one request and return its start time, or None when at the limit"""
+        with self._lock:
+            if self._in_flight >= int(self._limit):
+                self.rejected += 1
+                return None
+            self._in_flight += 1
+            self.admitted += 1
+            return time.monotonic()
+
+    def release(self, started, ok=True):
+        """Finish a request admitted at started, feeding its latency back into the limit"""
+        now = time.monotonic()
+        with self._lock:
+            self._in_flight -= 1
+            if not ok or now - started > self.latency_target:
+                # One decrease per round trip: the requests already in flight saw the same slowdown
+                if started > self._last_decrease:
+                    self._limit = max(self.minimum, self._limit * self.backoff)
+                    self._last_decrease = now
+                    self.decreases += 1
+            elif self._in_flight + 1 >= int(self._limit):
+                # Only grow while the limit is actually what holds requests back
+                self._limit = min(self.maximum, self._limit + 1 / self._limit)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "limit": int(self._limit),
+                "in_flight": self._in_flight,
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "decreases": self.decreases,
+                "latency_target_ms": round(self.latency_target * 1000),
+            }
+
+
+class AdmissionControl:
+    """One AdaptiveLimiter per endpoint of a Flask app"""
+
+    def __init__(self):
+        self.limiters = {}
+        self._lock = threading.Lock()
+
+    def limiter(self, endpoint):
+        limiter = self.limiters.get(endpoint)
+        if limiter is None:
+            with self._lock:
+                limiter = self.limiters.get(endpoint)
+                if limiter is None:
+                    limiter = self.limiters[endpoint] = AdaptiveLimiter()
+        return limiter
+
+    def _admit(self):
+        if (request.endpoint is None or request.method in EXEMPT_METHODS
+                or request.path.startswith(EXEMPT_PREFIXES)):
+            return None
+        limiter = self.limiter(request.endpoint)
+        started = limiter.acquire()
+        if started is None:
+            response = jsonify({
+                "code": 503,
+                "message": "Service overloaded, retry later"
+            })
+            response.status_code = 503
+            response.headers["Retry-After"] = str(RETRY_AFTER)
+            return response
+        g.admission = (limiter, started)
+        return None
+
+    def _record_status(self, response):
+        if "admission" in g:
+            g.admission_ok = response.status_code < 500
+        return response
+
+    def _release(self, exc):
+        admitted = g.pop("admission", None)
+        if admitted is not None:
+            limiter, started = admitted
+            limiter.release(started, ok=exc is None and g.pop("admission_ok", False))
+
+    def stats(self):
+        return {endpoint: limiter.stats() for endpoint, limiter in sorted(self.limiters.items())}
+
+    def init_app(self, app):
+        """Limit every route of app (ADMISSION_ENABLED=False turns it off); stats at /debug/admission"""
+        if not ENABLED:
+            return
+        app.before_request(self._admit)
+        app.after_request(self._record_status)
+        app.teardown_request(self._release)
+
+        def admission_stats():
+            return jsonify({
+                "code": 200,
+                "data": self.stats()
+            }), 200
+
+        add_debug_route(app, "/debug/admission", "admission_stats", admission_stats)
@@ -0,0 +1,297 @@
+"""
+Bulk import and export of the service tables with COPY ... FROM/TO STDIN.
+
+  python -m common.bulk export orders orders.csv
+  python -m common.bulk import orders orders.csv --skip-invalid
+  python -m common.bulk export carts carts.bin --format binary
+
+Connection settings come from the same DB_* variables as the services; the
+database defaults to the one owning the table (order_db for orders, ...).
+Use "-" as the file to read from stdin or write to stdout.
+
+CSV imports are validated row by row on the way in (parts_list must have the
+shape the service's POST endpoint would have accepted) and streamed to the
+server as a single COPY, so memory stays flat however large the file is.
+Binary files cannot be inspected client-side; they are copied into a temporary
+staging table and checked there before being moved into the real table.
+"""
+import io
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+from collections import namedtuple
+
+import psycopg2
+
+from .db import DatabasePool
+
+# check: SQL predicate a valid row satisfies, used for binary (staged) imports
+Table = namedtuple("Table", ["name", "dbname", "columns", "parts_list", "check"])
+
+TABLES = {
+    "customers": Table(
+        "customers", "customer_db",
+        ["customer_id", "name", "address", "email", "created_at", "updated_at"],
+        None, "TRUE"
+    ),
+    "orders": Table(
+        "orders", "order_db",
+        ["order_id", "customer_id", "parts_list", "status", "timestamp"],
+        "jsonb", "jsonb_typeof(parts_list) = 'array'"
+    ),
+    "deliveries": Table(
+        "deliveries", "delivery_db",
+        ["delivery_id", "order_id", "customer_id", "created_at", "updated_at"],
+        None, "TRUE"
+    ),
+    "carts": Table(
+        "carts", "cart_db",
+        ["cart_id", "customer_id", "name", "parts_list", "total_cost", "timestamp"],
+        "int[]", "array_position(parts_list, NULL) IS NULL"
+    ),
+    "recommendations": Table(
+        "recommendations", "recommendation_db",
+        ["recommendation_id", "customer_id", "name", "cost", "parts_list", "timestamp"],
+        "jsonb-ids", """
+            jsonb_typeof(parts_list) = 'array' AND NOT EXISTS (
+                SELECT 1 FROM jsonb_array_elements(parts_list) AS part
+                WHERE jsonb_typeof(part) <> 'number' OR part::numeric <> trunc(part::numeric)
+            )
+        """
+    ),
+}
+
+DEFAULT_CHUNK_SIZE = 1 << 20
+
+
+class InvalidRow(ValueError):
+    """Raised for a row whose parts_list the owning service would have rejected"""
+
+
+def db_params(dbname):
+    """Connection parameters from the services' DB_* variables"""
+    return {
+        "dbname": dbname,
+        "user": os.getenv("DB_USER", "esduser"),
+        "password": os.getenv("DB_PASSWORD", "esduser"),
+        "host": os.getenv("DB_HOST", "localhost"),
+        "port": os.getenv("DB_PORT", "5444"),
+    }
+
+
+def parse_parts_list(value):
+    """Accept a decoded value, JSON text or a Postgres array literal such as {1,2,3}"""
+    if not isinstance(value, str):
+        return value
+    text = value.strip()
+    try:
+        return json.loads(text)
+    except ValueError:
+        pass
+    if not (text.startswith("{") and text.endswith("}")):
+        raise InvalidRow("parts_list is neither JSON nor a Postgres array literal")
+    inner = text[1:-1].strip()
+    try:
+        return [int(part) for part in inner.split(",")] if inner else []
+    except ValueError:
+        raise InvalidRow("parts_list array literal must contain only integers")
+
+
+def validate_parts_list(table, value):
+    """Apply the owning service's rules and return the list to store"""
+    parts = parse_parts_list(value)
+    if table.parts_list == "jsonb-ids" and isinstance(parts, dict):
+        # The shape POST /recommendation accepts: {"cpu": {"Id": 1}, ...}
+        if not all(isinstance(part, dict) and "Id" in part for part in parts.values()):
+            raise InvalidRow("parts_list must be an object where each value contains an 'Id' attribute")
+        parts = [part["Id"] for part in parts.values()]
+    if not isinstance(parts, list):
+        raise InvalidRow("parts_list must be an array")
+    if table.parts_list in ("int[]", "jsonb-ids") and not all(isinstance(part, int) for part in parts):
+        raise InvalidRow("All items in parts_list must be integers")
+    return parts
+
+
+def encode_parts_list(table, value):
+    """Validate parts_list and render it as COPY text for the table's column type"""
+    decoded = parse_parts_list(value)
+    parts = validate_parts_list(table, decoded)
+    if table.parts_list == "int[]":
+        return "{" + ",".join(str(part) for part in parts) + "}"
+    if parts is decoded and isinstance(value, str) and value.lstrip().startswith("["):
+        # Already a valid JSON array; pass the text through instead of re-encoding it
+        return value
+    return json.dumps(parts, separators=(",", ":"))
+
+
+class _CopySource(io.TextIOBase):
+    """
+    File-like object COPY reads from: encodes rows lazily, batch by batch, so a
+    single COPY streams an arbitrarily long row iterator in constant memory.
+    """
+
+    def __init__(self, table, columns, rows, skip_invalid=False, validate=True, batch_rows=5000):
+        self.table = table
+        self.validate = validate
+        self.columns = columns
+        self.rows = iter(rows)
+        self.skip_invalid = skip_invalid
+        self.batch_rows = batch_rows
+        self.buffer = ""
+        self.done = False
+        self.rows_read = 0
+        self.rejected = 0
+        # psycopg2 turns exceptions raised inside read() into a generic COPY failure
+        self.error = None
+
+    def _fill(self):
+        batch = io.StringIO()
+        writer = csv.writer(batch, lineterminator="\n")
+        # Only parts_list needs work; csv.writer renders str/int/Decimal/datetime in forms COPY accepts
+        parts_index = None
+        if self.validate and self.table.parts_list and "parts_list" in self.columns:
+            parts_index = self.columns.index("parts_list")
+        for _ in range(self.batch_rows):
+            row = next(self.rows, None)
+            if row is None:
+                self.done = True
+                break
+            self.rows_read += 1
+            row = [row.get(column) for column in self.columns] if isinstance(row, dict) else list(row)
+            try:
+                if parts_index is not None and row[parts_index] is not None:
+                    row[parts_index] = encode_parts_list(self.table, row[parts_index])
+                writer.writerow(row)
+            except InvalidRow as e:
+                if not self.skip_invalid:
+                    self.error = InvalidRow(f"row {self.rows_read}: {str(e)}")
+                    raise self.error
+                self.rejected += 1
+        self.buffer += batch.getvalue()
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        while not self.done and (size < 0 or len(self.buffer) < size):
+            self._fill()
+        if size < 0:
+            size = len(self.buffer)
+        chunk, self.buffer = self.buffer[:size], self.buffer[size:]
+        return chunk
+
+
+def copy_rows(db_pool, table, rows, columns=None, skip_invalid=False, chunk_size=DEFAULT_CHUNK_SIZE,
+              validate=True):
+    """
+    Stream rows (tuples in column order, or dicts) into table with one COPY in one
+    transaction. Returns (rows_loaded, rows_rejected). validate=False is for trusted
+    producers that already hand over parts_list as COPY text (JSON, or {1,2} for carts).
+    """
+    table = TABLES[table] if isinstance(table, str) else table
+    columns = list(columns or table.columns)
+    source = _CopySource(table, columns, rows, skip_invalid, validate)
+    statement = f"COPY {table.name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)"
+    try:
+        with db_pool.transaction() as cursor:
+            cursor.copy_expert(statement, source, size=chunk_size)
+    except Exception:
+        if source.error is not None:
+            raise source.error
+        raise
+    return source.rows_read - source.rejected, source.rejected
+
+
+def import_csv(db_pool, table, stream, skip_invalid=False, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Load a CSV file with a header row naming (a subset of) the table's columns"""
+    reader = csv.reader(stream)
+    header = next(reader, None)
+    if not header:
+        return 0, 0
+    unknown = [column for column in header if column not in table.columns]
+    if unknown:
+        raise InvalidRow(f"unknown columns for {table.name}: {', '.join(unknown)}")
+    # Empty unquoted CSV fields mean NULL, as they would to COPY itself
+    rows = ([value if value != "" else None for value in row] for row in reader)
+    return copy_rows(db_pool, table, rows, header, skip_invalid, chunk_size)
+
+
+def import_binary(db_pool, table, stream, skip_invalid=False, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Load a COPY binary file (as written by export) through a validated staging table"""
+    columns = ", ".join(table.columns)
+    with db_pool.transaction() as cursor:
+        cursor.execute(f"CREATE TEMP TABLE bulk_stage (LIKE {table.name} INCLUDING DEFAULTS) ON COMMIT DROP")
+        cursor.copy_expert(f"COPY bulk_stage ({columns}) FROM STDIN WITH (FORMAT binary)", stream, size=chunk_size)
+        cursor.execute(f"SELECT count(*) FILTER (WHERE NOT ({table.check})), count(*) FROM bulk_stage")
+        rejected, total = cursor.fetchone()
+        if rejected and not skip_invalid:
+            raise InvalidRow(f"{rejected} of {total} rows have an invalid parts_list")
+        cursor.execute(f"INSERT INTO {table.name} ({columns}) SELECT {columns} FROM bulk_stage WHERE {table.check}")
+    return total - rejected, rejected
+
+
+def export(db_pool, table, stream, fmt="csv", chunk_size=DEFAULT_CHUNK_SIZE):
+    """Dump the whole table; CSV gets a header row so it can be imported again"""
+    options = "FORMAT csv, HEADER true" if fmt == "csv" else "FORMAT binary"
+    with db_pool.cursor() as cursor:
+        cursor.copy_expert(
+            f"COPY {table.name} ({', '.join(table.columns)}) TO STDOUT WITH ({options})",
+            stream, size=chunk_size
+        )
+        return cursor.rowcount
+
+
+def _open(path, mode, fmt):
+    binary = fmt == "binary"
+    if path == "-":
+        std = sys.stdin if "r" in mode else sys.stdout
+        return std.buffer if binary else std
+    if binary:
+        return open(path, mode + "b")
+    return open(path, mode, newline="", encoding="utf-8")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m common.bulk", description="Bulk COPY import/export")
+    parser.add_argument("action", choices=["import", "export"])
+    parser.add_argument("table", choices=sorted(TABLES))
+    parser.add_argument("file", help='path, or "-" for stdin/stdout')
+    parser.add_argument("--format", choices=["csv", "binary"], default="csv")
+    parser.add_argument("--dbname", help="defaults to the database of the service owning the table")
+    parser.add_argument("--skip-invalid", action="store_true", help="drop invalid rows instead of aborting")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="bytes per COPY round trip")
+    args = parser.parse_args(argv)
+
+    table = TABLES[args.table]
+    db_pool = DatabasePool("bulk", db_params(args.dbname or table.dbname), minconn=1, maxconn=1)
+    started = time.monotonic()
+    try:
+        if args.action == "export":
+            with _open(args.file, "w", args.format) as stream:
+                count = export(db_pool, table, stream, args.format, args.chunk_size)
+            rejected = 0
+        else:
+            load = import_csv if args.format == "csv" else import_binary
+            with _open(args.file, "r", args.format) as stream:
+                count, rejected = load(db_pool, table, stream, args.skip_invalid, args.chunk_size)
+    except (InvalidRow, psycopg2.Error) as e:
+        # Each import is a single transaction, so a failure leaves the table untouched
+        print(f"[bulk] {args.action} of {args.table} failed: {str(e).strip()}", file=sys.stderr)
+        return 1
+    finally:
+        db_pool.close()
+
+    elapsed = time.monotonic() - started
+    verb = "exported" if args.action == "export" else "imported"
+    summary = f"[bulk] {verb} {count} {args.table} rows in {elapsed:.1f}s ({count / max(elapsed, 1e-6):,.0f} rows/s)"
+    if rejected:
+        summary += f", skipped {rejected} invalid"
+    print(summary, file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
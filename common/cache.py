@@ -0,0 +1,173 @@
+import os
+import time
+import select
+import logging
+import threading
+from collections import OrderedDict
+
+import psycopg2
+from psycopg2 import sql
+
+from . import serving
+
+logger = logging.getLogger(__name__)
+
+
+class InvalidatingCache:
+    """
+    Process-local LRU cache kept coherent across service instances with Postgres
+    LISTEN/NOTIFY.
+
+    Writers call notify() with the key they changed, on the same cursor as the
+    write, so the notification is delivered when (and only if) the write commits.
+    Every worker runs a listener thread on its own connection that evicts the
+    key as soon as the notification arrives. While the listener is not connected
+    the cache is bypassed entirely, since notifications may be missed.
+    """
+
+    def __init__(self, db_pool, channel, ttl=None, maxsize=None):
+        self.db_pool = db_pool
+        self.channel = channel
+        # Upper bound on an entry's life even if every notification arrives
+        self.ttl = ttl if ttl is not None else float(os.getenv("LOCAL_CACHE_TTL", 300))
+        self.maxsize = maxsize if maxsize is not None else int(os.getenv("LOCAL_CACHE_SIZE", 10000))
+        self.enabled = os.getenv("LOCAL_CACHE_ENABLED", "True").lower() in ('true', '1', 't')
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        # Bumped on every eviction; a load that raced with one is not stored
+        self._evictions = 0
+        self._listening = threading.Event()
+        self._listener = None
+        self._pid = None
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def active(self):
+        """True when entries may be served, i.e. the listener is connected in this process"""
+        if not self.enabled:
+            return False
+        self._ensure_listener()
+        return self._listening.is_set()
+
+    def _ensure_listener(self):
+        """Start the listener thread once per process (per-worker init, like the pool)"""
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid != pid:
+                # A forked child inherits neither the thread nor a trustworthy copy of the entries
+                self._entries = OrderedDict()
+                self._listening = threading.Event()
+                self._listener = threading.Thread(
+                    target=self._listen, name=f"{self.channel}-listener", daemon=True
+                )
+                self._listener.start()
+                self._pid = pid
+
+    def token(self):
+        """Take before loading a value from the database; pass to set()"""
+        return self._evictions
+
+    def get(self, key):
+        if not self.active:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] < time.monotonic():
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, token):
+        """Store value unless an eviction happened since token was taken"""
+        if not self.active:
+            return
+        with self._lock:
+            if token != self._evictions:
+                return
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def evict(self, key):
+        with self._lock:
+            self._evictions += 1
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._evictions += 1
+            self._entries = OrderedDict()
+
+    def notify(self, cursor, key):
+        """Tell every instance (this one included) that key changed; runs inside the writer's transaction"""
+        cursor.execute("SELECT pg_notify(%s, %s)", (self.channel, str(key)))
+        self.evict(str(key))
+
+    def stats(self):
+        with self._lock:
+            size = len(self._entries)
+        return {
+            "channel": self.channel,
+            "active": self._listening.is_set(),
+            "size": size,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def init_app(self, app):
+        """Expose hit/miss counters of this worker's cache at /debug/cache; start listening as each worker boots"""
+        from flask import jsonify
+
+        from .profiling import add_debug_route
+
+        if self.enabled:
+            serving.after_fork(self._ensure_listener)
+
+        def cache_stats():
+            return jsonify({
+                "code": 200,
+                "data": self.stats()
+            }), 200
+
+        add_debug_route(app, "/debug/cache", "cache_stats", cache_stats)
+
+    def _listen(self):
+        """Listener thread: evict on every notification, reconnect with backoff on failure"""
+        params = dict(self.db_pool.db_params, application_name=f"{self.db_pool.service}:cache-listener")
+        backoff = 1
+        while True:
+            conn = None
+            try:
+                conn = psycopg2.connect(**params)
+                conn.autocommit = True
+                with conn.cursor() as cursor:
+                    cursor.execute(sql.SQL("LISTEN {}").format(sql.Identifier(self.channel)))
+                # Anything cached before now may have missed a notification
+                self.clear()
+                self._listening.set()
+                backoff = 1
+
+                while True:
+                    if select.select([conn], [], [], 10) == ([], [], []):
+                        # Quiet channel: make sure the connection is still alive
+                        with conn.cursor() as cursor:
+                            cursor.execute("SELECT 1")
+                    conn.poll()
+                    while conn.notifies:
+                        self.evict(conn.notifies.pop(0).payload)
+            except Exception as e:
+                self._listening.clear()
+                self.clear()
+                logger.warning(f"[{self.db_pool.service}] cache listener on '{self.channel}' lost: {str(e)}")
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+            finally:
+                if conn is not None and not conn.closed:
+                    conn.close()
@@ -0,0 +1,119 @@
+"""
+Transparent response compression negotiated through Accept-Encoding.
+
+Brotli is preferred when the brotli package is installed and the client accepts
+it, gzip otherwise. Buffered responses smaller than COMPRESSION_MIN_SIZE bytes
+(single entities, errors) are sent as they are; streamed responses (NDJSON) are
+always compressed, chunk by chunk, so they stay constant-memory; each chunk is
+flushed so the client receives it as soon as it is produced.
+"""
+import os
+import zlib
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = ("application/json", "application/x-ndjson", "text/plain", "text/html", "text/csv")
+
+# Below about one packet the savings do not pay for the CPU time
+MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", 1400))
+# Fast settings: these bodies are compressed for every request, not once ahead of time
+GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", 5))
+BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", 4))
+ENABLED = os.getenv("COMPRESSION_ENABLED", "True").lower() in ('true', '1', 't')
+
+
+class _Gzip:
+    def __init__(self):
+        # wbits 16 + MAX_WBITS writes the gzip header and trailer
+        self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+class _Brotli:
+    def __init__(self):
+        self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+ENCODINGS = {"gzip": _Gzip}
+if brotli is not None:
+    ENCODINGS = {"br": _Brotli, "gzip": _Gzip}
+
+
+def _negotiate():
+    """Best encoding both sides support, honouring the client's q-values; None for identity"""
+    return request.accept_encodings.best_match(list(ENCODINGS))
+
+
+def _compressed_stream(original, chunks, compressor):
+    try:
+        for chunk in chunks:
+            # Flushed per chunk, or the compressor holds rows back until its buffer fills
+            data = compressor.compress(chunk) + compressor.flush()
+            if data:
+                yield data
+        yield compressor.finish()
+    finally:
+        # Lets the wrapped generator release its pooled connection on client disconnect
+        if hasattr(original, "close"):
+            original.close()
+
+
+def compress_response(response):
+    """after_request hook: compress response in place when it is worth it and the client accepts it"""
+    if (response.status_code < 200 or response.status_code in (204, 304)
+            or response.direct_passthrough
+            or "Content-Encoding" in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+
+    if not response.is_streamed and response.content_length is not None and response.content_length < MIN_SIZE:
+        return response
+
+    # Eligible for compression, so caches must key on Accept-Encoding either way
+    response.vary.add("Accept-Encoding")
+    encoding = _negotiate()
+    if encoding is None:
+        return response
+
+    compressor = ENCODINGS[encoding]()
+    if response.is_streamed:
+        original = response.response
+        response.response = _compressed_stream(original, response.iter_encoded(), compressor)
+        response.headers.pop("Content-Length", None)
+    else:
+        response.set_data(compressor.compress(response.get_data()) + compressor.finish())
+    response.headers["Content-Encoding"] = encoding
+    # The compressed bytes differ from the identity ones, so a strong ETag becomes weak
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def init_app(app):
+    """Compress this app's responses (COMPRESSION_ENABLED=False turns it off)"""
+    if ENABLED:
+        app.after_request(compress_response)
+    return app
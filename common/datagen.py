@@ -0,0 +1,280 @@
+"""
+Seeded synthetic data for scale testing, loaded through the COPY path in common.bulk.
+
+  python -m common.datagen --orders 1000000
+  python -m common.datagen --orders 20000000 --seed 7 --tables orders deliveries --truncate
+
+Every table is generated from its own seeded stream, and row n always gets the
+same ids, so runs with the same --seed and sizes produce identical data and can
+be loaded one table at a time. References line up across the five databases:
+orders point at existing customers, every delivery at a shipped order, and
+parts lists draw from one parts catalogue with a popularity skew.
+
+Tables must exist already (start each service once so its migrations run).
+"""
+import sys
+import time
+import itertools
+import uuid
+import random
+import argparse
+from datetime import datetime, timedelta
+
+import psycopg2
+
+from .bulk import TABLES, copy_rows, db_params
+from .db import DatabasePool
+
+# Part categories of a build: (first catalogue Id, number of models, base price, chance to be in a build)
+CATALOGUE = {
+    "cpu": (1, 60, 250.0, 1.0),
+    "motherboard": (101, 80, 180.0, 1.0),
+    "ram": (201, 50, 90.0, 1.0),
+    "storage": (301, 70, 110.0, 1.0),
+    "psu": (401, 40, 95.0, 1.0),
+    "case": (501, 60, 85.0, 1.0),
+    "gpu": (601, 90, 550.0, 0.85),
+    "cooler": (701, 40, 60.0, 0.6),
+    "extra_storage": (301, 70, 110.0, 0.3),
+}
+
+ORDER_STATUSES = (
+    ("completed", 0.80),
+    ("processing", 0.07),
+    ("pending", 0.08),
+    ("refunded", 0.03),
+    ("refund_pending", 0.02),
+)
+
+# Orders in these states have been handed to delivery
+SHIPPED = ("completed", "processing", "refunded", "refund_pending")
+
+FIRST_NAMES = ["Wei", "Hui Min", "Arjun", "Siti", "Jun Jie", "Priya", "Daniel", "Mei Ling", "Farhan", "Chloe",
+               "Ryan", "Nur", "Marcus", "Aisha", "Ethan", "Xin Yi", "Kumar", "Rachel", "Hafiz", "Sarah"]
+LAST_NAMES = ["Tan", "Lim", "Lee", "Ng", "Wong", "Goh", "Chua", "Koh", "Teo", "Ong",
+              "Rahman", "Singh", "Kumar", "Ismail", "Chen", "Ho", "Yeo", "Low", "Sim", "Toh"]
+STREETS = ["Orchard Road", "Bukit Timah Road", "Tampines Avenue 4", "Jurong West Street 52", "Ang Mo Kio Avenue 3",
+           "Bedok North Road", "Clementi Avenue 2", "Serangoon Road", "Woodlands Drive 14", "Punggol Field"]
+
+
+def customer_id(index):
+    return f"cust{index:010d}"
+
+
+def order_id(index):
+    # Scrambled like real payment intent ids, so inserts do not arrive in key order
+    return f"pi_{(index * 0x9E3779B97F4A7C15 + 0x632BE59BD9B4E019) & ((1 << 96) - 1):024x}"
+
+
+# Distinct builds sampled per run; rows pick from this pool instead of assembling a build each
+BUILD_POOL_SIZE = 1 << 16
+
+
+class Config:
+    """Sizes and time range shared by every table, so each one can be regenerated on its own"""
+
+    def __init__(self, orders, customers, seed, end, days):
+        self.orders = orders
+        self.customers = customers
+        self.seed = seed
+        self.end = end
+        self.start = end - timedelta(days=days)
+        self.span = (self.end - self.start).total_seconds()
+        self._builds = None
+
+    def rng(self, table):
+        return random.Random(f"{self.seed}:{table}")
+
+    @property
+    def builds(self):
+        """Seeded pool of (parts, cost) builds, drawn from the catalogue distribution"""
+        if self._builds is None:
+            rng = self.rng("builds")
+            self._builds = [_build(rng) for _ in range(BUILD_POOL_SIZE)]
+        return self._builds
+
+
+def _build(rng):
+    """A plausible build: one part per core category plus optional extras; returns (ids, cost)"""
+    draw = rng.random
+    parts = []
+    cost = 0.0
+    for first, models, price, chance in CATALOGUE.values():
+        if chance < 1.0 and draw() >= chance:
+            continue
+        # Squaring skews picks towards the popular (low-numbered) models
+        offset = int(models * draw() ** 2)
+        parts.append(first + offset)
+        cost += price * (0.6 + 0.8 * offset / models)
+    return parts, round(cost, 2)
+
+
+def _json_list(parts):
+    return "[" + ",".join(map(str, parts)) + "]"
+
+
+def _pg_array(parts):
+    return "{" + ",".join(map(str, parts)) + "}"
+
+
+def _status(rng):
+    roll = rng.random()
+    for status, share in ORDER_STATUSES:
+        if roll < share:
+            return status
+        roll -= share
+    return ORDER_STATUSES[0][0]
+
+
+def _uuid(rng):
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+
+def generate_customers(cfg):
+    rng = cfg.rng("customers")
+    # Sign-ups are spread over the period before and during the order history
+    first_signup = cfg.start - timedelta(days=365)
+    signup_span = (cfg.end - first_signup).total_seconds()
+    for index in range(cfg.customers):
+        created = first_signup + timedelta(seconds=signup_span * index / cfg.customers)
+        yield (
+            customer_id(index),
+            f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+            f"{rng.randint(1, 999)} {rng.choice(STREETS)}, Singapore {rng.randint(100000, 829999)}",
+            f"customer{index}@example.com",
+            created,
+            created,
+        )
+
+
+def _order_customer(rng, cfg):
+    # A minority of customers place most of the orders
+    return customer_id(int(cfg.customers * rng.random() ** 3))
+
+
+def generate_orders(cfg):
+    rng = cfg.rng("orders")
+    parts_lists = [_json_list(parts) for parts, _ in cfg.builds]
+    step = cfg.span / cfg.orders
+    for index in range(cfg.orders):
+        # Timestamps rise with the row number, as they do when orders arrive over time
+        placed = cfg.start + timedelta(seconds=step * index + rng.random() * step)
+        yield (
+            order_id(index),
+            _order_customer(rng, cfg),
+            parts_lists[rng.getrandbits(16)],
+            _status(rng),
+            placed,
+        )
+
+
+def generate_deliveries(cfg):
+    rng = cfg.rng("deliveries")
+    for order in generate_orders(cfg):
+        if order[3] not in SHIPPED:
+            continue
+        created = order[4] + timedelta(hours=rng.uniform(2, 48))
+        yield (
+            _uuid(rng),
+            order[0],
+            order[1],
+            created,
+            created + timedelta(hours=rng.uniform(0, 96)),
+        )
+
+
+def generate_carts(cfg):
+    rng = cfg.rng("carts")
+    for index in range(cfg.customers):
+        for _ in range(rng.choice((0, 0, 1, 1, 1, 2, 3))):
+            parts, cost = cfg.builds[rng.getrandbits(16)]
+            yield (
+                _uuid(rng),
+                customer_id(index),
+                f"Cart {rng.randint(1, 99)}",
+                _pg_array(parts),
+                cost,
+                cfg.start + timedelta(seconds=rng.random() * cfg.span),
+            )
+
+
+def generate_recommendations(cfg):
+    rng = cfg.rng("recommendations")
+    for index in range(cfg.customers):
+        if rng.random() >= 0.5:
+            continue
+        for _ in range(rng.randint(1, 3)):
+            parts, cost = cfg.builds[rng.getrandbits(16)]
+            yield (
+                _uuid(rng),
+                customer_id(index),
+                rng.choice(("Gaming build", "Workstation", "Budget build", "Streaming rig", "Compact build")),
+                cost,
+                _json_list(parts),
+                cfg.start + timedelta(seconds=rng.random() * cfg.span),
+            )
+
+
+GENERATORS = {
+    "customers": generate_customers,
+    "orders": generate_orders,
+    "deliveries": generate_deliveries,
+    "carts": generate_carts,
+    "recommendations": generate_recommendations,
+}
+
+
+def load(cfg, table, dbname=None, batch_size=1000000, truncate=False):
+    """Generate one table and COPY it in, one transaction per batch; returns the row count"""
+    spec = TABLES[table]
+    db_pool = DatabasePool("datagen", db_params(dbname or spec.dbname), minconn=1, maxconn=1)
+    started = time.monotonic()
+    total = 0
+    try:
+        if truncate:
+            with db_pool.cursor() as cursor:
+                cursor.execute(f"TRUNCATE {spec.name}")
+        rows = GENERATORS[table](cfg)
+        while True:
+            # Each batch streams straight from the generator, so memory stays flat
+            loaded, _ = copy_rows(db_pool, spec, itertools.islice(rows, batch_size), validate=False)
+            if not loaded:
+                break
+            total += loaded
+            elapsed = time.monotonic() - started
+            print(f"[datagen] {table}: {total:,} rows ({total / max(elapsed, 1e-6):,.0f} rows/s)", file=sys.stderr)
+    finally:
+        db_pool.close()
+    return total
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m common.datagen", description="Seeded synthetic data generator")
+    parser.add_argument("--orders", type=int, default=1000000)
+    parser.add_argument("--customers", type=int, help="defaults to one customer per ten orders")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--end-date", default="2025-01-01", help="newest order date (ISO); fixed so runs compare")
+    parser.add_argument("--days", type=int, default=365, help="length of the order history")
+    parser.add_argument("--tables", nargs="+", choices=list(GENERATORS), default=list(GENERATORS))
+    parser.add_argument("--batch-size", type=int, default=1000000, help="rows per COPY transaction")
+    parser.add_argument("--truncate", action="store_true", help="empty each table before loading it")
+    args = parser.parse_args(argv)
+
+    cfg = Config(
+        orders=args.orders,
+        customers=args.customers or max(1, args.orders // 10),
+        seed=args.seed,
+        end=datetime.fromisoformat(args.end_date),
+        days=args.days,
+    )
+    try:
+        for table in args.tables:
+            load(cfg, table, batch_size=args.batch_size, truncate=args.truncate)
+    except psycopg2.Error as e:
+        print(f"[datagen] {table} failed: {str(e).strip()}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
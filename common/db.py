@@ -0,0 +1,553 @@
+import os
+import re
+import time
+import logging
+import itertools
+import threading
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import errorcodes
+from psycopg2 import pool as pg_pool
+from psycopg2.extensions import BYTES, TRANSACTION_STATUS_IDLE, connection as pg_connection, register_type
+from psycopg2.extensions import cursor as pg_cursor
+
+from . import serving
+from .sqlstats import SQLStats, TimingCursor
+
+logger = logging.getLogger(__name__)
+
+# Callers that must see their own earlier writes send this header to keep reads on the primary
+READ_AFTER_WRITE_HEADER = "X-Read-After-Write"
+
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+# Seconds since the last replayed transaction, or 0 when the replica has replayed everything it received
+REPLICA_LAG_QUERY = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+
+class PoolTimeout(Exception):
+    """Raised when no pooled connection frees up within the configured wait time"""
+
+
+class PreparingConnection(pg_connection):
+    """Connection that remembers which named statements are prepared in its session"""
+
+    # Set by the pool on every borrow: where TimingCursor reports, and (with DB_TAG_ROUTES) the current application_name
+    sql_stats = None
+    route_tag = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # A reconnect creates a new connection object, so this starts empty and
+        # every statement is prepared again on its first use in the new session.
+        self.prepared = set()
+        # Set when a statement turned out to be stale; everything is deallocated before the next use
+        self.prepared_stale = False
+
+
+class PreparedStatement:
+    """
+    A fixed parameterized query that is PREPAREd once per pooled connection and
+    then run with EXECUTE, so Postgres skips parsing and planning on the hot path.
+    Created through DatabasePool.prepare(); %s placeholders work as in cursor.execute().
+    """
+
+    # Statement gone (e.g. DISCARD ALL) or its cached plan invalidated by a schema change
+    STALE_ERRORS = (errorcodes.INVALID_SQL_STATEMENT_NAME, errorcodes.FEATURE_NOT_SUPPORTED)
+
+    def __init__(self, name, query, enabled=True):
+        self.name = name
+        self.query = query
+        self.enabled = enabled
+        placeholders = itertools.count(1)
+        self.prepare_sql = f"PREPARE {name} AS " + re.sub(r"%s", lambda _: f"${next(placeholders)}", query)
+        count = next(placeholders) - 1
+        self.execute_sql = f"EXECUTE {name}" + (f" ({', '.join(['%s'] * count)})" if count else "")
+
+    def _ensure_prepared(self, conn, cursor):
+        if conn.prepared_stale:
+            cursor.execute("DEALLOCATE PREPARE ALL")
+            conn.prepared.clear()
+            conn.prepared_stale = False
+        if self.name not in conn.prepared:
+            cursor.execute(self.prepare_sql)
+            conn.prepared.add(self.name)
+
+    def execute(self, cursor, params=()):
+        """Run the statement on cursor, preparing it first if this session has not seen it"""
+        conn = cursor.connection
+        if not self.enabled or not isinstance(conn, PreparingConnection):
+            cursor.execute(self.query, params)
+            return
+
+        self._ensure_prepared(conn, cursor)
+        try:
+            cursor.execute(self.execute_sql, params)
+        except psycopg2.Error as e:
+            if e.pgcode not in self.STALE_ERRORS:
+                raise
+            conn.prepared_stale = True
+            # Inside a transaction the failure already aborted it; the next use starts clean
+            if not conn.autocommit:
+                raise
+            self._ensure_prepared(conn, cursor)
+            cursor.execute(self.execute_sql, params)
+
+
+class Replica:
+    """A read replica: its own pool plus the health and lag state used for routing"""
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.host = pool.db_params["host"]
+        self.port = pool.db_params["port"]
+        # Skipped until this monotonic time after a connection failure
+        self.down_until = 0.0
+        self.lag = None
+        self.lag_checked_at = 0.0
+
+    def describe(self):
+        stats = self.pool.stats()
+        return {
+            "host": f"{self.host}:{self.port}",
+            "available": time.monotonic() >= self.down_until,
+            "lag_s": self.lag,
+            "borrows": stats["borrows"],
+            "open": stats["open"],
+            "in_use": stats["in_use"],
+        }
+
+
+class DatabasePool:
+    """
+    Bounded, thread-safe PostgreSQL connection pool shared by the data services.
+
+    The underlying ThreadedConnectionPool is created lazily the first time a
+    connection is borrowed in a process, and rebuilt if the process id changes,
+    so every forked worker gets its own sockets instead of sharing the parent's.
+    Connections run in autocommit mode so a single-statement read costs exactly
+    one round trip; multi-statement writes go through transaction().
+
+    When DB_REPLICA_HOSTS lists read replicas (host[:port], comma separated),
+    read_cursor() spreads read-only handlers across them round-robin, skipping
+    replicas that are down or lag more than DB_REPLICA_MAX_LAG seconds and
+    falling back to the primary when none qualify. A replica whose pool stays
+    full for DB_REPLICA_POOL_TIMEOUT seconds is passed over for that read only.
+    """
+
+    def __init__(self, service, db_params, minconn=None, maxconn=None,
+                 wait_timeout=None, health_check_after=None, replica_hosts=None, sql_stats=None):
+        self.service = service
+        self.db_params = dict(db_params)
+        self.db_params.setdefault("application_name", service)
+        self.db_params.setdefault("connect_timeout", int(os.getenv("DB_CONNECT_TIMEOUT", 5)))
+        self.db_params.setdefault("connection_factory", PreparingConnection)
+        self.db_params.setdefault("cursor_factory", TimingCursor)
+
+        self.minconn = minconn if minconn is not None else int(os.getenv("DB_POOL_MIN", 1))
+        self.maxconn = maxconn if maxconn is not None else int(os.getenv("DB_POOL_MAX", 10))
+        # Seconds a request may wait for a free connection before giving up
+        self.wait_timeout = wait_timeout if wait_timeout is not None else float(os.getenv("DB_POOL_TIMEOUT", 5))
+        # Connections idle longer than this are pinged with SELECT 1 before reuse
+        self.health_check_after = (health_check_after if health_check_after is not None
+                                   else float(os.getenv("DB_POOL_HEALTH_CHECK_AFTER", 30)))
+        # Rows fetched per round trip by server-side cursors in stream()
+        self.stream_itersize = int(os.getenv("DB_STREAM_ITERSIZE", 2000))
+        # Turn off behind poolers that do not keep server-side sessions (PgBouncer transaction mode)
+        self.prepare_statements = os.getenv("DB_PREPARE_STATEMENTS", "True").lower() in ('true', '1', 't')
+        self._statements = {}
+
+        # Statement timings behind /debug/sql-stats, shared with the replica pools
+        self.sql_stats = sql_stats or SQLStats(service)
+        self.collect_sql_stats = os.getenv("DB_SQL_STATS", "True").lower() in ('true', '1', 't')
+        # Opt-in: application_name becomes "<service>:<flask endpoint>" so pg_stat_activity shows
+        # the route, at the cost of a set_config round trip on borrows where the route changes
+        self.tag_routes = os.getenv("DB_TAG_ROUTES", "False").lower() in ('true', '1', 't')
+
+        # Replicas further behind than this many seconds are not read from
+        self.replica_max_lag = float(os.getenv("DB_REPLICA_MAX_LAG", 5))
+        # How often a replica's lag is re-measured, and how long a failed replica is skipped
+        self.replica_lag_check_interval = float(os.getenv("DB_REPLICA_LAG_CHECK_INTERVAL", 5))
+        self.replica_retry_after = float(os.getenv("DB_REPLICA_RETRY_AFTER", 30))
+        # Seconds a read waits for a busy replica's pool before trying the next replica or the primary
+        self.replica_wait_timeout = float(os.getenv("DB_REPLICA_POOL_TIMEOUT", 0.05))
+        if replica_hosts is None:
+            replica_hosts = [h.strip() for h in os.getenv("DB_REPLICA_HOSTS", "").split(",") if h.strip()]
+        self.replicas = [self._build_replica(h) for h in replica_hosts]
+        self._replica_turn = itertools.count()
+        self._cursor_ids = itertools.count(1)
+
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._pool = None
+        self._pid = None
+        self._slots = None
+        self._returned_at = {}
+        self._reset_stats()
+        # Used only by ping(), owned by the process that opened it
+        self._ping_conn = None
+        self._ping_pid = None
+
+    def _build_replica(self, address):
+        host, _, port = address.partition(":")
+        params = dict(self.db_params, host=host, port=port or self.db_params.get("port"))
+        return Replica(DatabasePool(self.service, params, self.minconn, self.maxconn,
+                                    self.replica_wait_timeout, self.health_check_after,
+                                    replica_hosts=(), sql_stats=self.sql_stats))
+
+    def _reset_stats(self):
+        self._stats = {
+            "borrows": 0,
+            "waits": 0,
+            "timeouts": 0,
+            "discarded": 0,
+            "total_wait_ms": 0.0,
+            "max_wait_ms": 0.0,
+        }
+
+    def _ensure_pool(self):
+        """Create the pool for the current process on first use (per-worker init)"""
+        pid = os.getpid()
+        if self._pool is not None and self._pid == pid:
+            return self._pool
+
+        with self._lock:
+            if self._pool is None or self._pid != pid:
+                if self._pool is not None:
+                    # Inherited from the parent across a fork; closing those sockets here
+                    # would terminate the parent's sessions, so just drop the references.
+                    logger.info(f"[{self.service}] process forked, building a fresh connection pool")
+                self._pool = pg_pool.ThreadedConnectionPool(self.minconn, self.maxconn, **self.db_params)
+                self._slots = threading.BoundedSemaphore(self.maxconn)
+                self._returned_at = {}
+                self._reset_stats()
+                self._pid = pid
+        return self._pool
+
+    def _is_healthy(self, conn):
+        """Cheap liveness check; only pings connections that sat idle for a while"""
+        if conn.closed:
+            return False
+        returned_at = self._returned_at.get(id(conn))
+        if returned_at is None or time.monotonic() - returned_at < self.health_check_after:
+            return True
+        try:
+            with conn.cursor(cursor_factory=pg_cursor) as cursor:
+                cursor.execute("SELECT 1")
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self):
+        """Borrow a connection, waiting up to wait_timeout seconds for a free slot"""
+        pool = self._ensure_pool()
+        started = time.monotonic()
+        if not self._slots.acquire(timeout=self.wait_timeout):
+            with self._stats_lock:
+                self._stats["timeouts"] += 1
+            raise PoolTimeout(
+                f"No database connection available for '{self.service}' after {self.wait_timeout}s"
+            )
+        waited_ms = (time.monotonic() - started) * 1000
+
+        try:
+            conn = pool.getconn()
+            if not self._is_healthy(conn):
+                with self._stats_lock:
+                    self._stats["discarded"] += 1
+                self._returned_at.pop(id(conn), None)
+                pool.putconn(conn, close=True)
+                conn = pool.getconn()
+            if not conn.autocommit:
+                conn.autocommit = True
+            conn.sql_stats = self.sql_stats if self.collect_sql_stats else None
+            if self.tag_routes:
+                self._tag_route(conn)
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._stats_lock:
+            self._stats["borrows"] += 1
+            self._stats["total_wait_ms"] += waited_ms
+            if waited_ms >= 1:
+                self._stats["waits"] += 1
+            if waited_ms > self._stats["max_wait_ms"]:
+                self._stats["max_wait_ms"] = waited_ms
+        return conn
+
+    def _tag_route(self, conn):
+        """Name the session after the service and Flask endpoint; costs a round trip only when it changes"""
+        from flask import has_request_context, request
+        tag = self.service
+        if has_request_context() and request.endpoint:
+            tag = f"{self.service}:{request.endpoint}"
+        if conn.route_tag != tag:
+            # Plain cursor, so the tagging itself does not show up in the SQL stats
+            with conn.cursor(cursor_factory=pg_cursor) as cursor:
+                cursor.execute("SELECT set_config('application_name', %s, false)", (tag,))
+            conn.route_tag = tag
+
+    def putconn(self, conn, close=False):
+        """Return a borrowed connection, discarding it if it is broken"""
+        pool = self._pool
+        try:
+            if not conn.closed and conn.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+        except psycopg2.Error:
+            close = True
+
+        close = close or bool(conn.closed)
+        if close:
+            with self._stats_lock:
+                self._stats["discarded"] += 1
+            self._returned_at.pop(id(conn), None)
+        else:
+            self._returned_at[id(conn)] = time.monotonic()
+
+        try:
+            pool.putconn(conn, close=close)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection for the duration of the with-block"""
+        conn = self.getconn()
+        broken = False
+        try:
+            yield conn
+        except psycopg2.OperationalError:
+            broken = True
+            raise
+        finally:
+            self.putconn(conn, close=broken)
+
+    @contextmanager
+    def cursor(self):
+        """Borrow a connection and yield an autocommit cursor on it"""
+        with self.connection() as conn:
+            with conn.cursor() as cursor:
+                yield cursor
+
+    @contextmanager
+    def transaction(self):
+        """Yield a cursor inside a transaction that commits on success and rolls back on error"""
+        with self.connection() as conn:
+            conn.autocommit = False
+            try:
+                with conn.cursor() as cursor:
+                    yield cursor
+                conn.commit()
+            except Exception:
+                if not conn.closed:
+                    conn.rollback()
+                raise
+            finally:
+                if not conn.closed:
+                    conn.autocommit = True
+
+    def _reads_from_primary(self):
+        """Writes, and reads that must observe earlier writes, stay on the primary"""
+        if not self.replicas:
+            return True
+        from flask import has_request_context, request
+        if not has_request_context():
+            return False
+        # Any read made while handling a write must see that write
+        if request.method not in SAFE_METHODS:
+            return True
+        return request.headers.get(READ_AFTER_WRITE_HEADER, "").lower() in ('true', '1', 't')
+
+    def _replica_connection(self):
+        """Borrow a connection from the next usable replica, or return (None, None)"""
+        for _ in range(len(self.replicas)):
+            replica = self.replicas[next(self._replica_turn) % len(self.replicas)]
+            if time.monotonic() < replica.down_until:
+                continue
+            try:
+                conn = replica.pool.getconn()
+            except PoolTimeout:
+                # Busy, not broken: this read goes elsewhere and the replica stays in rotation
+                continue
+            except psycopg2.Error as e:
+                logger.warning(f"[{self.service}] replica {replica.host} unavailable: {str(e)}")
+                replica.down_until = time.monotonic() + self.replica_retry_after
+                continue
+
+            if time.monotonic() - replica.lag_checked_at >= self.replica_lag_check_interval:
+                try:
+                    with conn.cursor() as cursor:
+                        cursor.execute(REPLICA_LAG_QUERY)
+                        replica.lag = float(cursor.fetchone()[0])
+                    replica.lag_checked_at = time.monotonic()
+                except psycopg2.Error as e:
+                    logger.warning(f"[{self.service}] replica {replica.host} failed its lag check: {str(e)}")
+                    replica.pool.putconn(conn, close=True)
+                    replica.down_until = time.monotonic() + self.replica_retry_after
+                    continue
+
+            if replica.lag is not None and replica.lag > self.replica_max_lag:
+                replica.pool.putconn(conn)
+                continue
+            return conn, replica
+        return None, None
+
+    @contextmanager
+    def read_cursor(self, primary=False):
+        """
+        Cursor for read-only queries: on a healthy, caught-up replica when replicas
+        are configured and the current request allows it, otherwise on the primary.
+        primary=True forces the primary, e.g. for results that are about to be cached.
+        """
+        use_primary = primary or self._reads_from_primary()
+        conn, replica = (None, None) if use_primary else self._replica_connection()
+        if conn is None:
+            with self.cursor() as cursor:
+                yield cursor
+            return
+
+        broken = False
+        try:
+            with conn.cursor() as cursor:
+                yield cursor
+        except psycopg2.OperationalError:
+            broken = True
+            replica.down_until = time.monotonic() + self.replica_retry_after
+            raise
+        finally:
+            replica.pool.putconn(conn, close=broken)
+
+    def prepare(self, name, query):
+        """Register a hot query to run as a per-connection prepared statement"""
+        if name in self._statements and self._statements[name].query != query:
+            raise ValueError(f"Prepared statement '{name}' is already registered with a different query")
+        statement = PreparedStatement(name, query, enabled=self.prepare_statements)
+        self._statements[name] = statement
+        return statement
+
+    def fetch_json(self, query, params=None, primary=False):
+        """
+        Run a read-only query whose only column is an already rendered JSON document
+        (cast to text) and return it as raw bytes, or None when no row comes back.
+        Nothing is decoded or re-encoded in Python.
+        """
+        row = self.fetch_json_row(query, params, primary)
+        return row[0] if row else None
+
+    def fetch_json_row(self, query, params=None, primary=False):
+        """Like fetch_json, for queries selecting more columns (e.g. a row version); returns the row as bytes"""
+        with self.read_cursor(primary=primary) as cursor:
+            register_type(BYTES, cursor)
+            cursor.execute(query, params)
+            return cursor.fetchone()
+
+    def stream(self, query, params=None, itersize=None):
+        """
+        Yield rows through a named (server-side) cursor, itersize rows per round trip,
+        so memory stays flat regardless of table size. The connection is held until
+        the generator is exhausted or closed.
+        """
+        with self.connection() as conn:
+            # Named cursors only live inside a transaction
+            conn.autocommit = False
+            try:
+                with conn.cursor(name=f"stream_{next(self._cursor_ids)}") as cursor:
+                    cursor.itersize = itersize or self.stream_itersize
+                    cursor.execute(query, params)
+                    for row in cursor:
+                        yield row
+            finally:
+                if not conn.closed:
+                    conn.rollback()
+                    conn.autocommit = True
+
+    def ping(self):
+        """
+        Round trip to the primary; raises when it is unreachable. Goes over a
+        connection of its own rather than the pool, so a pool busy with requests
+        never makes the health check wait or fail.
+        """
+        pid = os.getpid()
+        conn = self._ping_conn
+        if conn is None or conn.closed or self._ping_pid != pid:
+            # One inherited across a fork is the parent's session; drop it without closing
+            params = dict(self.db_params, application_name=f"{self.service}:health",
+                          connection_factory=pg_connection, cursor_factory=pg_cursor)
+            conn = self._ping_conn = psycopg2.connect(**params)
+            conn.autocommit = True
+            self._ping_pid = pid
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+        except psycopg2.Error:
+            conn.close()
+            raise
+
+    def stats(self):
+        """Snapshot of pool size and wait-time statistics for this worker"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        pool = self._pool
+        idle = len(pool._pool) if pool is not None and self._pid == os.getpid() else 0
+        in_use = len(pool._used) if pool is not None and self._pid == os.getpid() else 0
+        stats["total_wait_ms"] = round(stats["total_wait_ms"], 3)
+        stats["max_wait_ms"] = round(stats["max_wait_ms"], 3)
+        stats["avg_wait_ms"] = round(stats["total_wait_ms"] / stats["borrows"], 3) if stats["borrows"] else 0.0
+        stats.update({
+            "service": self.service,
+            "pid": os.getpid(),
+            "minconn": self.minconn,
+            "maxconn": self.maxconn,
+            "open": idle + in_use,
+            "idle": idle,
+            "in_use": in_use,
+        })
+        if self.replicas:
+            stats["replicas"] = [replica.describe() for replica in self.replicas]
+        return stats
+
+    def close(self):
+        """Close every connection owned by this process"""
+        with self._lock:
+            if self._pool is not None and self._pid == os.getpid():
+                self._pool.closeall()
+            self._pool = None
+            self._pid = None
+        for replica in self.replicas:
+            replica.pool.close()
+
+    def init_app(self, app):
+        """
+        Expose the pool statistics at /debug/db-pool and per-statement latencies at
+        /debug/sql-stats (see profiling.add_debug_route), and under gunicorn open the pool in each worker rather than
+        keeping the master's connections around.
+        """
+        from flask import jsonify
+
+        from .profiling import add_debug_route
+
+        serving.before_fork(self.close)
+        serving.after_fork(self._ensure_pool)
+
+        def db_pool_stats():
+            return jsonify({
+                "code": 200,
+                "data": self.stats()
+            }), 200
+
+        def sql_stats():
+            return jsonify({
+                "code": 200,
+                "data": self.sql_stats.snapshot()
+            }), 200
+
+        add_debug_route(app, "/debug/db-pool", "db_pool_stats", db_pool_stats)
+        add_debug_route(app, "/debug/sql-stats", "sql_stats", sql_stats)
@@ -0,0 +1,43 @@
+"""
+Conditional GETs for single-entity reads, with ETags taken from the row version.
+
+Postgres gives every row version its own xmin (the id of the transaction that
+wrote it), so xmin::text changes whenever the row does and serves as a strong
+ETag without a version column. A client sending If-None-Match is answered from
+a version-only lookup: a 304 when its copy is current, before anything is
+fetched in full or serialized.
+"""
+from flask import Response, request
+
+# Select this next to the entity's columns to get its ETag
+VERSION_COLUMN = "xmin::text"
+
+
+def tag(response, version):
+    """Set the strong ETag for version on response"""
+    response.set_etag(str(version))
+    return response
+
+
+def not_modified(version):
+    """A 304 response when If-None-Match already names version, otherwise None"""
+    # Weak comparison, as RFC 9110 requires for If-None-Match; compressed copies carry a weak tag
+    if version is not None and request.if_none_match.contains_weak(str(version)):
+        return tag(Response(status=304), version)
+    return None
+
+
+def revalidate(pool, statement, key, primary=False):
+    """
+    For a request carrying If-None-Match, look up only the row version with
+    statement (a PreparedStatement selecting VERSION_COLUMN by key) and return
+    a 304 when the client's copy is current. Returns None when the request is
+    not conditional, the copy is stale or the row is gone; the caller's full
+    fetch then answers.
+    """
+    if not request.if_none_match:
+        return None
+    with pool.read_cursor(primary=primary) as cursor:
+        statement.execute(cursor, (key,))
+        row = cursor.fetchone()
+    return not_modified(row[0]) if row else None
@@ -0,0 +1,48 @@
+"""
+Shared gunicorn settings for the Flask services, run from the service directory:
+
+  gunicorn -c common/gunicorn_conf.py app:app        (in the containers)
+  gunicorn -c ../common/gunicorn_conf.py app:app     (from a checkout)
+
+Everything is tuned through environment variables so one file serves every
+service: PORT, GUNICORN_WORKERS (2 x cores + 1), GUNICORN_THREADS (4),
+GUNICORN_PRELOAD (True), GUNICORN_TIMEOUT (30), GUNICORN_MAX_REQUESTS (0, never
+recycle) and GUNICORN_LOG_LEVEL (info).
+"""
+import os
+import sys
+import tempfile
+import multiprocessing
+
+# The hooks below import common.serving, also when the app has not been imported yet
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Workers share their metric snapshots here (common/metrics.py); one fresh directory per server run
+os.environ.setdefault("METRICS_DIR", tempfile.mkdtemp(prefix="metrics-"))
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv("GUNICORN_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+# Requests mostly wait on Postgres or other services, so each worker also runs a few threads
+threads = int(os.getenv("GUNICORN_THREADS", 4))
+worker_class = "gthread"
+# Import the app (and run migrations) once in the master instead of once per worker
+preload_app = os.getenv("GUNICORN_PRELOAD", "True").lower() in ('true', '1', 't')
+
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 30))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", 30))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", 5))
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", 0))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", 50)) if max_requests else 0
+
+accesslog = "-"
+errorlog = "-"
+loglevel = os.getenv("GUNICORN_LOG_LEVEL", "info")
+
+
+def pre_fork(server, worker):
+    from common import serving
+    serving.run_before_fork()
+
+
+def post_worker_init(worker):
+    from common import serving
+    serving.run_after_fork()
@@ -0,0 +1,152 @@
+"""
+Dependency health checks run in the background and served from memory.
+
+Each service registers its dependencies with a HealthMonitor:
+
+    health_monitor = health.HealthMonitor("stripe")
+    health_monitor.add_check("broker", ping_broker)
+    health_monitor.add_check("stripe_api", health.http("https://api.stripe.com"), critical=False)
+    health_monitor.init_app(app)
+
+A thread per worker runs every check each HEALTH_CHECK_INTERVAL seconds and
+keeps the latest outcome, latency and time of each. A check is a callable that
+raises (or returns False) when the dependency is unusable. Probes only read
+that snapshot, so they answer immediately and never touch a dependency:
+
+  GET /health   200 while the process serves; the snapshot, "degraded" when any check is down
+  GET /ready    200 when every critical check is up and recent, 503 otherwise
+
+Non-critical checks (downstream services, external APIs) are reported but do
+not take the instance out of rotation; results older than three intervals
+count as down, in case the monitor itself is stuck.
+"""
+import os
+import time
+import logging
+import threading
+import urllib.error
+import urllib.request
+from urllib.parse import urlsplit
+
+from flask import jsonify
+
+from . import serving
+
+INTERVAL = float(os.getenv("HEALTH_CHECK_INTERVAL", 15))
+TIMEOUT = float(os.getenv("HEALTH_CHECK_TIMEOUT", 2))
+
+logger = logging.getLogger(__name__)
+
+
+def http(url, timeout=TIMEOUT):
+    """Check that url answers at all; any status below 500 means reachable"""
+    def check():
+        try:
+            with urllib.request.urlopen(url, timeout=timeout) as response:
+                response.read(0)
+        except urllib.error.HTTPError as e:
+            if e.code >= 500:
+                raise
+    return check
+
+
+def service_url(url, path="/health"):
+    """path (by default the /health endpoint) on the host url points to"""
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}{path}"
+
+
+class HealthMonitor:
+    def __init__(self, service, interval=INTERVAL):
+        self.service = service
+        self.interval = interval
+        # name -> (check, critical)
+        self._checks = {}
+        # name -> latest result; replaced as a whole so readers never see a partial update
+        self._results = {}
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def add_check(self, name, check, critical=True):
+        self._checks[name] = (check, critical)
+
+    def run_checks(self):
+        """Run every check once and publish the results"""
+        results = {}
+        for name, (check, critical) in self._checks.items():
+            started = time.perf_counter()
+            error = None
+            try:
+                if check() is False:
+                    error = "check failed"
+            except Exception as e:
+                error = str(e) or type(e).__name__
+            results[name] = {
+                "status": "up" if error is None else "down",
+                "critical": critical,
+                "latency_ms": round((time.perf_counter() - started) * 1000, 1),
+                "checked_at": time.time(),
+                "error": error,
+            }
+            if error is not None and self._results.get(name, {}).get("status") != "down":
+                logger.warning("[%s] %s check failed: %s", self.service, name, error)
+        self._results = results
+        return results
+
+    def _run(self):
+        while True:
+            self.run_checks()
+            time.sleep(self.interval)
+
+    def start(self):
+        """Start this process's monitor thread unless it is running"""
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid != pid:
+                self._results = {}
+                threading.Thread(target=self._run, name="health-monitor", daemon=True).start()
+                self._pid = pid
+
+    def snapshot(self):
+        """(ready, status, results) from the latest run"""
+        results = self._results
+        stale_before = time.time() - 3 * self.interval
+        ready = bool(results) or not self._checks
+        degraded = False
+        for name, result in results.items():
+            down = result["status"] != "up" or result["checked_at"] < stale_before
+            degraded = degraded or down
+            if down and result["critical"]:
+                ready = False
+        if not results and self._checks:
+            status = "starting"
+        elif not ready:
+            status = "unhealthy"
+        else:
+            status = "degraded" if degraded else "healthy"
+        return ready, status, results
+
+    def health(self):
+        # Outside gunicorn no after_fork hook starts the thread; the first probe does
+        self.start()
+        ready, status, results = self.snapshot()
+        return jsonify({
+            "code": 200,
+            "data": {"service": self.service, "status": status, "checks": results}
+        }), 200
+
+    def ready(self):
+        self.start()
+        ready, status, results = self.snapshot()
+        code = 200 if ready else 503
+        return jsonify({
+            "code": code,
+            "data": {"service": self.service, "status": status, "checks": results}
+        }), code
+
+    def init_app(self, app):
+        app.add_url_rule("/health", "health", self.health, methods=["GET"])
+        app.add_url_rule("/ready", "ready", self.ready, methods=["GET"])
+        serving.after_fork(self.start)
@@ -0,0 +1,98 @@
+"""
+Pooled keep-alive HTTP client for calls between services and to external APIs.
+
+requests.request() builds a throwaway Session per call, so every hop paid a
+TCP (and for OutSystems and Stripe, TLS) handshake and nothing bounded how
+long it could hang. request() below goes through one Session per process:
+
+  - connections are kept alive in a pool per host, HTTP_POOL_SIZE connections
+    each (default GUNICORN_THREADS, or 10), overridden per host with
+    HTTP_POOL_SIZES, e.g. "personal-0careuf6.outsystemscloud.com=16,customer:5001=4"
+  - calls without an explicit timeout get (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+    seconds, 3.05 and 30 by default
+  - idempotent methods (GET, HEAD, PUT, DELETE, OPTIONS) are retried up to
+    HTTP_RETRIES times (2) on connection errors and 502/503/504 responses, after
+    HTTP_RETRY_BACKOFF (0.2) x 2^n seconds or the server's Retry-After; POST never is
+
+The session sends no cookies, so threads serving different users cannot leak
+state into each other through it, and is rebuilt after a fork so workers never
+share the master's sockets.
+"""
+import os
+import threading
+from http.cookiejar import DefaultCookiePolicy
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", os.getenv("GUNICORN_THREADS", 10)))
+POOL_SIZES = os.getenv("HTTP_POOL_SIZES", "")
+CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", 3.05))
+READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", 30))
+RETRIES = int(os.getenv("HTTP_RETRIES", 2))
+RETRY_BACKOFF = float(os.getenv("HTTP_RETRY_BACKOFF", 0.2))
+
+RETRY_METHODS = frozenset(["GET", "HEAD", "PUT", "DELETE", "OPTIONS"])
+RETRY_STATUSES = (502, 503, 504)
+
+_lock = threading.Lock()
+_session = None
+_pid = None
+
+
+def _adapter(pool_size):
+    retry = Retry(total=RETRIES, backoff_factor=RETRY_BACKOFF, status_forcelist=RETRY_STATUSES,
+                  allowed_methods=RETRY_METHODS, raise_on_status=False)
+    # pool_connections is how many hosts keep a pool; there are only a handful of downstreams
+    return HTTPAdapter(pool_connections=20, pool_maxsize=pool_size, max_retries=retry)
+
+
+def parse_pool_sizes(value):
+    """{"host[:port]": size} from "host[:port]=size,..." """
+    sizes = {}
+    for entry in value.split(","):
+        host, _, size = entry.strip().rpartition("=")
+        if host and size.isdigit():
+            sizes[host.lower()] = int(size)
+    return sizes
+
+
+def _build():
+    session = requests.Session()
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    default = _adapter(POOL_SIZE)
+    session.mount("http://", default)
+    session.mount("https://", default)
+    for host, size in parse_pool_sizes(POOL_SIZES).items():
+        adapter = _adapter(size)
+        # The longest matching prefix wins, so these take precedence over the defaults
+        session.mount(f"http://{host}", adapter)
+        session.mount(f"https://{host}", adapter)
+    return session
+
+
+def session():
+    """This process's shared Session"""
+    global _session, _pid
+    pid = os.getpid()
+    if _pid != pid:
+        with _lock:
+            if _pid != pid:
+                _session = _build()
+                _pid = pid
+    return _session
+
+
+def request(method, url, **kwargs):
+    """requests.request() over the shared pool, with the default timeouts unless timeout is given"""
+    kwargs.setdefault("timeout", (CONNECT_TIMEOUT, READ_TIMEOUT))
+    return session().request(method, url, **kwargs)
+
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+def put(url, **kwargs):
+    return request("PUT", url, **kwargs)
@@ -0,0 +1,101 @@
+"""
+Faster JSON for the Flask apps: orjson when it is installed, the stdlib otherwise.
+
+Both paths render datetime/date/time as ISO 8601, Decimal as a JSON number and
+UUID as its canonical string, so handlers can put database rows into responses
+without converting each value first. Output otherwise matches Flask's default
+provider: sorted keys, compact separators, trailing newline.
+"""
+import uuid
+import decimal
+from datetime import date, datetime, time
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    from flask.json.provider import DefaultJSONProvider
+except ImportError:
+    # Flask < 2.2 (scenario3 pins 2.0.1) has no providers; init_app sets a JSONEncoder instead
+    DefaultJSONProvider = None
+
+# OPT_NON_STR_KEYS: accept int keys the way json.dumps does
+ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS if orjson is not None else 0
+
+
+def default(o):
+    """Encode the types the database driver hands back that JSON has no native form for"""
+    if isinstance(o, (datetime, date, time)):
+        return o.isoformat()
+    if isinstance(o, decimal.Decimal):
+        return float(o)
+    if isinstance(o, uuid.UUID):
+        return str(o)
+    if hasattr(o, "__html__"):
+        return str(o.__html__())
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+def _orjson_dumps(obj, sort_keys):
+    options = ORJSON_OPTIONS | (orjson.OPT_SORT_KEYS if sort_keys else 0)
+    return orjson.dumps(obj, default=default, option=options)
+
+
+if DefaultJSONProvider is not None:
+    class FastJSONProvider(DefaultJSONProvider):
+        """
+        Drop-in replacement for Flask's DefaultJSONProvider. Calls with extra
+        json.dumps arguments (indent, cls, ...), values orjson rejects (e.g.
+        integers beyond 64 bits) and pretty-printed debug responses take the
+        stdlib path.
+        """
+
+        default = staticmethod(default)
+
+        def dumps(self, obj, **kwargs):
+            if orjson is not None and not kwargs:
+                try:
+                    return _orjson_dumps(obj, self.sort_keys).decode()
+                except TypeError:
+                    pass
+            return super().dumps(obj, **kwargs)
+
+        def loads(self, s, **kwargs):
+            if orjson is not None and not kwargs:
+                return orjson.loads(s)
+            return super().loads(s, **kwargs)
+
+        def response(self, *args, **kwargs):
+            obj = self._prepare_response_obj(args, kwargs)
+            pretty = self.compact is False or (self.compact is None and self._app.debug)
+            if orjson is not None and not pretty:
+                try:
+                    body = _orjson_dumps(obj, self.sort_keys) + b"\n"
+                    return self._app.response_class(body, mimetype=self.mimetype)
+                except TypeError:
+                    pass
+            return super().response(obj)
+else:
+    FastJSONProvider = None
+
+    from flask.json import JSONEncoder
+
+    class _Encoder(JSONEncoder):
+        """Older Flask: same value encoding through the app's json_encoder hook"""
+
+        def default(self, o):
+            try:
+                return default(o)
+            except TypeError:
+                return super().default(o)
+
+
+def init_app(app):
+    """Use the fast provider for jsonify(), request.get_json() and app.json on app"""
+    if FastJSONProvider is not None:
+        app.json = FastJSONProvider(app)
+    else:
+        app.json_encoder = _Encoder
+    return app
@@ -0,0 +1,154 @@
+"""
+Structured logging shared by the services: JSON lines on stdout, written off the request thread.
+
+setup(service) replaces whatever handlers the root logger has with one that
+queues records for a per-process background thread, which formats each as
+
+  {"ts": "2024-05-01T12:00:00.123Z", "level": "INFO", "service": "make_purchase",
+   "logger": "invokes", "message": "GET customer -> 200", "trace_id": "...", ...}
+
+plus any extra={...} fields. Log with %-style arguments, never f-strings:
+records below LOG_LEVEL are then dropped before anything is formatted, and
+enabled ones are formatted on the background thread. Request and response
+bodies go through body(), which logs only a LOG_BODY_SAMPLE_RATE fraction of
+them and cuts each to LOG_BODY_LIMIT characters, decoding nothing until the
+line is written.
+
+Settings: LOG_LEVEL (the service's default, usually INFO), LOG_FORMAT (json, or
+text for local runs), LOG_BODY_LIMIT (512), LOG_BODY_SAMPLE_RATE (1.0) and
+LOG_ASYNC (True; False writes on the calling thread).
+"""
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import random
+import logging
+import threading
+import logging.handlers
+
+BODY_LIMIT = int(os.getenv("LOG_BODY_LIMIT", 512))
+BODY_SAMPLE_RATE = float(os.getenv("LOG_BODY_SAMPLE_RATE", 1.0))
+FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+ASYNC = os.getenv("LOG_ASYNC", "True").lower() in ('true', '1', 't')
+
+# Attributes every LogRecord has; anything else on a record came in through extra=
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class Body:
+    """A request or response body, decoded and cut to limit characters only when the line is written"""
+
+    __slots__ = ("value", "limit")
+
+    def __init__(self, value, limit=BODY_LIMIT):
+        self.value = value
+        self.limit = limit
+
+    def __str__(self):
+        value = self.value
+        if isinstance(value, (bytes, bytearray)):
+            text = bytes(value[:self.limit * 4]).decode("utf-8", errors="replace")
+        elif isinstance(value, str):
+            text = value
+        else:
+            text = json.dumps(value, default=str)
+        if len(text) > self.limit:
+            return f"{text[:self.limit]}... ({len(text) - self.limit}+ more)"
+        return text
+
+
+def body(value, limit=BODY_LIMIT):
+    """Wrap a body (str, bytes or JSON-able value) for logging as a %s argument"""
+    if BODY_SAMPLE_RATE < 1.0 and random.random() >= BODY_SAMPLE_RATE:
+        return "[body not sampled]"
+    return Body(value, limit)
+
+
+class JSONFormatter(logging.Formatter):
+    def __init__(self, service):
+        super().__init__()
+        self.service = service
+
+    def format(self, record):
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "service": self.service,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class _TraceFilter(logging.Filter):
+    """Stamp records with the active trace so log lines can be joined with spans"""
+
+    def filter(self, record):
+        from . import tracing
+        active = tracing.current()
+        if active is not None:
+            record.trace_id = active.context.trace_id
+            record.span_id = active.context.span_id
+        return True
+
+
+class _AsyncHandler(logging.handlers.QueueHandler):
+    """
+    Queues records for a listener thread owned by the current process; the
+    thread is (re)started on first use after a fork, so gunicorn workers log
+    even when setup() ran in the master.
+    """
+
+    def __init__(self, target):
+        super().__init__(queue.SimpleQueue())
+        self.target = target
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def prepare(self, record):
+        # Unlike the stdlib handler, leave formatting to the listener thread
+        return record
+
+    def emit(self, record):
+        if self._pid != os.getpid():
+            self._start()
+        super().emit(record)
+
+    def _start(self):
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self.queue = queue.SimpleQueue()
+            listener = logging.handlers.QueueListener(self.queue, self.target, respect_handler_level=True)
+            listener.start()
+            atexit.register(listener.stop)
+            self._pid = os.getpid()
+
+
+def setup(service, level="INFO"):
+    """Route this process's logging through the structured handler; LOG_LEVEL overrides level"""
+    stream = logging.StreamHandler(sys.stdout)
+    if FORMAT == "text":
+        stream.setFormatter(logging.Formatter(f"%(asctime)s [%(levelname)s] {service} %(name)s: %(message)s"))
+    else:
+        stream.setFormatter(JSONFormatter(service))
+    handler = _AsyncHandler(stream) if ASYNC else stream
+    # The trace is per thread, so it has to be read before the record changes threads
+    handler.addFilter(_TraceFilter())
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(os.getenv("LOG_LEVEL", level).upper())
+    # Connection chatter from the AMQP client is only interesting when it fails
+    logging.getLogger("pika").setLevel(logging.WARNING)
+    return root
@@ -0,0 +1,359 @@
+"""
+Prometheus metrics for the Flask services, served at /metrics in the text exposition format.
+
+init_app(app) records, per worker:
+
+  http_request_duration_seconds{method,route,status}     histogram (its _count is the request count)
+  http_requests_in_flight                                 gauge
+  outbound_request_duration_seconds{downstream,method,status}
+                                                          histogram, fed by outbound() around remote calls
+  db_pool_*{pool,database}                                connection pool gauges and counters
+
+Recording is a bisect and a few list increments under a lock; nothing is
+formatted until /metrics is scraped. Under gunicorn every worker keeps its own
+numbers, so each one also writes a snapshot to METRICS_DIR (a fresh directory
+per server run, set in common/gunicorn_conf.py) every METRICS_FLUSH_INTERVAL
+seconds, and /metrics sums the snapshots of all workers. Counters and
+histograms of exited workers stay in the sum so totals never go backwards;
+gauges only count live workers.
+"""
+import os
+import json
+import time
+import atexit
+import bisect
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
+from urllib.parse import urlsplit
+
+from flask import Response, g, request
+
+from . import serving
+
+ENABLED = os.getenv("METRICS_ENABLED", "True").lower() in ('true', '1', 't')
+FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", 5))
+# Seconds; wide enough for an orchestration that chains several remote calls
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Remote hosts by the name they are reported under; anything else is reported as host:port
+DOWNSTREAM_HOSTS = {
+    "customer": "customer",
+    "order": "order",
+    "delivery": "delivery",
+    "recommendation": "recommendation",
+    "cart": "cart",
+    "stripe": "stripe",
+    "api.stripe.com": "stripe_api",
+    "api.sendgrid.com": "sendgrid",
+}
+DOWNSTREAM_SUFFIXES = {
+    ".outsystemscloud.com": "outsystems",
+}
+# Local runs reach the services on localhost through their published ports
+DOWNSTREAM_PORTS = {
+    5000: "stripe",
+    5001: "customer",
+    5002: "order",
+    5003: "delivery",
+    5004: "recommendation",
+    5009: "cart",
+}
+
+
+class Histogram:
+    """Bucketed observations per label combination"""
+
+    type = "histogram"
+
+    def __init__(self, name, description, labelnames, buckets=BUCKETS):
+        self.name = name
+        self.description = description
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # label values -> per-bucket counts (last one is +Inf), then the sum
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            child = self._children.get(labels)
+            if child is None:
+                child = self._children[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            child[index] += 1
+            child[-1] += value
+
+    def collect(self):
+        with self._lock:
+            return [[list(labels), list(child)] for labels, child in self._children.items()]
+
+
+class Gauge:
+    type = "gauge"
+
+    def __init__(self, name, description, labelnames=()):
+        self.name = name
+        self.description = description
+        self.labelnames = labelnames
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def inc(self):
+        with self._lock:
+            self._value += 1
+
+    def dec(self):
+        with self._lock:
+            self._value -= 1
+
+    def collect(self):
+        return [[[], self._value]]
+
+
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "Time spent serving HTTP requests", ("method", "route", "status"))
+IN_FLIGHT = Gauge("http_requests_in_flight", "HTTP requests currently being served")
+OUTBOUND_DURATION = Histogram(
+    "outbound_request_duration_seconds", "Time spent in calls to other services and external APIs",
+    ("downstream", "method", "status"))
+METRICS = (REQUEST_DURATION, IN_FLIGHT, OUTBOUND_DURATION)
+
+# name -> (type, description) of the metrics read from DatabasePool.stats() at collection time
+POOL_METRICS = {
+    "db_pool_connections": ("gauge", "Open pooled connections by state"),
+    "db_pool_max_connections": ("gauge", "Upper bound of the connection pool"),
+    "db_pool_borrows_total": ("counter", "Connections handed out by the pool"),
+    "db_pool_waits_total": ("counter", "Borrows that had to wait for a free connection"),
+    "db_pool_timeouts_total": ("counter", "Borrows that gave up waiting for a connection"),
+    "db_pool_wait_seconds_total": ("counter", "Time spent waiting for a free connection"),
+}
+POOL_LABELS = ("pool", "database")
+
+_pools = []
+
+
+class _Call:
+    status = "error"
+
+
+def downstream(url):
+    """Name a remote call is reported under, from its URL"""
+    return _downstream(urlsplit(url).netloc)
+
+
+@lru_cache(maxsize=256)
+def _downstream(netloc):
+    parts = urlsplit(f"//{netloc}")
+    host = parts.hostname or ""
+    if host in DOWNSTREAM_HOSTS:
+        return DOWNSTREAM_HOSTS[host]
+    for suffix, name in DOWNSTREAM_SUFFIXES.items():
+        if host.endswith(suffix):
+            return name
+    if host in ("localhost", "127.0.0.1") and parts.port in DOWNSTREAM_PORTS:
+        return DOWNSTREAM_PORTS[parts.port]
+    return netloc or "unknown"
+
+
+@contextmanager
+def outbound(target, method):
+    """
+    Time a remote call. target is a URL or a downstream name; set .status on the
+    yielded object to the response status, calls that raise are counted as "error".
+    """
+    call = _Call()
+    name = downstream(target) if "://" in target else target
+    started = time.perf_counter()
+    try:
+        yield call
+    finally:
+        OUTBOUND_DURATION.observe(time.perf_counter() - started, name, method.upper(), str(call.status))
+
+
+def _collect_pools():
+    samples = {name: [] for name in POOL_METRICS}
+    for pool in _pools:
+        stats = pool.stats()
+        params = pool.db_params
+        labels = [pool.service, f"{params.get('host')}:{params.get('port')}/{params.get('dbname')}"]
+        samples["db_pool_connections"] += [[labels + ["idle"], stats["idle"]],
+                                           [labels + ["in_use"], stats["in_use"]]]
+        samples["db_pool_max_connections"].append([labels, stats["maxconn"]])
+        samples["db_pool_borrows_total"].append([labels, stats["borrows"]])
+        samples["db_pool_waits_total"].append([labels, stats["waits"]])
+        samples["db_pool_timeouts_total"].append([labels, stats["timeouts"]])
+        samples["db_pool_wait_seconds_total"].append([labels, stats["total_wait_ms"] / 1000])
+    return samples
+
+
+def snapshot():
+    """This worker's samples: {"pid": ..., "metrics": {name: [[label values, value], ...]}}"""
+    metrics = {metric.name: metric.collect() for metric in METRICS}
+    metrics.update(_collect_pools())
+    return {"pid": os.getpid(), "metrics": metrics}
+
+
+def _metrics_dir():
+    return os.getenv("METRICS_DIR")
+
+
+def flush():
+    """Write this worker's snapshot for the other workers' /metrics to read"""
+    directory = _metrics_dir()
+    if not directory:
+        return
+    path = os.path.join(directory, f"{os.getpid()}.json")
+    with open(path + ".tmp", "w") as f:
+        json.dump(snapshot(), f)
+    os.replace(path + ".tmp", path)
+
+
+def _flush_periodically():
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        try:
+            flush()
+        except OSError:
+            pass
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _snapshots():
+    """This worker's live snapshot plus the last one written by every other worker of this server"""
+    snapshots = [snapshot()]
+    directory = _metrics_dir()
+    if not directory:
+        return snapshots
+    for entry in os.listdir(directory):
+        if not entry.endswith(".json") or entry == f"{os.getpid()}.json":
+            continue
+        try:
+            with open(os.path.join(directory, entry)) as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return snapshots
+
+
+def _types():
+    types = {metric.name: (metric.type, metric.description) for metric in METRICS}
+    types.update(POOL_METRICS)
+    return types
+
+
+def _merge(snapshots, types):
+    merged = {name: {} for name in types}
+    for snap in snapshots:
+        alive = snap["pid"] == os.getpid() or _alive(snap["pid"])
+        for name, samples in snap["metrics"].items():
+            kind = types.get(name, ("gauge",))[0]
+            if kind == "gauge" and not alive:
+                continue
+            series = merged.setdefault(name, {})
+            for labels, value in samples:
+                key = tuple(labels)
+                if kind == "histogram":
+                    total = series.get(key)
+                    series[key] = value if total is None else [a + b for a, b in zip(total, value)]
+                else:
+                    series[key] = series.get(key, 0) + value
+    return merged
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def render():
+    """All workers' metrics in the Prometheus text format"""
+    types = _types()
+    labelnames = {metric.name: metric.labelnames for metric in METRICS}
+    labelnames.update({name: POOL_LABELS for name in POOL_METRICS})
+    labelnames["db_pool_connections"] = POOL_LABELS + ("state",)
+
+    lines = []
+    for name, series in _merge(_snapshots(), types).items():
+        kind, description = types[name]
+        names = labelnames[name]
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in sorted(series.items()):
+            if kind != "histogram":
+                lines.append(f"{name}{_labels(names, labels)} {value}")
+                continue
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ("+Inf",), value[:-1]):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{name}_bucket{_labels(names, labels, le)} {cumulative}")
+            lines.append(f"{name}_sum{_labels(names, labels)} {value[-1]}")
+            lines.append(f"{name}_count{_labels(names, labels)} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+def _start_request():
+    g.metrics_started = time.perf_counter()
+    g.metrics_in_flight = True
+    IN_FLIGHT.inc()
+
+
+def _record_request(response):
+    started = g.pop("metrics_started", None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        REQUEST_DURATION.observe(time.perf_counter() - started, request.method, route, str(response.status_code))
+    return response
+
+
+def _finish_request(exc):
+    if g.pop("metrics_in_flight", False):
+        IN_FLIGHT.dec()
+
+
+def _start_flushing():
+    if _metrics_dir():
+        threading.Thread(target=_flush_periodically, name="metrics-flush", daemon=True).start()
+        atexit.register(flush)
+
+
+def init_app(app, pools=()):
+    """
+    Record request metrics for app and serve /metrics (METRICS_ENABLED=False
+    turns both off). pools are DatabasePools whose statistics are exported too.
+    Register before other before_request hooks (admission control) so requests
+    they turn away are measured as well.
+    """
+    if not ENABLED:
+        return app
+    for pool in pools:
+        if pool not in _pools:
+            _pools.append(pool)
+    app.before_request(_start_request)
+    app.after_request(_record_request)
+    app.teardown_request(_finish_request)
+
+    def metrics():
+        return Response(render(), mimetype=None, content_type=CONTENT_TYPE)
+
+    app.add_url_rule("/metrics", "metrics", metrics, methods=["GET"])
+    serving.after_fork(_start_flushing)
+    return app
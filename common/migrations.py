@@ -0,0 +1,132 @@
+import re
+import time
+import logging
+from collections import namedtuple
+
+import psycopg2
+from psycopg2 import sql
+
+logger = logging.getLogger(__name__)
+
+# A single schema change. Non-transactional migrations run in autocommit mode,
+# which CREATE INDEX CONCURRENTLY requires, and must hold a single statement.
+Migration = namedtuple("Migration", ["version", "description", "sql", "transactional"])
+Migration.__new__.__defaults__ = (True,)
+
+# Arbitrary constant so concurrently starting workers apply migrations one at a time
+MIGRATION_LOCK_ID = 7351
+# Seconds between attempts to take the migration lock while another process holds it
+MIGRATION_LOCK_POLL = 0.5
+
+# Name of the index a CREATE INDEX CONCURRENTLY migration builds
+CONCURRENT_INDEX = re.compile(
+    r"CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)", re.IGNORECASE)
+
+
+def ensure_database(db_params):
+    """Create the service database through the maintenance 'postgres' database if it is missing"""
+    params = dict(db_params)
+    dbname = params.pop("dbname")
+    params.pop("application_name", None)
+    try:
+        conn = psycopg2.connect(dbname="postgres", **params)
+    except psycopg2.Error as e:
+        # Managed servers often refuse connections to the maintenance database;
+        # the service database is then expected to exist already.
+        logger.warning("Could not connect to 'postgres' to check for '%s': %s", dbname, e)
+        return
+
+    try:
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM pg_database WHERE datname = %s", (dbname,))
+            if not cursor.fetchone():
+                logger.info("Creating database '%s'...", dbname)
+                cursor.execute(sql.SQL("CREATE DATABASE {}").format(sql.Identifier(dbname)))
+                logger.info("Database '%s' created successfully", dbname)
+    finally:
+        conn.close()
+
+
+def run_migrations(db_pool, migrations):
+    """Apply every migration newer than the recorded schema version, once per process start"""
+    ensure_database(db_pool.db_params)
+
+    with db_pool.connection() as conn:
+        with conn.cursor() as cursor:
+            _lock(cursor)
+            try:
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS schema_migrations (
+                        version INTEGER PRIMARY KEY,
+                        description VARCHAR(255) NOT NULL,
+                        applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+                    )
+                """)
+                cursor.execute("SELECT version FROM schema_migrations")
+                applied = {row[0] for row in cursor.fetchall()}
+
+                for migration in sorted(migrations, key=lambda m: m.version):
+                    if migration.version in applied:
+                        continue
+                    _apply(conn, cursor, migration)
+                    logger.info("[%s] applied migration %s: %s", db_pool.service, migration.version, migration.description)
+            finally:
+                cursor.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_ID,))
+
+
+def _lock(cursor):
+    """
+    Take the migration lock, polling rather than blocking in pg_advisory_lock: a
+    waiting statement keeps a snapshot open, and CREATE INDEX CONCURRENTLY run by
+    the holder waits for every open snapshot, so the two would deadlock.
+    """
+    while True:
+        cursor.execute("SELECT pg_try_advisory_lock(%s)", (MIGRATION_LOCK_ID,))
+        if cursor.fetchone()[0]:
+            return
+        time.sleep(MIGRATION_LOCK_POLL)
+
+
+def _index_is_invalid(cursor, name):
+    cursor.execute("""
+        SELECT NOT i.indisvalid
+        FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE c.relname = %s AND pg_table_is_visible(c.oid)
+    """, (name,))
+    row = cursor.fetchone()
+    return bool(row and row[0])
+
+
+def _drop_index(cursor, name):
+    cursor.execute(sql.SQL("DROP INDEX CONCURRENTLY IF EXISTS {}").format(sql.Identifier(name)))
+
+
+def _apply(conn, cursor, migration):
+    """Run one migration and record its version"""
+    record = "INSERT INTO schema_migrations (version, description) VALUES (%s, %s)"
+    if not migration.transactional:
+        # A CREATE INDEX CONCURRENTLY that failed part way leaves an INVALID index behind,
+        # which IF NOT EXISTS would then skip; drop it and build it again
+        match = CONCURRENT_INDEX.search(migration.sql)
+        index = match.group(1) if match else None
+        if index and _index_is_invalid(cursor, index):
+            logger.warning("Rebuilding invalid index %s left by an earlier attempt", index)
+            _drop_index(cursor, index)
+        cursor.execute(migration.sql)
+        if index and _index_is_invalid(cursor, index):
+            _drop_index(cursor, index)
+            raise RuntimeError(f"Index {index} of migration {migration.version} was left invalid")
+        cursor.execute(record, (migration.version, migration.description))
+        return
+
+    conn.autocommit = False
+    try:
+        cursor.execute(migration.sql)
+        cursor.execute(record, (migration.version, migration.description))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.autocommit = True
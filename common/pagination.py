@@ -0,0 +1,100 @@
+import os
+import json
+import heapq
+import base64
+import itertools
+from collections import namedtuple
+from datetime import datetime
+
+from flask import request
+
+DEFAULT_PAGE_SIZE = int(os.getenv("PAGE_SIZE_DEFAULT", 50))
+MAX_PAGE_SIZE = int(os.getenv("PAGE_SIZE_MAX", 500))
+
+# limit: rows per page; after: (timestamp, id) of the last row the client has seen, or None
+Page = namedtuple("Page", ["limit", "after"])
+
+
+class InvalidCursor(ValueError):
+    """Raised when a pagination token cannot be decoded"""
+
+
+def encode_cursor(timestamp, key):
+    """Opaque token pointing just past the row with this (timestamp, id)"""
+    raw = json.dumps([timestamp.isoformat(), str(key)], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(token):
+    """Inverse of encode_cursor"""
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        timestamp, key = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.fromisoformat(timestamp), key
+    except Exception:
+        raise InvalidCursor("Invalid pagination cursor")
+
+
+def page_request():
+    """
+    Read ?limit= and ?cursor= from the current request.
+
+    Returns None when neither is present, so endpoints keep returning the
+    full collection to clients that have not opted in to pagination.
+    """
+    if "limit" not in request.args and "cursor" not in request.args:
+        return None
+
+    limit = request.args.get("limit", DEFAULT_PAGE_SIZE, type=int) or DEFAULT_PAGE_SIZE
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    token = request.args.get("cursor")
+    return Page(limit, decode_cursor(token) if token else None)
+
+
+def keyset_query(select, timestamp_column, id_column, page, filters=(), params=()):
+    """
+    Build a newest-first keyset query for one page.
+
+    Seeks past the cursor with a (timestamp, id) row comparison, which a btree on
+    (filter columns..., timestamp, id) answers with a single index range scan, so
+    deep pages cost the same as the first one. One extra row is fetched to tell
+    whether another page exists.
+    """
+    conditions = list(filters)
+    params = list(params)
+    if page.after is not None:
+        conditions.append(f"({timestamp_column}, {id_column}) < (%s, %s)")
+        params.extend(page.after)
+
+    query = select
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += f" ORDER BY {timestamp_column} DESC, {id_column} DESC LIMIT %s"
+    params.append(page.limit + 1)
+    return query, params
+
+
+def fetch_page(db_pool, select, timestamp_column, id_column, page, cursor_key, filters=(), params=()):
+    """Run one keyset page; cursor_key maps a row to its (timestamp, id)"""
+    query, params = keyset_query(select, timestamp_column, id_column, page, filters, params)
+    with db_pool.read_cursor() as cursor:
+        cursor.execute(query, params)
+        rows = cursor.fetchall()
+    return _finish_page(rows, page, cursor_key)
+
+
+def merge_pages(pages, page, cursor_key):
+    """
+    Combine the results of one keyset_query() run against several shards. Each is
+    already newest first, so a k-way merge of the first limit + 1 rows gives the
+    page a single database would have returned.
+    """
+    merged = heapq.merge(*pages, key=cursor_key, reverse=True)
+    return _finish_page(list(itertools.islice(merged, page.limit + 1)), page, cursor_key)
+
+
+def _finish_page(rows, page, cursor_key):
+    if len(rows) <= page.limit:
+        return rows, None
+    rows = rows[:page.limit]
+    return rows, encode_cursor(*cursor_key(rows[-1]))
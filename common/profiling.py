@@ -0,0 +1,215 @@
+"""
+On-demand cProfile of individual requests, retrievable from /debug/profiles.
+
+A request is profiled when it carries a valid X-Debug-Profile token, or when it
+falls in the PROFILING_SAMPLE_RATE fraction of traffic (0 by default). Tokens are
+"<expiry unix time>.<hex HMAC-SHA256 of the expiry>" keyed with PROFILING_SECRET;
+mint one with
+
+  PROFILING_SECRET=... python -m common.profiling [ttl seconds]
+
+and send it, e.g. curl -H "X-Debug-Profile: $TOKEN" -X POST .../initial_purchase.
+Without PROFILING_SECRET no token is accepted and only sampling applies.
+
+The /debug/* endpoints of every shared module (profiles here, and the pool,
+SQL, cache, shard and admission stats) go through add_debug_route(). They are
+registered only when PROFILING_SECRET is set, and then require a token too,
+or when DEBUG_ENDPOINTS=True, which serves them to anyone (local runs).
+
+Each profile is written to PROFILING_DIR (shared by the gunicorn workers of a
+service) and the newest PROFILING_KEEP are kept:
+
+  GET /debug/profiles                   newest first: id, route, status, duration, trigger
+  GET /debug/profiles/<id>              top functions by cumulative time, as text
+  GET /debug/profiles/<id>?format=pstats  the raw stats for pstats, snakeviz or gprof2dot
+
+One request per worker is profiled at a time; others run unprofiled meanwhile.
+"""
+import io
+import os
+import sys
+import hmac
+import json
+import time
+import uuid
+import random
+import pstats
+import hashlib
+import tempfile
+import threading
+import logging
+import cProfile
+import functools
+
+from flask import Response, g, jsonify, request, send_file
+
+HEADER = "X-Debug-Profile"
+SECRET = os.getenv("PROFILING_SECRET", "")
+SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", 0))
+KEEP = int(os.getenv("PROFILING_KEEP", 50))
+REPORT_LINES = int(os.getenv("PROFILING_REPORT_LINES", 40))
+DEBUG_ENDPOINTS = os.getenv("DEBUG_ENDPOINTS", "False").lower() in ('true', '1', 't')
+
+logger = logging.getLogger(__name__)
+
+# cProfile hooks the thread it is enabled in; one at a time keeps the overhead bounded
+_active = threading.Lock()
+
+
+def sign(secret, ttl=300):
+    """A token valid for ttl seconds"""
+    expires = str(int(time.time() + ttl))
+    return f"{expires}.{hmac.new(secret.encode(), expires.encode(), hashlib.sha256).hexdigest()}"
+
+
+def verify(token, secret=SECRET):
+    """Whether token was signed with secret and has not expired"""
+    if not secret or not token:
+        return False
+    expires, _, digest = token.partition(".")
+    if not expires.isdigit() or int(expires) < time.time():
+        return False
+    expected = hmac.new(secret.encode(), expires.encode(), hashlib.sha256).hexdigest()
+    return hmac.compare_digest(digest, expected)
+
+
+def add_debug_route(app, rule, endpoint, view):
+    """GET rule on app when debug endpoints are enabled; with PROFILING_SECRET set, only for a valid token"""
+    if not (SECRET or DEBUG_ENDPOINTS):
+        return
+
+    @functools.wraps(view)
+    def guarded(*args, **kwargs):
+        if SECRET and not verify(request.headers.get(HEADER)):
+            return jsonify({"code": 403, "message": f"A valid {HEADER} token is required"}), 403
+        return view(*args, **kwargs)
+
+    app.add_url_rule(rule, endpoint, guarded, methods=["GET"])
+
+
+class Profiler:
+    """Profiles selected requests of one app and serves the results"""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _trigger(self):
+        if request.path.startswith("/debug/"):
+            return None
+        if verify(request.headers.get(HEADER)):
+            return "header"
+        if SAMPLE_RATE and random.random() < SAMPLE_RATE:
+            return "sampled"
+        return None
+
+    def _start(self):
+        trigger = self._trigger()
+        if trigger is None or not _active.acquire(blocking=False):
+            return
+        profile = cProfile.Profile()
+        g.profile = (profile, trigger, time.time(), time.perf_counter())
+        profile.enable()
+
+    def _record_status(self, response):
+        if "profile" in g:
+            g.profile_status = response.status_code
+        return response
+
+    def _finish(self, exc):
+        started = g.pop("profile", None)
+        if started is None:
+            return
+        profile, trigger, started_at, started_perf = started
+        profile.disable()
+        _active.release()
+        duration_ms = (time.perf_counter() - started_perf) * 1000
+        meta = {
+            "method": request.method,
+            "path": request.path,
+            "route": request.url_rule.rule if request.url_rule is not None else None,
+            "status": g.pop("profile_status", 500),
+            "duration_ms": round(duration_ms, 1),
+            "started_at": started_at,
+            "trigger": trigger,
+            "pid": os.getpid(),
+        }
+        try:
+            self._save(profile, meta)
+        except OSError as e:
+            logger.warning(f"Could not store profile of {request.path}: {str(e)}")
+
+    def _save(self, profile, meta):
+        os.makedirs(self.directory, exist_ok=True)
+        profile_id = f"{int(meta['started_at'] * 1000)}-{uuid.uuid4().hex[:8]}"
+        meta["id"] = profile_id
+        profile.dump_stats(os.path.join(self.directory, f"{profile_id}.prof"))
+        with open(os.path.join(self.directory, f"{profile_id}.json"), "w") as f:
+            json.dump(meta, f)
+        self._prune()
+
+    def _ids(self):
+        """Profile ids, newest first"""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return sorted((name[:-5] for name in names if name.endswith(".json")), reverse=True)
+
+    def _prune(self):
+        for profile_id in self._ids()[KEEP:]:
+            for suffix in (".json", ".prof"):
+                try:
+                    os.remove(os.path.join(self.directory, profile_id + suffix))
+                except FileNotFoundError:
+                    pass
+
+    def _path(self, profile_id, suffix):
+        # Ids are generated here; anything else must not reach the filesystem
+        if not all(c.isalnum() or c == "-" for c in profile_id):
+            return None
+        path = os.path.join(self.directory, profile_id + suffix)
+        return path if os.path.exists(path) else None
+
+    def list_profiles(self):
+        profiles = []
+        for profile_id in self._ids():
+            try:
+                with open(os.path.join(self.directory, f"{profile_id}.json")) as f:
+                    profiles.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return jsonify({
+            "code": 200,
+            "data": profiles
+        }), 200
+
+    def get_profile(self, profile_id):
+        path = self._path(profile_id, ".prof")
+        if path is None:
+            return jsonify({"code": 404, "message": "Profile not found"}), 404
+        if request.args.get("format") == "pstats":
+            return send_file(path, mimetype="application/octet-stream")
+        report = io.StringIO()
+        stats = pstats.Stats(path, stream=report)
+        stats.strip_dirs().sort_stats("cumulative").print_stats(REPORT_LINES)
+        return Response(report.getvalue(), mimetype="text/plain")
+
+    def init_app(self, app):
+        app.before_request(self._start)
+        app.after_request(self._record_status)
+        app.teardown_request(self._finish)
+        add_debug_route(app, "/debug/profiles", "list_profiles", self.list_profiles)
+        add_debug_route(app, "/debug/profiles/<string:profile_id>", "get_profile", self.get_profile)
+
+
+def init_app(app, service):
+    """Profile requests of app on demand; profiles go to PROFILING_DIR (default: a per-service temp directory)"""
+    directory = os.getenv("PROFILING_DIR", os.path.join(tempfile.gettempdir(), f"profiles-{service}"))
+    Profiler(directory).init_app(app)
+    return app
+
+
+if __name__ == "__main__":
+    if not SECRET:
+        sys.exit("Set PROFILING_SECRET to the value the service runs with")
+    print(sign(SECRET, int(sys.argv[1]) if len(sys.argv) > 1 else 300))
@@ -0,0 +1,48 @@
+"""
+Per-worker setup for services served by gunicorn (common/gunicorn_conf.py).
+
+With preload_app the application is imported once in the master and every
+worker is forked from it, so anything that owns sockets or threads (database
+pools, cache listeners, AMQP consumers) has to be created in each worker after
+the fork. Components register that step with after_fork(), and with
+before_fork() release whatever the master opened while importing the app
+(migrations borrow a pooled connection, for instance).
+
+Outside gunicorn nothing calls these hooks; pools and listeners are then built
+lazily on first use, and script entry points call run_after_fork() themselves.
+"""
+import logging
+
+logger = logging.getLogger(__name__)
+
+_before_fork = []
+_after_fork = []
+
+
+def before_fork(fn):
+    """Run fn in the master before each worker is forked"""
+    _before_fork.append(fn)
+    return fn
+
+
+def after_fork(fn):
+    """Run fn in every worker once it has loaded the app"""
+    _after_fork.append(fn)
+    return fn
+
+
+def _run(hooks, stage):
+    for fn in list(hooks):
+        try:
+            fn()
+        except Exception as e:
+            # A database or broker that is down must not keep the worker from serving
+            logger.warning(f"{stage} hook {getattr(fn, '__qualname__', fn)} failed: {str(e)}")
+
+
+def run_before_fork():
+    _run(_before_fork, "before_fork")
+
+
+def run_after_fork():
+    _run(_after_fork, "after_fork")
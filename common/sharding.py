@@ -0,0 +1,226 @@
+import os
+import bisect
+import hashlib
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+from psycopg2.extensions import parse_dsn
+
+from . import serving
+from .db import DatabasePool
+from .migrations import run_migrations
+
+# Maps every entity id to the shard it was written to, so lookups by id need no fan-out
+DIRECTORY_TABLE = """
+    CREATE TABLE IF NOT EXISTS shard_directory (
+        entity_id VARCHAR(255) PRIMARY KEY,
+        shard VARCHAR(255) NOT NULL
+    )
+"""
+
+
+def _hash(value):
+    # Stable across processes and restarts, unlike hash()
+    return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """
+    Consistent hashing over shard names. Every shard owns vnodes points on the
+    ring, so adding or removing a shard only moves the keys next to its points
+    instead of reshuffling everything.
+    """
+
+    def __init__(self, names, vnodes=64):
+        points = sorted((_hash(f"{name}#{i}"), name) for name in names for i in range(vnodes))
+        self._hashes = [point[0] for point in points]
+        self._names = [point[1] for point in points]
+
+    def lookup(self, key):
+        index = bisect.bisect(self._hashes, _hash(str(key))) % len(self._hashes)
+        return self._names[index]
+
+
+class ShardSet:
+    """
+    Rows of one table hash-sharded by an owner key across several databases.
+
+    directory is the service's own pool: it holds the id -> shard directory and,
+    when no shards are configured, is the only shard, so callers can route every
+    query through this class whether sharding is on or off. Shards are named
+    host:port/dbname; that name is what the ring hashes and the directory stores.
+    """
+
+    def __init__(self, service, directory, shard_params=(), vnodes=None):
+        self.service = service
+        self.directory = directory
+        self.pools = {}
+        for params in shard_params:
+            name = f"{params.get('host')}:{params.get('port')}/{params.get('dbname')}"
+            # Replicas are configured for the directory database only; shards read from their primary
+            self.pools[name] = DatabasePool(f"{service}-shard", params, replica_hosts=(),
+                                            sql_stats=directory.sql_stats)
+        if not self.pools:
+            self.pools = {"default": directory}
+        vnodes = vnodes if vnodes is not None else int(os.getenv("SHARD_VNODES", 64))
+        self.ring = HashRing(list(self.pools), vnodes)
+        self.names = {id(pool): name for name, pool in self.pools.items()}
+        # Request threads per worker that may scatter at the same time
+        self.request_threads = int(os.getenv("GUNICORN_THREADS", 4))
+
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+
+    @classmethod
+    def from_env(cls, service, variable, directory):
+        """
+        Shards from a comma separated list of libpq DSNs or URIs in the given variable;
+        settings a DSN leaves out (user, password, ...) come from the directory's.
+        """
+        defaults = {k: v for k, v in directory.db_params.items()
+                    if k in ("dbname", "user", "password", "host", "port")}
+        dsns = [dsn.strip() for dsn in os.getenv(variable, "").split(",") if dsn.strip()]
+        return cls(service, directory, [dict(defaults, **parse_dsn(dsn)) for dsn in dsns])
+
+    @property
+    def sharded(self):
+        return self.pools.get("default") is not self.directory
+
+    def for_key(self, key):
+        """Pool of the shard that owns key (e.g. a customer id)"""
+        return self.pools[self.ring.lookup(key)]
+
+    def name(self, pool):
+        return self.names[id(pool)]
+
+    @contextmanager
+    def assign(self, entity_id, key):
+        """
+        Yield the pool a new entity owned by key is written to. Its directory row is
+        inserted first, so the primary key on entity_id still rejects duplicates
+        across shards, and removed again if the write in the with-block fails.
+        """
+        pool = self.for_key(key)
+        if not self.sharded:
+            yield pool
+            return
+
+        with self.directory.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO shard_directory (entity_id, shard) VALUES (%s, %s)",
+                (entity_id, self.name(pool))
+            )
+        try:
+            yield pool
+        except Exception:
+            with self.directory.cursor() as cursor:
+                cursor.execute("DELETE FROM shard_directory WHERE entity_id = %s", (entity_id,))
+            raise
+
+    def locate(self, entity_id, probe_query):
+        """
+        Pool of the shard holding entity_id, or None if none has it. Ids missing from
+        the directory (rows written before sharding was enabled) are found by running
+        probe_query, which must return a row when the entity exists, on every shard.
+        """
+        if not self.sharded:
+            return self.directory
+
+        with self.directory.read_cursor() as cursor:
+            cursor.execute("SELECT shard FROM shard_directory WHERE entity_id = %s", (entity_id,))
+            row = cursor.fetchone()
+        if row and row[0] in self.pools:
+            return self.pools[row[0]]
+
+        def probe(pool):
+            with pool.read_cursor() as cursor:
+                cursor.execute(probe_query, (entity_id,))
+                return cursor.fetchone() is not None
+
+        for pool, found in zip(self.pools.values(), self.scatter(probe)):
+            if found:
+                return pool
+        return None
+
+    def forget(self, cursor, entity_id):
+        """Drop the directory row of a deleted entity; cursor must be on the directory database"""
+        if self.sharded:
+            cursor.execute("DELETE FROM shard_directory WHERE entity_id = %s", (entity_id,))
+
+    def _ensure_executor(self):
+        """
+        A thread per shard for every request thread, so concurrent scatter-gathers
+        do not queue behind each other; created per process like the connection pools
+        """
+        pid = os.getpid()
+        if self._executor is None or self._pid != pid:
+            with self._lock:
+                if self._executor is None or self._pid != pid:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.request_threads * len(self.pools),
+                        thread_name_prefix=f"{self.service}-scatter"
+                    )
+                    self._pid = pid
+        return self._executor
+
+    def scatter(self, fn):
+        """Run fn(pool) on every shard in parallel and return the results in shard order"""
+        pools = list(self.pools.values())
+        if len(pools) == 1:
+            return [fn(pools[0])]
+
+        from flask import copy_current_request_context, has_request_context
+        executor = self._ensure_executor()
+        futures = []
+        for pool in pools:
+            # A copy of the request context per thread keeps route tagging working in the workers
+            task = copy_current_request_context(fn) if has_request_context() else fn
+            futures.append(executor.submit(task, pool))
+        return [future.result() for future in futures]
+
+    def fetchall(self, query, params=None):
+        """Rows of a read-only query from every shard, one list per shard"""
+        def fetch(pool):
+            with pool.read_cursor() as cursor:
+                cursor.execute(query, params)
+                return cursor.fetchall()
+
+        return self.scatter(fetch)
+
+    def stream(self, query, params=None):
+        """Stream query from one shard after the other; closing the generator releases the connection"""
+        for pool in self.pools.values():
+            yield from pool.stream(query, params)
+
+    def migrate(self, migrations):
+        """Apply the service's migrations to every shard other than the directory database"""
+        for pool in self.pools.values():
+            if pool is not self.directory:
+                run_migrations(pool, migrations)
+
+    def stats(self):
+        return {
+            "sharded": self.sharded,
+            "shards": {name: pool.stats() for name, pool in self.pools.items()},
+        }
+
+    def init_app(self, app):
+        """Expose per-shard pool statistics at /debug/shards; shard pools open per worker like the main one"""
+        from flask import jsonify
+
+        from .profiling import add_debug_route
+
+        for pool in self.pools.values():
+            if pool is not self.directory:
+                serving.before_fork(pool.close)
+                serving.after_fork(pool._ensure_pool)
+
+        def shard_stats():
+            return jsonify({
+                "code": 200,
+                "data": self.stats()
+            }), 200
+
+        add_debug_route(app, "/debug/shards", "shard_stats", shard_stats)
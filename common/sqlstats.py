@@ -0,0 +1,140 @@
+import os
+import re
+import time
+import logging
+import threading
+from collections import deque
+
+import psycopg2
+from psycopg2.extensions import cursor as pg_cursor
+
+logger = logging.getLogger(__name__)
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_WHITESPACE = re.compile(r"\s+")
+# Statements EXPLAIN accepts; PREPARE, SET, DDL and friends are only timed
+_EXPLAINABLE = re.compile(r"\s*(SELECT|INSERT|UPDATE|DELETE|WITH|EXECUTE|VALUES)\b", re.IGNORECASE)
+
+
+def normalize(query):
+    """Collapse whitespace and blank out inline literals so equivalent statements share one entry"""
+    return _LITERALS.sub("?", _WHITESPACE.sub(" ", query).strip())
+
+
+def _percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+class SQLStats:
+    """
+    Per-worker latency statistics for every statement run through a TimingCursor,
+    keyed by normalized query text. Percentiles are computed over the most recent
+    DB_SQL_STATS_SAMPLES executions of each statement.
+    """
+
+    def __init__(self, service, slow_ms=None, samples=None):
+        self.service = service
+        self.slow_ms = slow_ms if slow_ms is not None else float(os.getenv("DB_SLOW_QUERY_MS", 200))
+        self.samples = samples if samples is not None else int(os.getenv("DB_SQL_STATS_SAMPLES", 1000))
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def record(self, cursor, query, params, elapsed_ms):
+        if isinstance(query, bytes):
+            query = query.decode("utf-8", "replace")
+        elif not isinstance(query, str):
+            query = query.as_string(cursor)  # psycopg2.sql composition
+        key = normalize(query)
+        rows = max(cursor.rowcount, 0)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = {
+                    "count": 0,
+                    "rows": 0,
+                    "total_ms": 0.0,
+                    "max_ms": 0.0,
+                    "durations": deque(maxlen=self.samples),
+                    "plan": None,
+                }
+            entry["count"] += 1
+            entry["rows"] += rows
+            entry["total_ms"] += elapsed_ms
+            entry["max_ms"] = max(entry["max_ms"], elapsed_ms)
+            entry["durations"].append(elapsed_ms)
+            # Only the first slow execution of a statement pays for an EXPLAIN
+            explain = elapsed_ms >= self.slow_ms and entry["plan"] is None
+            if explain:
+                entry["plan"] = ""
+
+        if elapsed_ms < self.slow_ms:
+            return
+        route = getattr(cursor.connection, "route_tag", None) or self.service
+        logger.warning(f"[{route}] slow query ({elapsed_ms:.1f} ms, {rows} rows): {key}")
+        if explain:
+            plan = self._explain(cursor, query, params)
+            with self._lock:
+                entry["plan"] = plan
+            logger.warning(f"[{route}] plan for slow query: {key}\n{plan}")
+
+    def _explain(self, cursor, query, params):
+        """EXPLAIN (without ANALYZE, so nothing runs twice) on the same connection"""
+        conn = cursor.connection
+        if conn.closed or not _EXPLAINABLE.match(query):
+            return "(not explainable)"
+        in_transaction = not conn.autocommit
+        # Plain cursor, so the EXPLAIN itself is not timed and recorded
+        with conn.cursor(cursor_factory=pg_cursor) as explain_cursor:
+            try:
+                if in_transaction:
+                    explain_cursor.execute("SAVEPOINT sql_stats_explain")
+                explain_cursor.execute(f"EXPLAIN {query}", params)
+                plan = "\n".join(row[0] for row in explain_cursor.fetchall())
+                if in_transaction:
+                    explain_cursor.execute("RELEASE SAVEPOINT sql_stats_explain")
+                return plan
+            except psycopg2.Error as e:
+                if in_transaction:
+                    explain_cursor.execute("ROLLBACK TO SAVEPOINT sql_stats_explain")
+                return f"(EXPLAIN failed: {str(e).strip()})"
+
+    def snapshot(self):
+        """Aggregated statistics, slowest total time first"""
+        with self._lock:
+            items = [(key, dict(entry, durations=list(entry["durations"]))) for key, entry in self._entries.items()]
+
+        report = []
+        for key, entry in items:
+            ordered = sorted(entry["durations"])
+            report.append({
+                "query": key,
+                "count": entry["count"],
+                "rows": entry["rows"],
+                "total_ms": round(entry["total_ms"], 3),
+                "mean_ms": round(entry["total_ms"] / entry["count"], 3),
+                "p50_ms": round(_percentile(ordered, 0.50), 3),
+                "p95_ms": round(_percentile(ordered, 0.95), 3),
+                "p99_ms": round(_percentile(ordered, 0.99), 3),
+                "max_ms": round(entry["max_ms"], 3),
+                "plan": entry["plan"] or None,
+            })
+        report.sort(key=lambda item: item["total_ms"], reverse=True)
+        return report
+
+    def reset(self):
+        with self._lock:
+            self._entries = {}
+
+
+class TimingCursor(pg_cursor):
+    """Cursor that reports the duration and row count of every statement to its connection's SQLStats"""
+
+    def execute(self, query, vars=None):
+        stats = getattr(self.connection, "sql_stats", None)
+        if stats is None:
+            return super().execute(query, vars)
+        started = time.perf_counter()
+        result = super().execute(query, vars)
+        # Failed statements surface as errors to the caller; only completed ones are recorded
+        stats.record(self, query, vars, (time.perf_counter() - started) * 1000)
+        return result
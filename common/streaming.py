@@ -0,0 +1,39 @@
+from flask import Response, current_app, request, stream_with_context
+
+NDJSON_MIMETYPE = "application/x-ndjson"
+
+_END = object()
+
+
+def wants_ndjson():
+    """True when the client explicitly prefers newline-delimited JSON over a single JSON body"""
+    best = request.accept_mimetypes.best_match(["application/json", NDJSON_MIMETYPE])
+    return best == NDJSON_MIMETYPE
+
+
+def ndjson_response(rows, serialize):
+    """
+    Stream one JSON document per row as a chunked response.
+
+    The first row is pulled before the response is returned, so connection and
+    query errors still surface as a normal error response from the handler
+    instead of a truncated stream.
+    """
+    rows = iter(rows)
+    first = next(rows, _END)
+
+    def generate():
+        if first is _END:
+            return
+        # The app's JSON provider, so rows encode exactly as they do in jsonify()
+        dumps = current_app.json.dumps
+        try:
+            yield dumps(serialize(first)) + "\n"
+            for row in rows:
+                yield dumps(serialize(row)) + "\n"
+        finally:
+            # Hand the pooled connection back right away if the client disconnects mid-stream
+            if hasattr(rows, "close"):
+                rows.close()
+
+    return Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
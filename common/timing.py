@@ -0,0 +1,90 @@
+"""
+Per-step timing of a request, reported in a Server-Timing header and one log line.
+
+Handlers wrap each remote call or other expensive step in
+
+    with timing.step("customer"):
+        customer = invoke_http(...)
+
+and, for apps registered with init_app(), the response carries
+
+    Server-Timing: customer;dur=41.2, part_lookup;dur=380.5;desc="6 calls", total;dur=455.0
+
+(steps of the same name are summed) while the "request_timing" logger gets a JSON
+line with the route, status and every individual step, so one slow request can be
+diagnosed from its own response or log entry. SERVER_TIMING=False keeps the log
+line but drops the header.
+"""
+import os
+import json
+import time
+import logging
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request
+
+HEADER_ENABLED = os.getenv("SERVER_TIMING", "True").lower() in ('true', '1', 't')
+
+logger = logging.getLogger("request_timing")
+
+
+@contextmanager
+def step(name, detail=None):
+    """Time the enclosed block as step name of the current request; detail ends up in the log line"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if has_request_context():
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            g.setdefault("timing_steps", []).append((name, elapsed_ms, detail))
+
+
+def server_timing(steps, total_ms):
+    """Server-Timing header value for steps (name, ms, detail), same-named steps summed in first-seen order"""
+    totals = {}
+    for name, elapsed_ms, _ in steps:
+        duration, calls = totals.get(name, (0.0, 0))
+        totals[name] = (duration + elapsed_ms, calls + 1)
+    metrics = []
+    for name, (duration, calls) in totals.items():
+        metric = f"{name};dur={duration:.1f}"
+        if calls > 1:
+            metric += f';desc="{calls} calls"'
+        metrics.append(metric)
+    metrics.append(f"total;dur={total_ms:.1f}")
+    return ", ".join(metrics)
+
+
+def _start():
+    g.timing_started = time.perf_counter()
+
+
+def _report(response):
+    steps = g.pop("timing_steps", None)
+    started = g.pop("timing_started", None)
+    if not steps or started is None:
+        return response
+    total_ms = (time.perf_counter() - started) * 1000
+    if HEADER_ENABLED:
+        response.headers["Server-Timing"] = server_timing(steps, total_ms)
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(json.dumps({
+            "event": "request_timing",
+            "method": request.method,
+            "route": request.url_rule.rule if request.url_rule is not None else request.path,
+            "status": response.status_code,
+            "total_ms": round(total_ms, 1),
+            "steps": [
+                {"name": name, "ms": round(elapsed_ms, 1), **({"detail": detail} if detail is not None else {})}
+                for name, elapsed_ms, detail in steps
+            ],
+        }))
+    return response
+
+
+def init_app(app):
+    """Report the steps timed during each request of app"""
+    app.before_request(_start)
+    app.after_request(_report)
+    return app
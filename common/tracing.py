@@ -0,0 +1,338 @@
+"""
+Distributed tracing: W3C Trace Context propagation over HTTP and AMQP, and span export.
+
+Every Flask app registered with init_app() continues the trace named by an
+incoming `traceparent` header (or starts one) in a server span per request.
+invoke_http opens a client span per call and forwards its traceparent, and
+publish_message puts the producer span's traceparent into the AMQP message
+headers, next to the publish time, so the consumer's span (consumer() below)
+joins the same trace and records how long the message sat in the queue.
+
+Finished spans of sampled traces are exported from a background thread:
+
+  TRACING_EXPORT_FILE     append one JSON object per span to this file
+  TRACING_OTLP_ENDPOINT   POST batches as OTLP/HTTP JSON, e.g. http://collector:4318/v1/traces
+
+With neither set spans are still created and propagated, just not exported.
+TRACING_SAMPLE_RATIO (1.0) decides for new traces; continued traces keep the
+caller's decision.
+"""
+import os
+import re
+import json
+import time
+import queue
+import atexit
+import random
+import logging
+import threading
+import contextvars
+import urllib.request
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import g, request
+
+from .metrics import downstream
+
+SAMPLE_RATIO = float(os.getenv("TRACING_SAMPLE_RATIO", 1.0))
+EXPORT_FILE = os.getenv("TRACING_EXPORT_FILE")
+OTLP_ENDPOINT = os.getenv("TRACING_OTLP_ENDPOINT")
+# Spans buffered for export; beyond this they are dropped rather than slowing requests down
+EXPORT_QUEUE_SIZE = int(os.getenv("TRACING_EXPORT_QUEUE_SIZE", 10000))
+EXPORT_BATCH_SIZE = int(os.getenv("TRACING_EXPORT_BATCH_SIZE", 512))
+EXPORT_INTERVAL = float(os.getenv("TRACING_EXPORT_INTERVAL", 1))
+
+# AMQP message header holding the publish time in epoch milliseconds
+PUBLISHED_AT_HEADER = "published_at_ms"
+
+# OTLP SpanKind values
+KINDS = {"internal": 1, "server": 2, "client": 3, "producer": 4, "consumer": 5}
+
+TRACEPARENT = re.compile(r"^([0-9a-f]{2})-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+logger = logging.getLogger(__name__)
+
+_current = contextvars.ContextVar("current_span", default=None)
+_service = os.getenv("TRACING_SERVICE_NAME")
+
+
+class SpanContext:
+    """The part of a span that crosses process boundaries"""
+
+    __slots__ = ("trace_id", "span_id", "sampled")
+
+    def __init__(self, trace_id, span_id, sampled):
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.sampled = sampled
+
+    def traceparent(self):
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+
+def parse_traceparent(value):
+    """SpanContext from a traceparent header value, or None when it is missing or malformed"""
+    match = TRACEPARENT.match((value or "").strip().lower())
+    if match is None:
+        return None
+    version, trace_id, span_id, flags = match.groups()
+    if version == "ff" or trace_id == "0" * 32 or span_id == "0" * 16:
+        return None
+    return SpanContext(trace_id, span_id, bool(int(flags, 16) & 1))
+
+
+class Span:
+    def __init__(self, name, kind="internal", parent=None, attributes=None):
+        self.name = name
+        self.kind = kind
+        self.service = _service
+        if parent is not None:
+            trace_id, sampled, self.parent_id = parent.trace_id, parent.sampled, parent.span_id
+        else:
+            trace_id, sampled, self.parent_id = f"{random.getrandbits(128):032x}", random.random() < SAMPLE_RATIO, None
+        self.context = SpanContext(trace_id, f"{random.getrandbits(64):016x}", sampled)
+        self.attributes = dict(attributes or {})
+        self.error = None
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def set_error(self, message):
+        self.error = str(message)
+
+    def end(self):
+        self.end_ns = time.time_ns()
+        if self.context.sampled:
+            _exporter.export(self)
+
+    def to_dict(self):
+        """Flat form written to TRACING_EXPORT_FILE"""
+        return {
+            "service": self.service,
+            "trace_id": self.context.trace_id,
+            "span_id": self.context.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "kind": self.kind,
+            "start_ns": self.start_ns,
+            "duration_ms": round((self.end_ns - self.start_ns) / 1e6, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+    def to_otlp(self):
+        span = {
+            "traceId": self.context.trace_id,
+            "spanId": self.context.span_id,
+            "name": self.name,
+            "kind": KINDS[self.kind],
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [_otlp_attribute(key, value) for key, value in self.attributes.items()],
+            "status": {"code": 2, "message": self.error} if self.error is not None else {},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+def _otlp_attribute(key, value):
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+class _Exporter:
+    """Hands finished spans to a per-process background thread that writes them in batches"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queue = None
+        self._pid = None
+        self.dropped = 0
+
+    def export(self, span):
+        if not (EXPORT_FILE or OTLP_ENDPOINT):
+            return
+        try:
+            self._ensure_thread().put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def _ensure_thread(self):
+        # A queue and thread inherited from the gunicorn master are useless after fork
+        pid = os.getpid()
+        if self._pid != pid:
+            with self._lock:
+                if self._pid != pid:
+                    self._queue = queue.Queue(EXPORT_QUEUE_SIZE)
+                    threading.Thread(target=self._run, name="trace-export", daemon=True).start()
+                    atexit.register(self._drain)
+                    self._pid = pid
+        return self._queue
+
+    def _batch(self, timeout):
+        spans = []
+        try:
+            spans.append(self._queue.get(timeout=timeout))
+            while len(spans) < EXPORT_BATCH_SIZE:
+                spans.append(self._queue.get_nowait())
+        except queue.Empty:
+            pass
+        return spans
+
+    def _run(self):
+        while True:
+            spans = self._batch(EXPORT_INTERVAL)
+            if spans:
+                self._write(spans)
+
+    def _drain(self):
+        spans = self._batch(0)
+        while spans:
+            self._write(spans)
+            spans = self._batch(0)
+
+    def _write(self, spans):
+        try:
+            if EXPORT_FILE:
+                lines = "".join(json.dumps(span.to_dict(), default=str) + "\n" for span in spans)
+                with open(EXPORT_FILE, "a") as f:
+                    f.write(lines)
+            if OTLP_ENDPOINT:
+                self._post(spans)
+        except Exception as e:
+            # Tracing must never take a service down with it
+            logger.warning(f"Exporting {len(spans)} spans failed: {str(e)}")
+
+    def _post(self, spans):
+        by_service = {}
+        for span in spans:
+            by_service.setdefault(span.service or "unknown", []).append(span.to_otlp())
+        body = json.dumps({"resourceSpans": [{
+            "resource": {"attributes": [_otlp_attribute("service.name", service)]},
+            "scopeSpans": [{"scope": {"name": "common.tracing"}, "spans": service_spans}],
+        } for service, service_spans in by_service.items()]}).encode()
+        post = urllib.request.Request(OTLP_ENDPOINT, data=body, method="POST",
+                                      headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(post, timeout=5) as response:
+            response.read()
+
+
+_exporter = _Exporter()
+
+
+def set_service(name):
+    """Name this process's spans are reported under (TRACING_SERVICE_NAME overrides it)"""
+    global _service
+    _service = os.getenv("TRACING_SERVICE_NAME", name)
+
+
+def current():
+    """The span active in this thread, or None"""
+    return _current.get()
+
+
+@contextmanager
+def span(name, kind="internal", parent=None, attributes=None):
+    """Run the enclosed block in a new span, a child of parent or of the current span"""
+    if parent is None and _current.get() is not None:
+        parent = _current.get().context
+    active = Span(name, kind, parent, attributes)
+    token = _current.set(active)
+    try:
+        yield active
+    except Exception as e:
+        active.set_error(e)
+        raise
+    finally:
+        _current.reset(token)
+        active.end()
+
+
+def client_span(method, url):
+    """span() for an outgoing HTTP call; put inject(headers) inside it"""
+    method = method.upper()
+    return span(f"{method} {downstream(url)}", "client", attributes={"http.method": method, "http.url": url})
+
+
+def inject(headers):
+    """Add the current span's traceparent to headers (a dict), which is returned"""
+    active = _current.get()
+    if active is not None:
+        headers["traceparent"] = active.context.traceparent()
+    return headers
+
+
+def extract(headers):
+    """SpanContext named by a traceparent in headers (HTTP or AMQP), or None"""
+    return parse_traceparent((headers or {}).get("traceparent"))
+
+
+def message_headers():
+    """AMQP headers for a message published now, carrying the current trace"""
+    return inject({PUBLISHED_AT_HEADER: int(time.time() * 1000)})
+
+
+def consumer(queue_name):
+    """
+    Decorator for pika on_message_callback functions: each delivery runs in a
+    consumer span continuing the publisher's trace, with the time the message
+    waited in the queue as messaging.queue_wait_ms.
+    """
+    def decorate(callback):
+        @wraps(callback)
+        def traced(channel, method, properties, body):
+            headers = getattr(properties, "headers", None) or {}
+            attributes = {"messaging.destination": queue_name,
+                          "messaging.routing_key": getattr(method, "routing_key", "")}
+            published_at = headers.get(PUBLISHED_AT_HEADER)
+            if isinstance(published_at, int):
+                attributes["messaging.queue_wait_ms"] = max(0, int(time.time() * 1000) - published_at)
+            with span(f"{queue_name} process", "consumer", extract(headers), attributes):
+                return callback(channel, method, properties, body)
+        return traced
+    return decorate
+
+
+def _start_request():
+    rule = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    active = Span(f"{request.method} {rule}", "server", extract(request.headers),
+                  {"http.method": request.method, "http.route": rule, "http.target": request.full_path})
+    g.trace_span = active
+    g.trace_token = _current.set(active)
+
+
+def _record_status(response):
+    active = g.get("trace_span")
+    if active is not None:
+        active.set_attribute("http.status_code", response.status_code)
+        if response.status_code >= 500:
+            active.set_error(f"HTTP {response.status_code}")
+    return response
+
+
+def _end_request(exc):
+    active = g.pop("trace_span", None)
+    if active is None:
+        return
+    if exc is not None:
+        active.set_error(exc)
+    _current.reset(g.pop("trace_token"))
+    active.end()
+
+
+def init_app(app, service):
+    """Trace every request of app as a server span of service"""
+    set_service(service)
+    app.before_request(_start_request)
+    app.after_request(_record_status)
+    app.teardown_request(_end_request)
+    return app
@@ -1,11 +1,26 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
 from flask_cors import CORS
-import psycopg2
 import os
-from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+import sys
+
+# Add the project root to the Python path so the shared common package resolves
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+from common.cache import InvalidatingCache
+from common import compression, etag, health, json_provider, log, metrics, profiling, tracing
+from common.db import DatabasePool
+from common.migrations import Migration, run_migrations
+from common.streaming import wants_ndjson, ndjson_response
+from common.pagination import InvalidCursor, page_request, fetch_page
+
+# JSON log lines written off the request thread, at LOG_LEVEL
+log.setup("customer")
 
 app = Flask(__name__)
 CORS(app)
+# orjson-backed jsonify that also encodes datetime, Decimal and UUID values
+json_provider.init_app(app)
+# gzip/brotli for large responses, negotiated through Accept-Encoding
+compression.init_app(app)
 
 # Database connection parameters
 DB_PARAMS = {
@@ -16,65 +31,137 @@ DB_PARAMS = {
     "port": os.getenv("DB_PORT", "5444"),  # Your host PostgreSQL port
 }
 
-def ensure_database_exists():
-    """Ensure the customer_db database exists"""
-    try:
-        conn = psycopg2.connect(
-            dbname=DB_PARAMS["dbname"],
-            user=DB_PARAMS["user"],
-            password=DB_PARAMS["password"],
-            host=DB_PARAMS["host"],
-            port=DB_PARAMS["port"]
+# Connections are borrowed from a per-worker pool instead of opened per request
+db_pool = DatabasePool("customer", DB_PARAMS)
+db_pool.init_app(app)
+# Prometheus /metrics: request latency per route and status, connection pool usage
+metrics.init_app(app, pools=[db_pool])
+# Server span per request, continuing the caller's W3C traceparent
+tracing.init_app(app, "customer")
+# cProfile of requests carrying a signed X-Debug-Profile token (or sampled), kept at /debug/profiles
+profiling.init_app(app, "customer")
+# /health and /ready served from a background check of the database every HEALTH_CHECK_INTERVAL seconds
+health_monitor = health.HealthMonitor("customer")
+health_monitor.add_check("database", db_pool.ping)
+health_monitor.init_app(app)
+
+# Per-worker cache of GET /customer/<id> bodies, evicted across instances through NOTIFY customer_changes
+customer_cache = InvalidatingCache(db_pool, "customer_changes")
+customer_cache.init_app(app)
+
+# Fills in missing created_at values a few thousand rows (and one short transaction) at a
+# time, walking the primary key so no batch scans the whole table or locks it
+BACKFILL_CREATED_AT = """
+    DO $$
+    DECLARE
+        last_id VARCHAR(255);
+        batch_end VARCHAR(255);
+    BEGIN
+        LOOP
+            SELECT max(customer_id) INTO batch_end FROM (
+                SELECT customer_id FROM customers
+                WHERE last_id IS NULL OR customer_id > last_id
+                ORDER BY customer_id LIMIT 5000
+            ) batch;
+            EXIT WHEN batch_end IS NULL;
+            UPDATE customers SET created_at = CURRENT_TIMESTAMP
+            WHERE (last_id IS NULL OR customer_id > last_id) AND customer_id <= batch_end
+              AND created_at IS NULL;
+            COMMIT;
+            last_id := batch_end;
+        END LOOP;
+    END $$
+"""
+
+# Versioned schema changes, applied once at process start instead of probed per request
+MIGRATIONS = [
+    Migration(1, "create customers table", """
+        CREATE TABLE IF NOT EXISTS customers (
+            customer_id VARCHAR(255) PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            address VARCHAR(255) NOT NULL,
+            email VARCHAR(255) UNIQUE NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
-        conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT 1 FROM pg_database WHERE datname = 'customer_db'")
-        exists = cursor.fetchone()
-        
-        if not exists:
-            print("Creating database 'customer_db'...")
-            cursor.execute("CREATE DATABASE customer_db")
-            print("Database 'customer_db' created successfully")
-        
-        cursor.close()
-        conn.close()
-        
-    except Exception as e:
-        print(f"Error ensuring database exists: {str(e)}")
-        raise
+    """),
+    # Lookups by email; a plain index, so tables created without the UNIQUE constraint
+    # (which may already hold duplicate emails) still get it instead of failing to start
+    Migration(2, "index customers.email", """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_customers_email ON customers (email)
+    """, transactional=False),
+    # Keyset pagination seeks on (created_at, customer_id), which must never be NULL
+    Migration(3, "backfill customers.created_at", BACKFILL_CREATED_AT, transactional=False),
+    Migration(4, "index customers (created_at, customer_id)", """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_customers_created_at_id ON customers (created_at, customer_id)
+    """, transactional=False),
+    # Enforced for new rows at once; NOT VALID skips checking the existing ones under the lock
+    Migration(5, "check customers.created_at is set", """
+        ALTER TABLE customers ADD CONSTRAINT customers_created_at_not_null CHECK (created_at IS NOT NULL) NOT VALID
+    """),
+    # Rows written without created_at between the first backfill and the check
+    Migration(6, "backfill customers.created_at again", BACKFILL_CREATED_AT, transactional=False),
+    # Scans the table without blocking reads or writes
+    Migration(7, "validate the customers.created_at check", """
+        ALTER TABLE customers VALIDATE CONSTRAINT customers_created_at_not_null
+    """),
+]
+
+# Create the database, tables and indexes once at process start
+run_migrations(db_pool, MIGRATIONS)
+
+# Hot queries, PREPAREd once per pooled connection and then executed by name
+SELECT_CUSTOMER = db_pool.prepare("select_customer", f"""
+    SELECT customer_id, name, address, email, {etag.VERSION_COLUMN}
+    FROM customers
+    WHERE customer_id = %s
+""")
+# Answers If-None-Match without fetching the row
+CUSTOMER_VERSION = db_pool.prepare("customer_version", f"""
+    SELECT {etag.VERSION_COLUMN} FROM customers WHERE customer_id = %s
+""")
 
-def get_db_connection():
-    """Get connection to our application database"""
-    ensure_database_exists()
-    conn = psycopg2.connect(**DB_PARAMS)
-    return conn
+def format_customer(customer):
+    """Convert a customers row into its JSON representation"""
+    return {
+        "customer_id": customer[0],
+        "name": customer[1],
+        "address": customer[2],
+        "email": customer[3]
+    }
 
 @app.route("/customers", methods=['GET'])
 def get_all_customers():
+    query = """
+        SELECT customer_id, name, address, email 
+        FROM customers 
+        ORDER BY customer_id
+    """
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT customer_id, name, address, email 
-            FROM customers 
-            ORDER BY customer_id
-        """)
-        customers_data = cursor.fetchall()
-        
-        cursor.close()
-        conn.close()
+        # Opt-in streaming: one customer per line from a server-side cursor, constant memory
+        if wants_ndjson():
+            return ndjson_response(db_pool.stream(query), format_customer)
+
+        # Keyset pagination (newest first) when the client passes ?limit= or ?cursor=
+        page = page_request()
+        if page:
+            customers_data, next_cursor = fetch_page(
+                db_pool, "SELECT customer_id, name, address, email, created_at FROM customers",
+                "created_at", "customer_id", page,
+                cursor_key=lambda customer: (customer[4], customer[0])
+            )
+            return jsonify({
+                "code": 200,
+                "data": [format_customer(customer) for customer in customers_data],
+                "next": next_cursor
+            }), 200
+
+        with db_pool.read_cursor() as cursor:
+            cursor.execute(query)
+            customers_data = cursor.fetchall()
         
         if customers_data:
-            customers = []
-            for customer in customers_data:
-                customers.append({
-                    "customer_id": customer[0],
-                    "name": customer[1],
-                    "address": customer[2],
-                    "email": customer[3]
-                })
+            customers = [format_customer(customer) for customer in customers_data]
             
             return jsonify({
                 "code": 200,
@@ -87,6 +174,11 @@ def get_all_customers():
                 "message": "No customers found"
             }), 200
             
+    except InvalidCursor as e:
+        return jsonify({
+            "code": 400,
+            "message": str(e)
+        }), 400
     except Exception as e:
         return jsonify({
             "code": 500,
@@ -97,21 +189,26 @@ def get_all_customers():
 @app.route("/customer/<string:customer_id>", methods=['GET'])
 def get_customer(customer_id):
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT customer_id, name, address, email 
-            FROM customers 
-            WHERE customer_id = %s
-        """, (customer_id,))
-        customer_data = cursor.fetchone()
-        
-        cursor.close()
-        conn.close()
+        cached = customer_cache.get(customer_id)
+        if cached:
+            body, version = cached
+            return etag.not_modified(version) or etag.tag(
+                Response(body, status=200, mimetype="application/json"), version
+            )
+        token = customer_cache.token()
+
+        # A client revalidating its copy only needs the row version, not the row
+        not_modified = etag.revalidate(db_pool, CUSTOMER_VERSION, customer_id, primary=customer_cache.active)
+        if not_modified:
+            return not_modified
+
+        # Anything that may be cached is read from the primary, never from a lagging replica
+        with db_pool.read_cursor(primary=customer_cache.active) as cursor:
+            SELECT_CUSTOMER.execute(cursor, (customer_id,))
+            customer_data = cursor.fetchone()
         
         if customer_data:
-            return jsonify({
+            response = jsonify({
                 "code": 200,
                 "data": {
                     "customer_id": customer_data[0],
@@ -119,7 +216,9 @@ def get_customer(customer_id):
                     "address": customer_data[2],
                     "email": customer_data[3]
                 }
-            }), 200
+            })
+            customer_cache.set(customer_id, (response.get_data(), customer_data[4]), token)
+            return etag.tag(response, customer_data[4]), 200
         else:
             return jsonify({
                 "code": 404,
@@ -147,31 +246,46 @@ def create_customer():
                 }), 400
                 
         # Check if customer already exists
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT customer_id FROM customers WHERE customer_id = %s", (data["customer_id"],))
-        if cursor.fetchone():
-            # Update existing customer
-            cursor.execute(
-                """
-                UPDATE customers 
-                SET name = %s, address = %s, email = %s
-                WHERE customer_id = %s
-                RETURNING customer_id, name, address, email
-                """,
-                (
-                    data["name"],
-                    data["address"],
-                    data["email"],
-                    data["customer_id"]
+        with db_pool.transaction() as cursor:
+            cursor.execute("SELECT customer_id FROM customers WHERE customer_id = %s", (data["customer_id"],))
+            existing_customer = cursor.fetchone()
+            if existing_customer:
+                # Update existing customer
+                cursor.execute(
+                    """
+                    UPDATE customers 
+                    SET name = %s, address = %s, email = %s
+                    WHERE customer_id = %s
+                    RETURNING customer_id, name, address, email
+                    """,
+                    (
+                        data["name"],
+                        data["address"],
+                        data["email"],
+                        data["customer_id"]
+                    )
                 )
-            )
-            
-            updated_customer = cursor.fetchone()
-            conn.commit()
-            cursor.close()
-            conn.close()
-            
+                updated_customer = cursor.fetchone()
+                # Delivered on commit; other instances drop their cached copy
+                customer_cache.notify(cursor, data["customer_id"])
+            else:
+                # Create new customer
+                cursor.execute(
+                    """
+                    INSERT INTO customers (customer_id, name, address, email)
+                    VALUES (%s, %s, %s, %s)
+                    RETURNING customer_id, name, address, email
+                    """,
+                    (
+                        data["customer_id"],
+                        data["name"],
+                        data["address"],
+                        data["email"]
+                    )
+                )
+                new_customer = cursor.fetchone()
+
+        if existing_customer:
             return jsonify({
                 "code": 200,
                 "message": "Customer updated successfully",
@@ -183,26 +297,6 @@ def create_customer():
                 }
             }), 200
         
-        # Create new customer
-        cursor.execute(
-            """
-            INSERT INTO customers (customer_id, name, address, email)
-            VALUES (%s, %s, %s, %s)
-            RETURNING customer_id, name, address, email
-            """,
-            (
-                data["customer_id"],
-                data["name"],
-                data["address"],
-                data["email"]
-            )
-        )
-        
-        new_customer = cursor.fetchone()
-        conn.commit()
-        cursor.close()
-        conn.close()
-        
         return jsonify({
             "code": 201,
             "message": "Customer created successfully",
@@ -215,11 +309,6 @@ def create_customer():
         }), 201
         
     except Exception as e:
-        if 'conn' in locals():
-            conn.rollback()
-            if 'cursor' in locals():
-                cursor.close()
-            conn.close()
         return jsonify({
             "code": 500,
             "message": str(e)
@@ -240,28 +329,24 @@ def update_customer(customer_id):
                 }), 400
 
         # Update customer details in the database
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute(
-            """
-            UPDATE customers
-            SET name = %s, address = %s, email = %s
-            WHERE customer_id = %s
-            RETURNING customer_id, name, address, email
-            """,
-            (
-                data["name"],
-                data["address"],
-                data["email"],
-                customer_id
+        with db_pool.cursor() as cursor:
+            cursor.execute(
+                """
+                UPDATE customers
+                SET name = %s, address = %s, email = %s
+                WHERE customer_id = %s
+                RETURNING customer_id, name, address, email
+                """,
+                (
+                    data["name"],
+                    data["address"],
+                    data["email"],
+                    customer_id
+                )
             )
-        )
-        
-        updated_customer = cursor.fetchone()
-        conn.commit()
-        cursor.close()
-        conn.close()
+            updated_customer = cursor.fetchone()
+            if updated_customer:
+                customer_cache.notify(cursor, customer_id)
         
         if updated_customer:
             return jsonify({
@@ -281,22 +366,10 @@ def update_customer(customer_id):
             }), 404
 
     except Exception as e:
-        if 'conn' in locals():
-            conn.rollback()
-            if 'cursor' in locals():
-                cursor.close()
-            conn.close()
         return jsonify({
             "code": 500,
             "message": str(e)
         }), 500
 
 if __name__ == '__main__':
-    try:
-        ensure_database_exists()
-        # initialize_tables()
-    except Exception as e:
-        print(f"Failed to find database: {str(e)}")
-        exit(1)
-    
     app.run(host='0.0.0.0', port=5001)
\ No newline at end of file
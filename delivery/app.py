@@ -1,14 +1,25 @@
 from flask import Flask, jsonify, request
 from flask_cors import CORS
-import psycopg2
 import os
-import json
+import sys
 import uuid
 from datetime import datetime
-from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+# Add the project root to the Python path so the shared common package resolves
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+from common import compression, health, json_provider, log, metrics, profiling, tracing
+from common.db import DatabasePool
+from common.migrations import Migration, run_migrations
+
+# JSON log lines written off the request thread, at LOG_LEVEL
+log.setup("delivery")
 
 app = Flask(__name__)
 CORS(app)
+# orjson-backed jsonify that also encodes datetime, Decimal and UUID values
+json_provider.init_app(app)
+# gzip/brotli for large responses, negotiated through Accept-Encoding
+compression.init_app(app)
 
 # Database connection parameters
 DB_PARAMS = {
@@ -19,84 +30,60 @@ DB_PARAMS = {
     "port": os.getenv("DB_PORT", "5444"),  # Your host PostgreSQL port
 }
 
+# Connections are borrowed from a per-worker pool instead of opened per request
+db_pool = DatabasePool("delivery", DB_PARAMS)
+db_pool.init_app(app)
+# Prometheus /metrics: request latency per route and status, connection pool usage
+metrics.init_app(app, pools=[db_pool])
+# Server span per request, continuing the caller's W3C traceparent
+tracing.init_app(app, "delivery")
+# cProfile of requests carrying a signed X-Debug-Profile token (or sampled), kept at /debug/profiles
+profiling.init_app(app, "delivery")
+# /health and /ready served from a background check of the database every HEALTH_CHECK_INTERVAL seconds
+health_monitor = health.HealthMonitor("delivery")
+health_monitor.add_check("database", db_pool.ping)
+health_monitor.init_app(app)
 
-def ensure_database_exists():
-    """Ensure the delivery_db database exists"""
-    try:
-        # Connect to the default 'postgres' database to check/create our database
-        conn = psycopg2.connect(
-            dbname=DB_PARAMS["dbname"],
-            user=DB_PARAMS["user"],
-            password=DB_PARAMS["password"],
-            host=DB_PARAMS["host"],
-            port=DB_PARAMS["port"]
+# Versioned schema changes, applied once at process start instead of probed per request
+MIGRATIONS = [
+    Migration(1, "create deliveries table", """
+        CREATE TABLE IF NOT EXISTS deliveries (
+            delivery_id VARCHAR(255) PRIMARY KEY,
+            order_id VARCHAR(255) NOT NULL,
+            customer_id VARCHAR(255) NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
-        conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
-        cursor = conn.cursor()
-        
-        # Check if database exists
-        cursor.execute("SELECT 1 FROM pg_database WHERE datname = 'delivery_db'")
-        exists = cursor.fetchone()
-        
-        if not exists:
-            print("Creating database 'delivery_db'...")
-            cursor.execute("CREATE DATABASE delivery_db")
-            print("Database 'delivery_db' created successfully")
-        
-        cursor.close()
-        conn.close()
-        
-    except Exception as e:
-        print(f"Error ensuring database exists: {str(e)}")
-        raise
+    """),
+    Migration(2, "index deliveries.order_id", """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_deliveries_order_id ON deliveries (order_id)
+    """, transactional=False),
+]
 
-def get_db_connection():
-    """Get connection to our application database"""
-    ensure_database_exists()  # Make sure DB exists before connecting
-    conn = psycopg2.connect(**DB_PARAMS)
-    return conn
+# Create the database, tables and indexes once at process start
+run_migrations(db_pool, MIGRATIONS)
+
+# Hot queries, PREPAREd once per pooled connection and then executed by name
+SELECT_DELIVERY = db_pool.prepare("select_delivery", """
+    SELECT delivery_id, order_id, customer_id, created_at, updated_at
+    FROM deliveries
+    WHERE delivery_id = %s
+""")
+INSERT_DELIVERY = db_pool.prepare("insert_delivery", """
+    INSERT INTO deliveries (
+        delivery_id, order_id, customer_id,
+        created_at, updated_at
+    ) VALUES (%s, %s, %s, %s, %s)
+    RETURNING *
+""")
 
-# def initialize_tables():
-#     """Initialize the database tables for delivery service"""
-#     try:
-#         conn = get_db_connection()
-#         cursor = conn.cursor()
-        
-#         # Updated table schema with parts_list (JSON) and timestamp
-#         cursor.execute("""
-#             CREATE TABLE IF NOT EXISTS deliveries (
-#                 delivery_id VARCHAR PRIMARY KEY,
-#                 order_id VARCHAR NOT NULL,
-#                 customer_id VARCHAR NOT NULL,
-#                 parts_list JSONB NOT NULL,
-#                 created_at TIMESTAMP NOT NULL,
-#                 updated_at TIMESTAMP NOT NULL
-#             )
-#         """)
-#         conn.commit()
-#         cursor.close()
-#         conn.close()
-#         print("Delivery tables initialized successfully")
-#     except Exception as e:
-#         print(f"Error initializing delivery tables: {str(e)}")
-#         raise
 
 @app.route("/delivery/<string:delivery_id>", methods=['GET'])
 def get_delivery(delivery_id):
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT delivery_id, order_id, customer_id, 
-                created_at, updated_at
-            FROM deliveries 
-            WHERE delivery_id = %s
-        """, (delivery_id,))
-        delivery_data = cursor.fetchone()
-        
-        cursor.close()
-        conn.close()
+        with db_pool.read_cursor() as cursor:
+            SELECT_DELIVERY.execute(cursor, (delivery_id,))
+            delivery_data = cursor.fetchone()
         
         if delivery_data:
             return jsonify({
@@ -105,8 +92,8 @@ def get_delivery(delivery_id):
                     "delivery_id": delivery_data[0],
                     "order_id": delivery_data[1],
                     "customer_id": delivery_data[2],
-                    "created_at": delivery_data[3].isoformat(),
-                    "updated_at": delivery_data[4].isoformat()
+                    "created_at": delivery_data[3],
+                    "updated_at": delivery_data[4]
                 }
             }), 200
         else:
@@ -139,31 +126,19 @@ def create_delivery():
         delivery_id = str(uuid.uuid4())
         current_time = datetime.now()
         
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Create new delivery with auto-generated fields
-        cursor.execute(
-            """
-            INSERT INTO deliveries (
-                delivery_id, order_id, customer_id,
-                created_at, updated_at
-            ) VALUES (%s, %s, %s, %s, %s)
-            RETURNING *
-            """,
-            (
-                delivery_id,
-                data["order_id"],
-                data["customer_id"],
-                current_time,
-                current_time
+        with db_pool.cursor() as cursor:
+            # Create new delivery with auto-generated fields
+            INSERT_DELIVERY.execute(
+                cursor,
+                (
+                    delivery_id,
+                    data["order_id"],
+                    data["customer_id"],
+                    current_time,
+                    current_time
+                )
             )
-        )
-        
-        new_delivery = cursor.fetchone()
-        conn.commit()
-        cursor.close()
-        conn.close()
+            new_delivery = cursor.fetchone()
         
         return jsonify({
             "code": 201,
@@ -172,17 +147,12 @@ def create_delivery():
                 "delivery_id": new_delivery[0],
                 "order_id": new_delivery[1],
                 "customer_id": new_delivery[2],
-                "created_at": new_delivery[3].isoformat(),
-                "updated_at": new_delivery[4].isoformat()
+                "created_at": new_delivery[3],
+                "updated_at": new_delivery[4]
             }
         }), 201
         
     except Exception as e:
-        if 'conn' in locals():
-            conn.rollback()
-            if 'cursor' in locals():
-                cursor.close()
-            conn.close()
         return jsonify({
             "code": 500,
             "message": str(e)
@@ -194,9 +164,6 @@ def update_delivery(delivery_id):
         data = request.get_json()
         current_time = datetime.now()
         
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
         # Update only the fields that are provided
         update_fields = []
         update_values = []
@@ -227,11 +194,9 @@ def update_delivery(delivery_id):
         """
         update_values.append(delivery_id)
         
-        cursor.execute(update_query, update_values)
-        updated_delivery = cursor.fetchone()
-        conn.commit()
-        cursor.close()
-        conn.close()
+        with db_pool.cursor() as cursor:
+            cursor.execute(update_query, update_values)
+            updated_delivery = cursor.fetchone()
         
         if not updated_delivery:
             return jsonify({
@@ -246,29 +211,16 @@ def update_delivery(delivery_id):
                 "delivery_id": updated_delivery[0],
                 "order_id": updated_delivery[1],
                 "customer_id": updated_delivery[2],
-                "created_at": updated_delivery[3].isoformat(),
-                "updated_at": updated_delivery[4].isoformat()
+                "created_at": updated_delivery[3],
+                "updated_at": updated_delivery[4]
             }
         }), 200
         
     except Exception as e:
-        if 'conn' in locals():
-            conn.rollback()
-            if 'cursor' in locals():
-                cursor.close()
-            conn.close()
         return jsonify({
             "code": 500,
             "message": str(e)
         }), 500
 
 if __name__ == '__main__':
-    # First ensure database exists, then initialize tables
-    try:
-        ensure_database_exists()
-        # initialize_tables()
-    except Exception as e:
-        print(f"Failed to detect database: {str(e)}")
-        exit(1)
-    
     app.run(host='0.0.0.0', port=5003)
\ No newline at end of file
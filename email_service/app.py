@@ -3,22 +3,21 @@ from dotenv import load_dotenv
 import logging
 from flask import Flask, jsonify
 from flask_cors import CORS
-from sendgrid import SendGridAPIClient
-from sendgrid.helpers.mail import Mail
 import sys
 from datetime import datetime
 import json
 from email_service.refund_notifications import RefundNotifications
 from email_service.config import EmailConfig
+from common import health, log, metrics, profiling, tracing
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../amqp')))
-import amqp_setup as amqp_setup
+import amqp_setup
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Configure logging
-logging.basicConfig(level=logging.WARNING)
+# JSON log lines written off the consumer and request threads; LOG_LEVEL=DEBUG adds (truncated) messages
+log.setup("email_service")
 logger = logging.getLogger(__name__)
 
 # Verify environment variables are loaded
@@ -36,56 +35,32 @@ if not sender_email:
 else:
     logger.info(f"✅ EMAIL_FROM_ADDRESS found: {sender_email}")
 
-sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../amqp')))
-import amqp_setup
-
-# Configure logging with format
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s [%(levelname)s] %(message)s'
-)
-logger = logging.getLogger(__name__)
-
-# Set PIKA logging to WARNING level only
-logging.getLogger("pika").setLevel(logging.WARNING)
-# Keep our app logging at DEBUG for important info
-logger.setLevel(logging.DEBUG)
-
-# Add formatter for cleaner logs
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-handler = logging.StreamHandler()
-handler.setFormatter(formatter)
-logger.addHandler(handler)
-
 app = Flask(__name__)
 CORS(app)
+# Prometheus /metrics: request latency per route and status, SendGrid call latency
+metrics.init_app(app)
+# Server span per request, continuing the caller's W3C traceparent
+tracing.init_app(app, "email_service")
+# cProfile of requests carrying a signed X-Debug-Profile token (or sampled), kept at /debug/profiles
+profiling.init_app(app, "email_service")
 
 # Change the port configuration
 PORT = 5005  # Updated from 5001 to 5005
 
-# Test route to verify service is running
-@app.route('/health', methods=['GET'])
-def health_check():
-    """Check if service and its dependencies are healthy"""
-    try:
-        # Check RabbitMQ connection
-        amqp_setup.check_setup()
-        rabbitmq_status = "connected"
-    except Exception as e:
-        rabbitmq_status = f"error: {str(e)}"
+sendgrid_reachable = health.http("https://api.sendgrid.com")
 
-    # Check SendGrid configuration
-    sendgrid_key = os.environ.get('SENDGRID_API_KEY')
-    sendgrid_status = "configured" if sendgrid_key else "missing API key"
+def check_sendgrid():
+    """SendGrid is configured and its API answers"""
+    if not os.environ.get('SENDGRID_API_KEY'):
+        raise Exception("missing API key")
+    sendgrid_reachable()
 
-    return {
-        "status": "healthy",
-        "service": "email-notifications",
-        "dependencies": {
-            "rabbitmq": rabbitmq_status,
-            "sendgrid": sendgrid_status
-        }
-    }
+# /health and /ready served from background checks every HEALTH_CHECK_INTERVAL seconds, instead of
+# opening a broker connection (with its retries) on every probe
+health_monitor = health.HealthMonitor("email_service")
+health_monitor.add_check("broker", amqp_setup.ping)
+health_monitor.add_check("sendgrid", check_sendgrid, critical=False)
+health_monitor.init_app(app)
 
 # Add SendGrid configuration check
 def check_sendgrid_config():
@@ -113,6 +88,8 @@ def verify_sendgrid():
             logger.error("❌ SENDGRID_SENDER_EMAIL not set in environment")
             return False
             
+        # Imported on first use: SendGrid pulls in its HTTP client stack, which a worker booting doesn't need
+        from sendgrid import SendGridAPIClient
         sg = SendGridAPIClient(api_key)
         logger.info("✅ SendGrid configuration verified")
         return True
@@ -124,6 +101,8 @@ def verify_sendgrid():
 @app.route('/test-email', methods=['GET'])
 def test_email():
     try:
+        from sendgrid import SendGridAPIClient
+        from sendgrid.helpers.mail import Mail
         sg = SendGridAPIClient(os.environ.get('SENDGRID_API_KEY'))
         message = Mail(
             from_email=os.environ.get('SENDGRID_SENDER_EMAIL'),
@@ -142,7 +121,9 @@ def test_email():
             """
         )
         
-        response = sg.send(message)
+        with metrics.outbound("sendgrid", "POST") as call:
+            response = sg.send(message)
+            call.status = response.status_code
         return jsonify({
             "success": True,
             "details": {
@@ -161,14 +142,14 @@ def test_email():
             }
         }), 500
 
+@tracing.consumer("EmailNotifications")
 def callback(channel, method, properties, body):
     """Process email notifications"""
     try:
-        logger.warning("=================== New Message Received ===================")
-        logger.warning(f"Received message: {body}")
+        logger.debug("Received message: %s", log.body(body))
         
         event = json.loads(body)  # Parse the message
-        logger.warning(f"Processing notification event type: {event['type']}")
+        logger.info("Processing notification event type: %s", event['type'])
         
         if event['type'] in ['notification.email.refund_initiated', 'notification.email.refund']:
             customer_email = event['data'].get('customer_email')
@@ -208,9 +189,6 @@ def start_email_worker():
             logger.error("❌ Cannot start email worker - SendGrid not configured")
             return
         
-        # Initialize AMQP
-        amqp_setup.check_setup()
-        
         # Get a connection and channel using create_channel()
         connection, channel = amqp_setup.create_channel()
         
@@ -218,6 +196,9 @@ def start_email_worker():
             logger.error("❌ Failed to create RabbitMQ channel")
             return
         
+        # Declare the exchanges and queues (nothing is declared at import); the broker is up by now
+        amqp_setup.ensure_topology()
+        
         # Declare queue (in case it doesn't exist)
         channel.queue_declare(queue='EmailNotifications', durable=True)
         
@@ -235,6 +216,7 @@ def start_email_worker():
 
 if __name__ == '__main__':
     print("Starting Email Notification Service...")
+    health_monitor.start()
     # Start Flask app in one thread
     import threading
     threading.Thread(target=lambda: app.run(host='0.0.0.0', port=PORT, debug=False)).start()
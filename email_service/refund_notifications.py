@@ -1,8 +1,7 @@
 from email_service.sendgrid_client import EmailService
 from email_service.config import EmailConfig
-from sendgrid import SendGridAPIClient
-from sendgrid.helpers.mail import Mail
 import logging
+from common import log, metrics
 
 # Configure logger
 logger = logging.getLogger(__name__)
@@ -29,6 +28,9 @@ class RefundNotifications:
     @staticmethod
     def send_refund_initiated(customer_email, refund_data):
         try:
+            # Imported on first send so the service starts without loading SendGrid
+            from sendgrid import SendGridAPIClient
+            from sendgrid.helpers.mail import Mail
             sg = SendGridAPIClient(EmailConfig.SENDGRID_API_KEY)
             message = Mail(
                 from_email=EmailConfig.EMAIL_FROM_ADDRESS,
@@ -41,10 +43,12 @@ class RefundNotifications:
                 """
             )
             
-            response = sg.send(message)
-            logger.warning(f"SendGrid Response Code: {response.status_code}")
+            with metrics.outbound("sendgrid", "POST") as call:
+                response = sg.send(message)
+                call.status = response.status_code
+            logger.info("SendGrid Response Code: %s", response.status_code)
             if response.status_code >= 300:
-                logger.error(f"SendGrid Error: {response.body}")
+                logger.error("SendGrid Error: %s", log.body(response.body))
                 raise Exception(f"SendGrid error: {response.status_code}")
             return True
                 
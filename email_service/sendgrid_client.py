@@ -1,6 +1,8 @@
-from sendgrid import SendGridAPIClient
-from sendgrid.helpers.mail import Mail, Email, To, Content, TemplateId, DynamicTemplateData
+import logging
 from .config import EmailConfig
+from common import log, metrics
+
+logger = logging.getLogger(__name__)
 
 class EmailService:
     """SendGrid email service implementation"""
@@ -21,6 +23,10 @@ class EmailService:
             dict: Response with status and message
         """
         try:
+            # Imported on first send so the service starts without loading SendGrid
+            from sendgrid import SendGridAPIClient
+            from sendgrid.helpers.mail import Mail, Email, To, Content, TemplateId, DynamicTemplateData
+
             # Validate API key
             if not EmailConfig.SENDGRID_API_KEY:
                 return {
@@ -55,7 +61,9 @@ class EmailService:
             
             # Send via SendGrid
             sg = SendGridAPIClient(EmailConfig.SENDGRID_API_KEY)
-            response = sg.send(mail)
+            with metrics.outbound("sendgrid", "POST") as call:
+                response = sg.send(mail)
+                call.status = response.status_code
             
             # Process response
             if response.status_code >= 200 and response.status_code < 300:
@@ -65,7 +73,7 @@ class EmailService:
                     "status_code": response.status_code
                 }
             else:
-                print(f"Error sending email: HTTP Error {response.status_code}: {response.body.decode('utf-8') if response.body else 'No body'}")
+                logger.error("Error sending email: HTTP Error %s: %s", response.status_code, log.body(response.body or "No body"))
                 return {
                     "success": False,
                     "message": f"Failed to send email: HTTP {response.status_code}",
@@ -74,8 +82,7 @@ class EmailService:
                 }
                     
         except Exception as e:
-            # Log the error (replace with proper logging)
-            print(f"Error sending email: {str(e)}")
+            logger.error("Error sending email: %s", e)
             
             return {
                 "success": False,
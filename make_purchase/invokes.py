@@ -1,13 +1,20 @@
-import requests
+import os
+import sys
+import logging
+
+# Add the project root to the Python path so the shared common package resolves
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+from common import http_client, log, metrics, tracing
+
+logger = logging.getLogger(__name__)
 
 SUPPORTED_HTTP_METHODS = set([
     "GET", "OPTIONS", "HEAD", "POST", "PUT", "PATCH", "DELETE"
 ])
 
 def invoke_http(url, method='GET', json=None, **kwargs):
-    print(f"Invoking {method} request to {url}")
     if json:
-        print(f"Payload: {json}")
+        logger.debug("%s %s payload: %s", method, url, log.body(json))
 
     headers = {
         "Accept": "*/*",
@@ -20,11 +27,13 @@ def invoke_http(url, method='GET', json=None, **kwargs):
         if method.upper() not in SUPPORTED_HTTP_METHODS:
             raise Exception(f"HTTP method {method} unsupported.")
 
-        response = requests.request(method, url, headers=headers, json=json, **kwargs)
+        with tracing.client_span(method, url) as span, metrics.outbound(url, method) as call:
+            response = http_client.request(method, url, headers=tracing.inject(headers), json=json, **kwargs)
+            call.status = response.status_code
+            span.set_attribute("http.status_code", response.status_code)
 
-        print(">>> Final URL:", response.url)
-        print(">>> Status:", response.status_code)
-        print(">>> Response:", response.text)
+        logger.info("%s %s -> %s", method, response.url, response.status_code)
+        logger.debug("%s %s response: %s", method, response.url, log.body(response.content))
 
         try:
             result = response.json() if response.content else {}
@@ -2,19 +2,38 @@ from flask import Flask, jsonify, request
 from dotenv import load_dotenv
 load_dotenv()
 from flask_cors import CORS
-from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
 from invokes import invoke_http
-import pika
 from datetime import datetime
-import uuid
+import os
 import sys
 import requests
 from os import environ
-import json
+import logging
+
+# Add the project root to the Python path so the shared common package resolves
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+from common import health, http_client, json_provider, log, metrics, profiling, timing, tracing
+from common.admission import AdmissionControl
+
+# JSON log lines written off the request thread; LOG_LEVEL=DEBUG adds (truncated) payloads
+log.setup("make_purchase")
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 CORS(app)
+# orjson-backed jsonify that also encodes datetime, Decimal and UUID values
+json_provider.init_app(app)
+# Prometheus /metrics: request latency per route and status, outbound call latency per downstream
+metrics.init_app(app)
+# Server span per request, continuing the caller's W3C traceparent
+tracing.init_app(app, "make_purchase")
+# cProfile of requests carrying a signed X-Debug-Profile token (or sampled), kept at /debug/profiles
+profiling.init_app(app, "make_purchase")
+# Server-Timing header and a JSON log line with the duration of every orchestration step
+timing.init_app(app)
+# Per-route AIMD concurrency limits: shed load with 503 + Retry-After when downstreams slow down
+admission_control = AdmissionControl()
+admission_control.init_app(app)
 
 # Set default values for environment variables
 environ.setdefault("customerURL", "http://customer:5001/customer")
@@ -34,6 +53,15 @@ partpostURL = environ.get("partpostURL")
 deliveryURL = environ.get("deliveryURL")
 stripeURL = environ.get("stripeURL")
 
+# /health and /ready served from background checks of the downstreams every HEALTH_CHECK_INTERVAL seconds;
+# none is critical, an outage downstream is no reason to take this instance out of rotation
+health_monitor = health.HealthMonitor("make_purchase")
+for name, url in (("customer", customerURL), ("recommendation", recommendationURL), ("order", environ.get("orderURL")),
+                  ("delivery", deliveryURL), ("stripe", stripeURL)):
+    health_monitor.add_check(name, health.http(health.service_url(url)), critical=False)
+health_monitor.add_check("outsystems", health.http(health.service_url(partgetURL, "/")), critical=False)
+health_monitor.init_app(app)
+
 # In-memory session storage (in production, you'd use a database)
 session_store = {}
 
@@ -46,7 +74,7 @@ def make_purchase():
     # - using request.get_json(); users need to pass in 2 vairables
     # - recommendation_id and customer_id
     data = request.get_json()
-    print(data)
+    logger.debug("Initial purchase request: %s", log.body(data))
     required_fields = ["recommendation_id", "customer_id"]
     for field in required_fields:
         if field not in data:
@@ -68,15 +96,13 @@ def make_purchase():
     # - second get the parts list from the recommendation 
     # - get the parts id from parts list and get the stock count using parts id
     # - only proceed if stock count for the item is > 0
-    print("DEBUG recommendationURL:", recommendationURL)
     full_url = f"{recommendationURL}/{recommendation_id}"
-    print("DEBUG FULL URL:", full_url)
-    print("DEBUG ENV recommendationURL:", recommendationURL)
 
 
-    recommendation = invoke_http(full_url, method="GET")
+    with timing.step("recommendation"):
+        recommendation = invoke_http(full_url, method="GET")
 
-    print(recommendation)
+    logger.debug("Recommendation %s: %s", recommendation_id, log.body(recommendation))
     if recommendation.get("code") != 200:
         return jsonify (
             {
@@ -93,13 +119,12 @@ def make_purchase():
         try:
             # Construct the full API URL
             api_url = f"https://personal-0careuf6.outsystemscloud.com/ByteMeComponentService/rest/ComponentAPI/GetComponentById?ComponentId={part_id}"
-            response = requests.get(api_url)   # Make the GET request to OutSystems API
+            with timing.step("part_lookup", part_id), metrics.outbound(api_url, "GET") as call:
+                response = http_client.get(api_url)   # Make the GET request to OutSystems API
+                call.status = response.status_code
             response.raise_for_status()   # Check if the request was successful
             part = response.json()
-            
-            # Print to console
-            print("API Response:")
-            print(json.dumps(part, indent=2))
+            logger.debug("Component %s: %s", part_id, log.body(response.content))
 
             stock = part["Stock"]
                 
@@ -117,7 +142,7 @@ def make_purchase():
                 )
 
         except requests.exceptions.RequestException as e:
-            print(f"Error calling OutSystems API: {str(e)}")
+            logger.warning("Error calling OutSystems API for part %s: %s", part_id, e)
             return jsonify({
                 "status": "error",
                 "message": str(e)
@@ -128,7 +153,8 @@ def make_purchase():
     3. get customer entirety of customer details (GET request)
     """
     # - retrieve customer details to get their email to be stored in the delivery microservice
-    customer = invoke_http(f"{customerURL}/{customer_id}", method="GET")
+    with timing.step("customer"):
+        customer = invoke_http(f"{customerURL}/{customer_id}", method="GET")
     if customer.get("code") != 200:
         return jsonify (
             {
@@ -158,7 +184,8 @@ def make_purchase():
         "customer_email": customer_details["email"],   
     }
     
-    payment_response = invoke_http(f"{stripeURL}/create-checkout-session", method="POST", json=payment_payload)
+    with timing.step("stripe_session"):
+        payment_response = invoke_http(f"{stripeURL}/create-checkout-session", method="POST", json=payment_payload)
     
     if "url" not in payment_response:
         return jsonify(
@@ -182,7 +209,7 @@ def make_purchase():
         "timestamp": datetime.now().isoformat()
     }
     
-    print(f"Stored session data for {session_id}: {json.dumps(session_store[session_id], default=str)}")
+    logger.info("Stored session data for %s: customer_id=%s, parts_list=%s", session_id, customer_id, part_ids)
 
     checkout_details = {
         "session_id": session_id,
@@ -216,7 +243,7 @@ def get_session_data(session_id):
 @app.route("/final_purchase", methods=['POST'])
 def make_purchase_after_stripe():
     data = request.get_json()
-    print("Received data:", data)
+    logger.debug("Final purchase request: %s", log.body(data))
     
     # Check for either session_id or payment_intent
     session_id = data.get("session_id")
@@ -232,7 +259,7 @@ def make_purchase_after_stripe():
         customer_id = data.get("customer_id", session_data["customer_id"])
         parts_list = data.get("parts_list", session_data["parts_list"])
         parts_details = session_data.get("parts_details", [])
-        print(f"Retrieved session data for {session_id}: customer_id={customer_id}, parts_list={parts_list}")
+        logger.info("Retrieved session data for %s: customer_id=%s, parts_list=%s", session_id, customer_id, parts_list)
     else:
         # Check if both customer_id and parts_list are provided in the request
         if not data.get("customer_id") or not data.get("parts_list"):
@@ -244,9 +271,9 @@ def make_purchase_after_stripe():
     # If we have session_id, get payment_intent from it
     order_id = None
     if session_id:
-        print(f"Getting payment intent from session ID: {session_id}")
-        checkout_response = invoke_http(f"{stripeURL}/checkout-session?session_id={session_id}", method="GET")
-        print("Checkout response:", checkout_response)
+        with timing.step("stripe_checkout"):
+            checkout_response = invoke_http(f"{stripeURL}/checkout-session?session_id={session_id}", method="GET")
+        logger.debug("Checkout session %s: %s", session_id, log.body(checkout_response))
         
         if checkout_response.get("payment_intent") is None:
             return jsonify({"code": 402, "message": "Payment failed", "details": checkout_response}), 402
@@ -255,9 +282,7 @@ def make_purchase_after_stripe():
         # Use the provided payment_intent directly
         order_id = payment_intent_id
     
-    print(f"Using order ID: {order_id}")
-    print(f"Using customer ID: {customer_id}")
-    print(f"Using parts list: {parts_list}")
+    logger.info("Completing order %s for customer %s, parts %s", order_id, customer_id, parts_list)
 
     # Create the order
     order_data = {
@@ -266,9 +291,9 @@ def make_purchase_after_stripe():
         "parts_list": parts_list,
     }
     
-    print(f"Sending order data to order service: {order_data}")
-    order_response = invoke_http(f"{environ.get('orderURL')}/order", method="POST", json=order_data)
-    print(f"Order service response: {order_response}")
+    with timing.step("order_create"):
+        order_response = invoke_http(f"{environ.get('orderURL')}/order", method="POST", json=order_data)
+    logger.debug("Order service response: %s", log.body(order_response))
 
     if order_response.get("code") != 201:
         return jsonify({"code": 500, "message": f"Failed to create order: {order_response}"}), 500
@@ -281,12 +306,14 @@ def make_purchase_after_stripe():
         for part_id in parts_list:
             try:
                 api_url = f"https://personal-0careuf6.outsystemscloud.com/ByteMeComponentService/rest/ComponentAPI/GetComponentById?ComponentId={part_id}"
-                response = requests.get(api_url)
+                with timing.step("part_lookup", part_id), metrics.outbound(api_url, "GET") as call:
+                    response = http_client.get(api_url)
+                    call.status = response.status_code
                 response.raise_for_status()
                 part = response.json()
                 parts_details.append(part)
             except requests.exceptions.RequestException as e:
-                print(f"Error retrieving part {part_id}: {str(e)}")
+                logger.warning("Error retrieving part %s: %s", part_id, e)
                 # Continue with the next part, don't fail the whole order
     
     """
@@ -306,12 +333,14 @@ def make_purchase_after_stripe():
 
         try:
             api_url = f"https://personal-0careuf6.outsystemscloud.com/ByteMeComponentService/rest/ComponentAPI/UpdateComponent"
-            response = requests.put(api_url, json=part_data)
+            with timing.step("stock_update", part["Id"]), metrics.outbound(api_url, "PUT") as call:
+                response = http_client.put(api_url, json=part_data)
+                call.status = response.status_code
             response.raise_for_status()
-            print(f"Successfully updated stock for part ID {part['Id']}")
+            logger.debug("Updated stock for part ID %s", part["Id"])
 
         except requests.exceptions.RequestException as e:
-            print(f"Failed to update part ID {part['Id']}: {str(e)}")
+            logger.warning("Failed to update part ID %s: %s", part["Id"], e)
             # Continue with the next part, don't fail the whole order
         
     """
@@ -324,9 +353,9 @@ def make_purchase_after_stripe():
         "customer_id":customer_id
     }
     
-    print(f"Sending delivery data: {delivery_data}")
-    delivery_response = invoke_http(f"{deliveryURL}/delivery", method="POST", json=delivery_data)
-    print(f"Delivery response: {delivery_response}")
+    with timing.step("delivery_create"):
+        delivery_response = invoke_http(f"{deliveryURL}/delivery", method="POST", json=delivery_data)
+    logger.debug("Delivery service response: %s", log.body(delivery_response))
     
     if delivery_response.get("code") != 201:
         return jsonify({"code": 500, "message": f"Failed to create delivery: {delivery_response}"}), 500
@@ -334,7 +363,7 @@ def make_purchase_after_stripe():
     # Clean up the session data now that order is complete
     if session_id in session_store:
         del session_store[session_id]
-        print(f"Removed session data for {session_id}")
+        logger.debug("Removed session data for %s", session_id)
     
     # Return final confirmation
     return jsonify({
@@ -1,14 +1,30 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
 from flask_cors import CORS
-import psycopg2
 import os
+import sys
 import json
-import uuid
+import itertools
 from datetime import datetime
-from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+# Add the project root to the Python path so the shared common package resolves
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+from common.cache import InvalidatingCache
+from common import compression, etag, health, json_provider, log, metrics, profiling, tracing
+from common.db import DatabasePool
+from common.migrations import Migration, run_migrations
+from common.streaming import wants_ndjson, ndjson_response
+from common.pagination import InvalidCursor, page_request, fetch_page, keyset_query, merge_pages
+from common.sharding import DIRECTORY_TABLE, ShardSet
+
+# JSON log lines written off the request thread, at LOG_LEVEL
+log.setup("order")
 
 app = Flask(__name__)
 CORS(app)
+# orjson-backed jsonify that also encodes datetime, Decimal and UUID values
+json_provider.init_app(app)
+# gzip/brotli for large responses, negotiated through Accept-Encoding
+compression.init_app(app)
 
 # Database connection parameters
 DB_PARAMS = {
@@ -19,95 +35,166 @@ DB_PARAMS = {
     "port": os.getenv("DB_PORT", "5444"),  # Your host PostgreSQL port
 }
 
+# Connections are borrowed from a per-worker pool instead of opened per request
+db_pool = DatabasePool("order", DB_PARAMS)
+db_pool.init_app(app)
 
-def ensure_database_exists():
-    """Ensure the order_db database exists"""
-    try:
-        # Connect to the default 'postgres' database to check/create our database
-        conn = psycopg2.connect(
-            dbname=DB_PARAMS["dbname"],
-            user=DB_PARAMS["user"],
-            password=DB_PARAMS["password"],
-            host=DB_PARAMS["host"],
-            port=DB_PARAMS["port"]
+# Per-worker cache of GET /order/<id> bodies, evicted across instances through NOTIFY order_changes
+order_cache = InvalidatingCache(db_pool, "order_changes")
+order_cache.init_app(app)
+
+# Optional hash sharding of orders by customer_id across the DSNs in ORDER_SHARD_DSNS;
+# order_db then keeps the order_id -> shard directory (and the cache channel)
+order_shards = ShardSet.from_env("order", "ORDER_SHARD_DSNS", db_pool)
+order_shards.init_app(app)
+# Prometheus /metrics: request latency per route and status, connection pool usage (shards included)
+metrics.init_app(app, pools=[db_pool, *order_shards.pools.values()])
+# Server span per request, continuing the caller's W3C traceparent
+tracing.init_app(app, "order")
+# cProfile of requests carrying a signed X-Debug-Profile token (or sampled), kept at /debug/profiles
+profiling.init_app(app, "order")
+# /health and /ready served from a background check of the database every HEALTH_CHECK_INTERVAL seconds
+health_monitor = health.HealthMonitor("order")
+health_monitor.add_check("database", db_pool.ping)
+for shard_name, shard_pool in order_shards.pools.items():
+    if shard_pool is not db_pool:
+        health_monitor.add_check(f"shard_{shard_name}", shard_pool.ping)
+health_monitor.init_app(app)
+
+# Versioned schema changes, applied once at process start instead of probed per request
+MIGRATIONS = [
+    Migration(1, "create orders table", """
+        CREATE TABLE IF NOT EXISTS orders (
+            order_id VARCHAR(255) PRIMARY KEY,
+            customer_id VARCHAR(255) NOT NULL,
+            parts_list JSONB NOT NULL,
+            status VARCHAR(20) NOT NULL DEFAULT 'pending',
+            timestamp TIMESTAMP NOT NULL
         )
-        conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
-        cursor = conn.cursor()
-        
-        # Check if database exists
-        cursor.execute("SELECT 1 FROM pg_database WHERE datname = 'order_db'")
-        exists = cursor.fetchone()
-        
-        if not exists:
-            print("Creating database 'order_db'...")
-            cursor.execute("CREATE DATABASE order_db")
-            print("Database 'order_db' created successfully")
-        
-        cursor.close()
-        conn.close()
-        
-    except Exception as e:
-        print(f"Error ensuring database exists: {str(e)}")
-        raise
+    """),
+    # Serves /order/customers/<id>; built concurrently so writes keep flowing on large tables
+    Migration(2, "index orders.customer_id", """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_orders_customer_id ON orders (customer_id)
+    """, transactional=False),
+    # Keyset pagination seeks on (timestamp, order_id), newest first
+    Migration(3, "index orders (timestamp, order_id)", """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_orders_timestamp_id ON orders (timestamp, order_id)
+    """, transactional=False),
+    Migration(4, "index orders (customer_id, timestamp, order_id)", """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_orders_customer_timestamp_id
+        ON orders (customer_id, timestamp, order_id)
+    """, transactional=False),
+    # Covered by the composite index above; dropping it saves a write per insert
+    Migration(5, "drop idx_orders_customer_id", """
+        DROP INDEX CONCURRENTLY IF EXISTS idx_orders_customer_id
+    """, transactional=False),
+    # Only written to while ORDER_SHARD_DSNS is set
+    Migration(6, "create shard_directory", DIRECTORY_TABLE),
+]
 
-def get_db_connection():
-    """Get connection to our application database"""
-    ensure_database_exists()  # Make sure DB exists before connecting
-    conn = psycopg2.connect(**DB_PARAMS)
-    return conn
+ORDER_SELECT = "SELECT order_id, customer_id, parts_list, status, timestamp FROM orders"
+
+# Finds orders missing from the shard directory, e.g. ones written before sharding was enabled
+ORDER_EXISTS = "SELECT 1 FROM orders WHERE order_id = %s"
+
+# Let Postgres build read responses with json_build_object/json_agg and pass the bytes through
+PG_JSON_RENDERING = os.getenv("PG_JSON_RENDERING", "False").lower() in ('true', '1', 't')
+
+# Postgres-side equivalent of format_order()
+ORDER_JSON = """
+    json_build_object(
+        'order_id', order_id,
+        'customer_id', customer_id,
+        'parts_list', parts_list,
+        'status', status,
+        'timestamp', timestamp
+    )
+"""
+
+# Create the database, tables and indexes once at process start
+run_migrations(db_pool, MIGRATIONS)
+order_shards.migrate(MIGRATIONS)
+
+# Hot queries, PREPAREd once per pooled connection and then executed by name
+SELECT_ORDER = db_pool.prepare("select_order", f"""
+    SELECT order_id, customer_id, parts_list, status, timestamp, {etag.VERSION_COLUMN}
+    FROM orders
+    WHERE order_id = %s
+""")
+# Answers If-None-Match without fetching the row
+ORDER_VERSION = db_pool.prepare("order_version", f"""
+    SELECT {etag.VERSION_COLUMN} FROM orders WHERE order_id = %s
+""")
+INSERT_ORDER = db_pool.prepare("insert_order", """
+    INSERT INTO orders (
+        order_id, customer_id, parts_list, status, timestamp
+    ) VALUES (%s, %s, %s::jsonb, %s, %s)
+    RETURNING *
+""")
+
+def format_order(order):
+    """Convert an orders row into its JSON representation"""
+    return {
+        "order_id": order[0],
+        "customer_id": order[1],
+        "parts_list": order[2],
+        "status": order[3],
+        "timestamp": order[4]
+    }
 
-def initialize_tables():
-    """Initialize the database tables for order service"""
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Simplified order table schema doesn't exist
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS orders (
-                order_id VARCHAR PRIMARY KEY,
-                customer_id VARCHAR NOT NULL,
-                parts_list JSONB NOT NULL,
-                status VARCHAR(20) NOT NULL DEFAULT 'pending',
-                timestamp TIMESTAMP NOT NULL
-            )
-        """)
-        
-        conn.commit()
-        cursor.close()
-        conn.close()
-        print("Order tables initialized successfully")
-    except Exception as e:
-        print(f"Error initializing order tables: {str(e)}")
-        raise
 
 @app.route("/order/<string:order_id>", methods=['GET'])
 def get_order(order_id):
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT order_id, customer_id, parts_list, status, timestamp
-            FROM orders 
-            WHERE order_id = %s
-        """, (order_id,))
-        order_data = cursor.fetchone()
-        
-        cursor.close()
-        conn.close()
+        cached = order_cache.get(order_id)
+        if cached:
+            body, version = cached
+            return etag.not_modified(version) or etag.tag(
+                Response(body, status=200, mimetype="application/json"), version
+            )
+        token = order_cache.token()
+        # Anything that may be cached is read from the primary, never from a lagging replica
+        primary = order_cache.active
+        # The shard holding the order; None when no shard has it
+        pool = order_shards.locate(order_id, ORDER_EXISTS)
+
+        # A client revalidating its copy only needs the row version, not the row
+        not_modified = pool is not None and etag.revalidate(pool, ORDER_VERSION, order_id, primary=primary)
+        if not_modified:
+            return not_modified
+
+        if pool is None:
+            order_data = None
+        elif PG_JSON_RENDERING:
+            # Postgres renders the whole response body; Python only forwards the bytes
+            row = pool.fetch_json_row(f"""
+                SELECT json_build_object('code', 200, 'data', {ORDER_JSON})::text, {etag.VERSION_COLUMN}
+                FROM orders
+                WHERE order_id = %s
+            """, (order_id,), primary=primary)
+            if row:
+                body, version = row[0], row[1].decode()
+                order_cache.set(order_id, (body, version), token)
+                return etag.tag(Response(body, status=200, mimetype="application/json"), version)
+            order_data = None
+        else:
+            with pool.read_cursor(primary=primary) as cursor:
+                SELECT_ORDER.execute(cursor, (order_id,))
+                order_data = cursor.fetchone()
         
         if order_data:
-            return jsonify({
+            response = jsonify({
                 "code": 200,
                 "data": {
                     "order_id": order_data[0],
                     "customer_id": order_data[1],
                     "parts_list": order_data[2],
                     "status": order_data[3],
-                    "timestamp": order_data[4].isoformat()
+                    "timestamp": order_data[4]
                 }
-            }), 200
+            })
+            order_cache.set(order_id, (response.get_data(), order_data[5]), token)
+            return etag.tag(response, order_data[5]), 200
         else:
             return jsonify({
                 "code": 404,
@@ -123,18 +210,42 @@ def get_order(order_id):
 @app.route("/order/customers/<string:customer_id>", methods=['GET'])
 def get_orders_by_customer(customer_id):
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT order_id, customer_id, parts_list, status, timestamp
-            FROM orders 
-            WHERE customer_id = %s
-        """, (customer_id,))
-        orders_data = cursor.fetchall()
-        
-        cursor.close()
-        conn.close()
+        # All of a customer's orders live on one shard
+        pool = order_shards.for_key(customer_id)
+
+        # Keyset pagination when the client passes ?limit= or ?cursor=
+        page = page_request()
+        if page:
+            orders_data, next_cursor = fetch_page(
+                pool, ORDER_SELECT, "timestamp", "order_id", page,
+                cursor_key=lambda order: (order[4], order[0]),
+                filters=["customer_id = %s"], params=[customer_id]
+            )
+            return jsonify({
+                "code": 200,
+                "data": [format_order(order) for order in orders_data],
+                "next": next_cursor
+            }), 200
+
+        if PG_JSON_RENDERING:
+            # Postgres renders the whole response body; Python only forwards the bytes
+            body = pool.fetch_json(f"""
+                SELECT json_build_object('code', 200, 'data', json_agg({ORDER_JSON}))::text
+                FROM orders
+                WHERE customer_id = %s
+                HAVING count(*) > 0
+            """, (customer_id,))
+            if body:
+                return Response(body, status=200, mimetype="application/json")
+            orders_data = None
+        else:
+            with pool.read_cursor() as cursor:
+                cursor.execute("""
+                    SELECT order_id, customer_id, parts_list, status, timestamp
+                    FROM orders 
+                    WHERE customer_id = %s
+                """, (customer_id,))
+                orders_data = cursor.fetchall()
         
         if orders_data:
             orders = []
@@ -144,7 +255,7 @@ def get_orders_by_customer(customer_id):
                     "customer_id": order[1],
                     "parts_list": order[2],
                     "status": order[3],
-                    "timestamp": order[4].isoformat()
+                    "timestamp": order[4]
                 })
             
             return jsonify({
@@ -157,6 +268,11 @@ def get_orders_by_customer(customer_id):
                 "message": "No orders found for this customer"
             }), 404
             
+    except InvalidCursor as e:
+        return jsonify({
+            "code": 400,
+            "message": str(e)
+        }), 400
     except Exception as e:
         return jsonify({
             "code": 500,
@@ -188,30 +304,21 @@ def create_order():
         order_id = data.get("order_id")
         current_time = datetime.now()
         
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Create new order with default status 'pending'
-        cursor.execute(
-            """
-            INSERT INTO orders (
-                order_id, customer_id, parts_list, status, timestamp
-            ) VALUES (%s, %s, %s::jsonb, %s, %s)
-            RETURNING *
-            """,
-            (
-                order_id,
-                data["customer_id"],
-                json.dumps(data["parts_list"]),
-                "pending",  # Default status
-                current_time
-            )
-        )
-        
-        new_order = cursor.fetchone()
-        conn.commit()
-        cursor.close()
-        conn.close()
+        # Written to the customer's shard, and recorded in the shard directory when sharded
+        with order_shards.assign(order_id, data["customer_id"]) as pool:
+            with pool.cursor() as cursor:
+                # Create new order with default status 'pending'
+                INSERT_ORDER.execute(
+                    cursor,
+                    (
+                        order_id,
+                        data["customer_id"],
+                        json.dumps(data["parts_list"]),
+                        "pending",  # Default status
+                        current_time
+                    )
+                )
+                new_order = cursor.fetchone()
         
         return jsonify({
             "code": 201,
@@ -221,16 +328,11 @@ def create_order():
                 "customer_id": new_order[1],
                 "parts_list": new_order[2],
                 "status": new_order[3],
-                "timestamp": new_order[4].isoformat()
+                "timestamp": new_order[4]
             }
         }), 201
         
     except Exception as e:
-        if 'conn' in locals():
-            conn.rollback()
-            if 'cursor' in locals():
-                cursor.close()
-            conn.close()
         return jsonify({
             "code": 500,
             "message": str(e)
@@ -238,29 +340,56 @@ def create_order():
 
 @app.route("/order", methods=['GET'])
 def get_all_orders():
+    query = """
+        SELECT order_id, customer_id, parts_list, status, timestamp
+        FROM orders
+    """
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        # Opt-in streaming: one order per line from a server-side cursor, constant memory
+        if wants_ndjson():
+            return ndjson_response(order_shards.stream(query), format_order)
 
-        cursor.execute("""
-            SELECT order_id, customer_id, parts_list, status, timestamp
-            FROM orders
-        """)
-        orders = cursor.fetchall()  # Fetch all results
+        # Keyset pagination when the client passes ?limit= or ?cursor=
+        page = page_request()
+        if page:
+            # Every shard returns its own newest-first page; they are merged into one
+            page_query, page_params = keyset_query(ORDER_SELECT, "timestamp", "order_id", page)
+            orders, next_cursor = merge_pages(
+                order_shards.fetchall(page_query, page_params), page,
+                cursor_key=lambda order: (order[4], order[0])
+            )
+            return jsonify({
+                "code": 200,
+                "data": [format_order(order) for order in orders],
+                "next": next_cursor
+            }), 200
 
-        cursor.close()
-        conn.close()
+        if PG_JSON_RENDERING and order_shards.sharded:
+            # Each shard renders its own array; the arrays are spliced together without parsing
+            arrays = order_shards.scatter(
+                lambda pool: pool.fetch_json(f"SELECT json_agg({ORDER_JSON})::text FROM orders")
+            )
+            items = [array[1:-1] for array in arrays if array]
+            if items:
+                body = b'{"code" : 200, "data" : [' + b", ".join(items) + b"]}"
+                return Response(body, status=200, mimetype="application/json")
+            orders = None
+        elif PG_JSON_RENDERING:
+            # Postgres renders the whole response body; Python only forwards the bytes
+            body = db_pool.fetch_json(f"""
+                SELECT json_build_object('code', 200, 'data', json_agg({ORDER_JSON}))::text
+                FROM orders
+                HAVING count(*) > 0
+            """)
+            if body:
+                return Response(body, status=200, mimetype="application/json")
+            orders = None
+        else:
+            # Queried on all shards in parallel
+            orders = list(itertools.chain.from_iterable(order_shards.fetchall(query)))
 
         if orders:
-            order_list = []
-            for order in orders:
-                order_list.append({
-                    "order_id": order[0],
-                    "customer_id": order[1],
-                    "parts_list": order[2],
-                    "status": order[3],
-                    "timestamp": order[4].isoformat()
-                })
+            order_list = [format_order(order) for order in orders]
 
             return jsonify({
                 "code": 200,
@@ -272,6 +401,11 @@ def get_all_orders():
                 "message": "No orders found"
             }), 404
 
+    except InvalidCursor as e:
+        return jsonify({
+            "code": 400,
+            "message": str(e)
+        }), 400
     except Exception as e:
         return jsonify({
             "code": 500,
@@ -299,34 +433,25 @@ def update_order_status(order_id):
                 "message": f"Invalid status. Must be one of: {', '.join(valid_statuses)}"
             }), 400
         
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Check if order exists
-        cursor.execute("SELECT order_id FROM orders WHERE order_id = %s", (order_id,))
-        if not cursor.fetchone():
-            cursor.close()
-            conn.close()
-            return jsonify({
-                "code": 404,
-                "message": "Order not found"
-            }), 404
-        
-        # Update the order status
-        cursor.execute(
-            """
-            UPDATE orders 
-            SET status = %s
-            WHERE order_id = %s
-            RETURNING order_id, customer_id, parts_list, status, timestamp
-            """,
-            (status, order_id)
-        )
-        
-        updated_order = cursor.fetchone()
-        conn.commit()
-        cursor.close()
-        conn.close()
+        # The UPDATE ... RETURNING doubles as the existence check
+        pool = order_shards.locate(order_id, ORDER_EXISTS)
+        updated_order = None
+        if pool is not None:
+            with pool.cursor() as cursor:
+                cursor.execute(
+                    """
+                    UPDATE orders 
+                    SET status = %s
+                    WHERE order_id = %s
+                    RETURNING order_id, customer_id, parts_list, status, timestamp
+                    """,
+                    (status, order_id)
+                )
+                updated_order = cursor.fetchone()
+        if updated_order:
+            # Cache listeners are on order_db, which is not necessarily the order's shard
+            with db_pool.cursor() as cursor:
+                order_cache.notify(cursor, order_id)
         
         if updated_order:
             return jsonify({
@@ -337,14 +462,14 @@ def update_order_status(order_id):
                     "customer_id": updated_order[1],
                     "parts_list": updated_order[2],
                     "status": updated_order[3],
-                    "timestamp": updated_order[4].isoformat()
+                    "timestamp": updated_order[4]
                 }
             }), 200
         else:
             return jsonify({
-                "code": 500,
-                "message": "Failed to update order status"
-            }), 500
+                "code": 404,
+                "message": "Order not found"
+            }), 404
             
     except Exception as e:
         return jsonify({
@@ -357,33 +482,24 @@ def update_order_status(order_id):
 def delete_order(order_id):
     """Delete an order by its ID"""
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Check if order exists first
-        cursor.execute("SELECT order_id FROM orders WHERE order_id = %s", (order_id,))
-        if not cursor.fetchone():
-            cursor.close()
-            conn.close()
-            return jsonify({
-                "code": 404,
-                "message": "Order not found"
-            }), 404
-        
-        # Delete the order
-        cursor.execute(
-            """
-            DELETE FROM orders 
-            WHERE order_id = %s
-            RETURNING order_id
-            """,
-            (order_id,)
-        )
-        
-        deleted_order = cursor.fetchone()
-        conn.commit()
-        cursor.close()
-        conn.close()
+        # The DELETE ... RETURNING doubles as the existence check
+        pool = order_shards.locate(order_id, ORDER_EXISTS)
+        deleted_order = None
+        if pool is not None:
+            with pool.cursor() as cursor:
+                cursor.execute(
+                    """
+                    DELETE FROM orders 
+                    WHERE order_id = %s
+                    RETURNING order_id
+                    """,
+                    (order_id,)
+                )
+                deleted_order = cursor.fetchone()
+        if deleted_order:
+            with db_pool.cursor() as cursor:
+                order_shards.forget(cursor, order_id)
+                order_cache.notify(cursor, order_id)
         
         if deleted_order:
             return jsonify({
@@ -395,27 +511,15 @@ def delete_order(order_id):
             }), 200
         else:
             return jsonify({
-                "code": 500,
-                "message": "Failed to delete order"
-            }), 500
+                "code": 404,
+                "message": "Order not found"
+            }), 404
             
     except Exception as e:
-        if 'conn' in locals():
-            conn.rollback()
-            if 'cursor' in locals():
-                cursor.close()
-            conn.close()
         return jsonify({
             "code": 500,
             "message": str(e)
         }), 500
 
 if __name__ == '__main__':
-    # Only ensure the database exists, no table initialization
-    try:
-        ensure_database_exists()
-    except Exception as e:
-        print(f"Failed to ensure database exists: {str(e)}")
-        exit(1)
-    
     app.run(host='0.0.0.0', port=5002)
\ No newline at end of file
@@ -1,14 +1,30 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
 from flask_cors import CORS
-import psycopg2
 import os
+import sys
+import logging
 import json
 import uuid
 from datetime import datetime
-from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+# Add the project root to the Python path so the shared common package resolves
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+from common import compression, etag, health, json_provider, log, metrics, profiling, tracing
+from common.db import DatabasePool
+from common.migrations import Migration, run_migrations
+from common.streaming import wants_ndjson, ndjson_response
+from common.pagination import InvalidCursor, page_request, fetch_page
+
+# JSON log lines written off the request thread, at LOG_LEVEL
+log.setup("recommendation")
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 CORS(app)
+# orjson-backed jsonify that also encodes datetime, Decimal and UUID values
+json_provider.init_app(app)
+# gzip/brotli for large responses, negotiated through Accept-Encoding
+compression.init_app(app)
 
 # Database connection parameters
 DB_PARAMS = {
@@ -19,71 +35,128 @@ DB_PARAMS = {
     "port": os.getenv("DB_PORT", "5432"),  # Your host PostgreSQL port
 }
 
+# Connections are borrowed from a per-worker pool instead of opened per request
+db_pool = DatabasePool("recommendation", DB_PARAMS)
+db_pool.init_app(app)
+# Prometheus /metrics: request latency per route and status, connection pool usage
+metrics.init_app(app, pools=[db_pool])
+# Server span per request, continuing the caller's W3C traceparent
+tracing.init_app(app, "recommendation")
+# cProfile of requests carrying a signed X-Debug-Profile token (or sampled), kept at /debug/profiles
+profiling.init_app(app, "recommendation")
+# /health and /ready served from a background check of the database every HEALTH_CHECK_INTERVAL seconds
+health_monitor = health.HealthMonitor("recommendation")
+health_monitor.add_check("database", db_pool.ping)
+health_monitor.init_app(app)
 
-def ensure_database_exists():
-    """Ensure the recommendation_db database exists"""
-    try:
-        # Connect to the default 'postgres' database to check/create our database
-        conn = psycopg2.connect(
-            dbname=DB_PARAMS["dbname"],
-            user=DB_PARAMS["user"],
-            password=DB_PARAMS["password"],
-            host=DB_PARAMS["host"],
-            port=DB_PARAMS["port"]
+# Versioned schema changes, applied once at process start instead of probed per request
+MIGRATIONS = [
+    Migration(1, "create recommendations table", """
+        CREATE TABLE IF NOT EXISTS recommendations (
+            recommendation_id VARCHAR(255) PRIMARY KEY,
+            customer_id VARCHAR(255) NOT NULL,
+            name VARCHAR(255) NOT NULL,
+            cost DECIMAL(10, 2) NOT NULL,
+            parts_list JSONB NOT NULL,
+            timestamp TIMESTAMP NOT NULL
         )
-        conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
-        cursor = conn.cursor()  
-        
-        # Check if database exists
-        cursor.execute("SELECT 1 FROM pg_database WHERE datname = 'recommendation_db'")
-        exists = cursor.fetchone()
-        
-        if not exists:
-            print("Creating database 'recommendation_db'...")
-            cursor.execute("CREATE DATABASE recommendation_db")
-            print("Database 'recommendation_db' created successfully")
-        
-        cursor.close()
-        conn.close()
-        
-    except Exception as e:
-        print(f"Error ensuring database exists: {str(e)}")
-        raise
+    """),
+    Migration(2, "index recommendations.customer_id", """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_recommendations_customer_id ON recommendations (customer_id)
+    """, transactional=False),
+    # Keyset pagination seeks on (customer_id, timestamp, recommendation_id), newest first
+    Migration(3, "index recommendations (customer_id, timestamp, recommendation_id)", """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_recommendations_customer_timestamp_id
+        ON recommendations (customer_id, timestamp, recommendation_id)
+    """, transactional=False),
+    # Covered by the composite index above; dropping it saves a write per insert
+    Migration(4, "drop idx_recommendations_customer_id", """
+        DROP INDEX CONCURRENTLY IF EXISTS idx_recommendations_customer_id
+    """, transactional=False),
+]
+
+# Create the database, tables and indexes once at process start
+run_migrations(db_pool, MIGRATIONS)
+
+# Hot queries, PREPAREd once per pooled connection and then executed by name
+SELECT_RECOMMENDATION = db_pool.prepare("select_recommendation", f"""
+    SELECT recommendation_id, customer_id, name, parts_list, cost, timestamp, {etag.VERSION_COLUMN}
+    FROM recommendations
+    WHERE recommendation_id = %s
+""")
+# Answers If-None-Match without fetching the row
+RECOMMENDATION_VERSION = db_pool.prepare("recommendation_version", f"""
+    SELECT {etag.VERSION_COLUMN} FROM recommendations WHERE recommendation_id = %s
+""")
+INSERT_RECOMMENDATION = db_pool.prepare("insert_recommendation", """
+    INSERT INTO recommendations (
+        recommendation_id, customer_id, name, parts_list, cost, timestamp
+    ) VALUES (%s, %s, %s, %s::jsonb, %s, %s)
+    RETURNING *
+""")
+
+# Let Postgres build read responses with json_build_object/json_agg and pass the bytes through
+PG_JSON_RENDERING = os.getenv("PG_JSON_RENDERING", "False").lower() in ('true', '1', 't')
+
+# Postgres-side equivalent of format_recommendation()
+RECOMMENDATION_JSON = """
+    json_build_object(
+        'recommendation_id', recommendation_id,
+        'customer_id', customer_id,
+        'name', name,
+        'parts_list', parts_list,
+        'cost', cost::float8,
+        'timestamp', timestamp
+    )
+"""
+
+def format_recommendation(rec):
+    """Convert a recommendations row into its JSON representation"""
+    return {
+        "recommendation_id": rec[0],
+        "customer_id": rec[1],
+        "name": rec[2],
+        "parts_list": rec[3],  # Directly return the list of integers
+        "cost": rec[4],
+        "timestamp": rec[5]
+    }
 
-def get_db_connection():
-    """Get connection to our application database"""
-    ensure_database_exists()  # Make sure DB exists before connecting
-    conn = psycopg2.connect(**DB_PARAMS)
-    return conn
 
 @app.route("/recommendation/<string:recommendation_id>", methods=['GET'])
 def get_recommendation(recommendation_id):
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT recommendation_id, customer_id, name, parts_list, cost, timestamp
-            FROM recommendations 
-            WHERE recommendation_id = %s
-        """, (recommendation_id,))
-        recommendation_data = cursor.fetchone()
-        
-        cursor.close()
-        conn.close()
+        # A client revalidating its copy only needs the row version, not the row
+        not_modified = etag.revalidate(db_pool, RECOMMENDATION_VERSION, recommendation_id)
+        if not_modified:
+            return not_modified
+
+        if PG_JSON_RENDERING:
+            # Postgres renders the whole response body; Python only forwards the bytes
+            row = db_pool.fetch_json_row(f"""
+                SELECT json_build_object('code', 200, 'data', {RECOMMENDATION_JSON})::text, {etag.VERSION_COLUMN}
+                FROM recommendations
+                WHERE recommendation_id = %s
+            """, (recommendation_id,))
+            if row:
+                return etag.tag(Response(row[0], status=200, mimetype="application/json"), row[1].decode())
+            recommendation_data = None
+        else:
+            with db_pool.read_cursor() as cursor:
+                SELECT_RECOMMENDATION.execute(cursor, (recommendation_id,))
+                recommendation_data = cursor.fetchone()
         
         if recommendation_data:
-            return jsonify({
+            return etag.tag(jsonify({
                 "code": 200,
                 "data": {
                     "recommendation_id": recommendation_data[0],
                     "customer_id": recommendation_data[1],
                     "name": recommendation_data[2],
                     "parts_list": recommendation_data[3],  # Directly return the list of integers
-                    "cost": float(recommendation_data[4]),
-                    "timestamp": recommendation_data[5].isoformat()
+                    "cost": recommendation_data[4],
+                    "timestamp": recommendation_data[5]
                 }
-            }), 200
+            }), recommendation_data[6]), 200
         else:
             return jsonify({
                 "code": 404,
@@ -131,28 +204,20 @@ def create_recommendation():
         recommendation_id = str(uuid.uuid4())
         current_time = datetime.now()
         
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Create new recommendation
-        cursor.execute(
-            """
-            INSERT INTO recommendations (
-                recommendation_id, customer_id, name, parts_list, cost, timestamp
-            ) VALUES (%s, %s, %s, %s::jsonb, %s, %s)
-            RETURNING *
-            """,
-            (
-                recommendation_id,
-                data["customer_id"],
-                data["name"],
-                json.dumps(transformed_parts_list),  # Save the transformed parts_list as a JSON array
-                data["cost"],
-                current_time
+        with db_pool.cursor() as cursor:
+            # Create new recommendation
+            INSERT_RECOMMENDATION.execute(
+                cursor,
+                (
+                    recommendation_id,
+                    data["customer_id"],
+                    data["name"],
+                    json.dumps(transformed_parts_list),  # Save the transformed parts_list as a JSON array
+                    data["cost"],
+                    current_time
+                )
             )
-        )
-        
-        new_recommendation = cursor.fetchone()
+            new_recommendation = cursor.fetchone()
         
         if not new_recommendation:
             return jsonify({
@@ -160,11 +225,7 @@ def create_recommendation():
                 "message": "Failed to retrieve the inserted recommendation"
             }), 500
         
-        print("New Recommendation:", new_recommendation)
-        
-        conn.commit()
-        cursor.close()
-        conn.close()
+        logger.debug("New Recommendation: %s", log.body(new_recommendation))
         
         return jsonify({
             "code": 201,
@@ -173,18 +234,13 @@ def create_recommendation():
                 "recommendation_id": new_recommendation[0],
                 "customer_id": new_recommendation[1],
                 "name": new_recommendation[2],
-                "cost": float(new_recommendation[3]),
+                "cost": new_recommendation[3],
                 "parts_list": transformed_parts_list,  # Return the transformed parts_list
-                "timestamp": new_recommendation[5].isoformat()
+                "timestamp": new_recommendation[5]
             }
         }), 201
         
     except Exception as e:
-        if 'conn' in locals():
-            conn.rollback()
-            if 'cursor' in locals():
-                cursor.close()
-            conn.close()
         return jsonify({
             "code": 500,
             "message": str(e)
@@ -193,19 +249,42 @@ def create_recommendation():
 @app.route("/recommendation/customer/<string:customer_id>", methods=['GET'])
 def get_recommendations_by_customer(customer_id):
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Query to get all recommendations for the given customer_id
-        cursor.execute("""
-            SELECT recommendation_id, customer_id, name, parts_list, cost, timestamp
-            FROM recommendations
-            WHERE customer_id = %s
-        """, (customer_id,))
-        recommendations = cursor.fetchall()
-        
-        cursor.close()
-        conn.close()
+        # Keyset pagination when the client passes ?limit= or ?cursor=
+        page = page_request()
+        if page:
+            recommendations, next_cursor = fetch_page(
+                db_pool,
+                "SELECT recommendation_id, customer_id, name, parts_list, cost, timestamp FROM recommendations",
+                "timestamp", "recommendation_id", page,
+                cursor_key=lambda rec: (rec[5], rec[0]),
+                filters=["customer_id = %s"], params=[customer_id]
+            )
+            return jsonify({
+                "code": 200,
+                "data": [format_recommendation(rec) for rec in recommendations],
+                "next": next_cursor
+            }), 200
+
+        if PG_JSON_RENDERING:
+            # Postgres renders the whole response body; Python only forwards the bytes
+            body = db_pool.fetch_json(f"""
+                SELECT json_build_object('code', 200, 'data', json_agg({RECOMMENDATION_JSON}))::text
+                FROM recommendations
+                WHERE customer_id = %s
+                HAVING count(*) > 0
+            """, (customer_id,))
+            if body:
+                return Response(body, status=200, mimetype="application/json")
+            recommendations = None
+        else:
+            with db_pool.read_cursor() as cursor:
+                # Query to get all recommendations for the given customer_id
+                cursor.execute("""
+                    SELECT recommendation_id, customer_id, name, parts_list, cost, timestamp
+                    FROM recommendations
+                    WHERE customer_id = %s
+                """, (customer_id,))
+                recommendations = cursor.fetchall()
         
         if recommendations:
             # Format the response data
@@ -215,8 +294,8 @@ def get_recommendations_by_customer(customer_id):
                     "customer_id": rec[1],
                     "name": rec[2],
                     "parts_list": rec[3],  # Directly return the list of integers
-                    "cost": float(rec[4]),
-                    "timestamp": rec[5].isoformat()
+                    "cost": rec[4],
+                    "timestamp": rec[5]
                 }
                 for rec in recommendations
             ]
@@ -230,6 +309,11 @@ def get_recommendations_by_customer(customer_id):
                 "message": "No recommendations found for the given customer ID"
             }), 404
             
+    except InvalidCursor as e:
+        return jsonify({
+            "code": 400,
+            "message": str(e)
+        }), 400
     except Exception as e:
         return jsonify({
             "code": 500,
@@ -238,33 +322,34 @@ def get_recommendations_by_customer(customer_id):
     
 @app.route("/recommendation/all", methods=['GET'])
 def get_all_recommendations():
+    # Query to get all recommendations
+    query = """
+        SELECT recommendation_id, customer_id, name, parts_list, cost, timestamp
+        FROM recommendations
+    """
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Query to get all recommendations
-        cursor.execute("""
-            SELECT recommendation_id, customer_id, name, parts_list, cost, timestamp
-            FROM recommendations
-        """)
-        recommendations = cursor.fetchall()
-        
-        cursor.close()
-        conn.close()
+        # Opt-in streaming: one recommendation per line from a server-side cursor, constant memory
+        if wants_ndjson():
+            return ndjson_response(db_pool.stream(query), format_recommendation)
+
+        if PG_JSON_RENDERING:
+            # Postgres renders the whole response body; Python only forwards the bytes
+            body = db_pool.fetch_json(f"""
+                SELECT json_build_object('code', 200, 'data', json_agg({RECOMMENDATION_JSON}))::text
+                FROM recommendations
+                HAVING count(*) > 0
+            """)
+            if body:
+                return Response(body, status=200, mimetype="application/json")
+            recommendations = None
+        else:
+            with db_pool.read_cursor() as cursor:
+                cursor.execute(query)
+                recommendations = cursor.fetchall()
 
         if recommendations:
             # Format the response data
-            recommendations_list = [
-                {
-                    "recommendation_id": rec[0],
-                    "customer_id": rec[1],
-                    "name": rec[2],
-                    "parts_list": rec[3],  # Directly return the list of integers
-                    "cost": float(rec[4]),
-                    "timestamp": rec[5].isoformat()
-                }
-                for rec in recommendations
-            ]
+            recommendations_list = [format_recommendation(rec) for rec in recommendations]
             return jsonify({
                 "code": 200,
                 "data": recommendations_list
@@ -282,12 +367,4 @@ def get_all_recommendations():
         }), 500
 
 if __name__ == '__main__':
-    # First ensure database exists, then initialize tables
-    try:
-        ensure_database_exists()
-        # initialize_tables()
-    except Exception as e:
-        print(f"Failed to initialize database: {str(e)}")
-        exit(1)
-    
     app.run(host='0.0.0.0', port=5004, debug=True)
\ No newline at end of file
@@ -1,5 +1,6 @@
 import requests
 import logging
+from common import http_client, log, metrics, tracing
 
 # Set up logging
 logger = logging.getLogger(__name__)
@@ -21,13 +22,17 @@ def invoke_http(url, method='GET', json=None, **kwargs):
         The JSON reply content from the http service if the call succeeds;
         otherwise, returns a JSON object with error details.
     """
-    logger.info(f"Invoking {method} request to {url}")
+    logger.info("Invoking %s request to %s", method, url)
     if json:
-        logger.debug(f"Payload: {json}")
+        logger.debug("Payload: %s", log.body(json))
         
     try:
         if method.upper() in SUPPORTED_HTTP_METHODS:
-            response = requests.request(method, url, json=json, **kwargs)
+            with tracing.client_span(method, url) as span, metrics.outbound(url, method) as call:
+                headers = tracing.inject(dict(kwargs.pop("headers", None) or {}))
+                response = http_client.request(method, url, headers=headers, json=json, **kwargs)
+                call.status = response.status_code
+                span.set_attribute("http.status_code", response.status_code)
             response.raise_for_status()
             return response.json() if response.content else {}
         else:
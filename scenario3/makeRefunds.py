@@ -12,17 +12,30 @@ RABBITMQ_PORT = int(os.environ.get('RABBITMQ_PORT', '5673'))
 from flask import Flask, request, jsonify
 from invokes import invoke_http
 from config import Config
-from amqp.amqp_setup import publish_message
+from amqp.amqp_setup import ping as ping_broker, publish_message
+from common import health, json_provider, log, metrics, profiling, tracing
+from common.admission import AdmissionControl
 import json
 from flask_cors import CORS
 import logging
 
+# JSON log lines written off the request thread; LOG_LEVEL=DEBUG adds (truncated) payloads
+log.setup("scenario3")
+logger = logging.getLogger(__name__)
+
 app = Flask(__name__)
 CORS(app)
-
-# Set up logging
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
+# orjson-backed jsonify that also encodes datetime, Decimal and UUID values
+json_provider.init_app(app)
+# Prometheus /metrics: request latency per route and status, outbound call latency per downstream
+metrics.init_app(app)
+# Server span per request, continuing the caller's W3C traceparent
+tracing.init_app(app, "scenario3")
+# cProfile of requests carrying a signed X-Debug-Profile token (or sampled), kept at /debug/profiles
+profiling.init_app(app, "scenario3")
+# Per-route AIMD concurrency limits: shed load with 503 + Retry-After when downstreams slow down
+admission_control = AdmissionControl()
+admission_control.init_app(app)
 
 # Service URLs
 CUSTOMER_URL = os.environ.get('CUSTOMER_SERVICE_URL', 'http://customer:5001')
@@ -31,6 +44,15 @@ DELIVERY_URL = os.environ.get('DELIVERY_SERVICE_URL', 'http://delivery:5003')
 ORDER_URL = os.environ.get('ORDER_SERVICE_URL', 'http://order:5002')
 OUTSYSTEMS_URL = 'https://personal-0careuf6.outsystemscloud.com/ByteMeComponentService/rest/ComponentAPI'
 
+# /health and /ready served from background checks every HEALTH_CHECK_INTERVAL seconds; refunds
+# cannot be queued without the broker, the downstreams are only reported
+health_monitor = health.HealthMonitor("scenario3")
+health_monitor.add_check("broker", ping_broker)
+for name, url in (("customer", CUSTOMER_URL), ("order", ORDER_URL), ("delivery", DELIVERY_URL), ("stripe", STRIPE_URL)):
+    health_monitor.add_check(name, health.http(health.service_url(url)), critical=False)
+health_monitor.add_check("outsystems", health.http(health.service_url(OUTSYSTEMS_URL, "/")), critical=False)
+health_monitor.init_app(app)
+
 def safe_publish(exchange, routing_key, message):
     """Safely publish a message to RabbitMQ with error handling"""
     try:
@@ -44,7 +66,7 @@ def safe_publish(exchange, routing_key, message):
 @app.route('/initiate-refund', methods=['POST'])
 def initiate_refund():
     data = request.get_json()
-    logger.info(f"Received refund request: {data}")
+    logger.debug("Received refund request: %s", log.body(data))
 
     # Validate required fields
     order_id = data.get('order_id')
@@ -60,20 +82,24 @@ def initiate_refund():
         customer_response = invoke_http(f"{CUSTOMER_URL}/customer/{customer_id}", method='GET')
         
         if customer_response.get("code") != 200:
-            logger.error(f"Failed to get customer details: {customer_response}")
+            logger.error("Failed to get customer details: %s", log.body(customer_response))
             return jsonify({"success": False, "error": "Failed to get customer details"}), 400
         
         customer_email = customer_response.get("data", {}).get("email")
         customer_address = customer_response.get("data", {}).get("address")
         
-        logger.info(f"Customer email: {customer_email}, address: {customer_address}")
+        logger.debug("Customer email: %s, address: %s", customer_email, customer_address)
         
         # Step 2: Get order details including parts list and payment intent ID
         logger.info(f"2️⃣ Fetching order details for order ID: {order_id}")
-        order_response = invoke_http(f"{ORDER_URL}/order/{order_id}", method='GET')
+        # Read from the primary: the refund decision must not act on a lagging replica's copy
+        order_response = invoke_http(
+            f"{ORDER_URL}/order/{order_id}", method='GET',
+            headers={"X-Read-After-Write": "true"}
+        )
         
         if order_response.get("code") != 200:
-            logger.error(f"Failed to get order details: {order_response}")
+            logger.error("Failed to get order details: %s", log.body(order_response))
             return jsonify({"success": False, "error": "Failed to get order details"}), 400
         
         order_data = order_response.get("data", {})
@@ -84,7 +110,7 @@ def initiate_refund():
         logger.info(f"3️⃣ Verifying payment intent: {payment_intent_id}")
         payment_intent_response = invoke_http(f"{STRIPE_URL}/payment-intent/{payment_intent_id}", method="GET")
         
-        logger.info(f"Payment intent response: {payment_intent_response}")
+        logger.debug("Payment intent response: %s", log.body(payment_intent_response))
         
         # Check if response has a data wrapper or is a direct response
         if "data" in payment_intent_response and isinstance(payment_intent_response["data"], dict):
@@ -94,7 +120,7 @@ def initiate_refund():
             # Direct response format: {"amount": 5000000, ...}
             payment_amount = payment_intent_response.get("amount", 0)
         
-        logger.info(f"Extracted payment amount: {payment_amount}")
+        logger.info("Extracted payment amount: %s", payment_amount)
         
         # Step 4: Initiate refund via Stripe
         logger.info(f"4️⃣ Initiating refund for payment: {payment_intent_id}")
@@ -130,11 +156,11 @@ def initiate_refund():
             
             # Increase stock by 1
             update_url = f"{OUTSYSTEMS_URL}/UpdateComponentStock?ComponentId={component_id}&QuantityChange=1"
-            logger.info(f"Updating stock for component {component_id}: {update_url}")
+            logger.debug("Updating stock for component %s: %s", component_id, update_url)
             
             try:
                 stock_response = invoke_http(update_url, method='POST')
-                logger.info(f"Stock update response for part {component_id}: {stock_response}")
+                logger.debug("Stock update response for part %s: %s", component_id, log.body(stock_response))
             except Exception as e:
                 logger.error(f"Failed to update stock for part {component_id}: {str(e)}")
                 # Continue with other parts even if one fails
@@ -150,7 +176,7 @@ def initiate_refund():
         
         try:
             delivery_response = invoke_http(f"{DELIVERY_URL}/delivery", method='POST', json=delivery_data)
-            logger.info(f"Delivery response: {delivery_response}")
+            logger.debug("Delivery response: %s", log.body(delivery_response))
         except Exception as e:
             logger.error(f"Failed to create delivery record: {str(e)}")
             # Continue even if delivery creation fails
@@ -167,7 +193,7 @@ def initiate_refund():
             if status_update_response.get("code") == 200:
                 logger.info(f"Order status updated successfully: {order_id} → refunded")
             else:
-                logger.error(f"Failed to update order status: {status_update_response}")
+                logger.error("Failed to update order status: %s", log.body(status_update_response))
                 # Continue even if status update fails
         except Exception as e:
             logger.error(f"Error updating order status: {str(e)}")
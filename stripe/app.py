@@ -15,30 +15,59 @@ from endpoints import status
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '/')))
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
 
-# Configure logging
-logging.basicConfig(level=logging.WARNING)
+from common import health, json_provider, log, metrics, profiling, serving, tracing
+
+# JSON log lines written off the request and consumer threads; LOG_LEVEL=DEBUG adds (truncated) payloads
+log.setup("stripe", level="WARNING")
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
 # Update CORS configuration to explicitly allow requests from the frontend
 CORS(app)
+# orjson-backed jsonify that also encodes datetime, Decimal and UUID values
+json_provider.init_app(app)
+# Prometheus /metrics: request latency per route and status, Stripe API call latency
+metrics.init_app(app)
+# Server span per request, continuing the caller's W3C traceparent
+tracing.init_app(app, "stripe")
+# cProfile of requests carrying a signed X-Debug-Profile token (or sampled), kept at /debug/profiles
+profiling.init_app(app, "stripe")
 
 # Configure Stripe
 stripe.api_key = Config.STRIPE_SECRET_KEY
 
-# Reinitialize RabbitMQ for refund requests
-from process.message_queue import setup_all_queues
 
-# Initialize AMQP for Stripe service
-if not setup_all_queues():
-    logger.error("Failed to setup Stripe AMQP queues")
-    raise Exception("AMQP Setup Failed")
+class TimedRequestsClient(stripe.http_client.RequestsClient):
+    """Stripe's default HTTP client, timing every API call into outbound_request_duration_seconds and a client span"""
+
+    def request(self, method, url, headers, post_data=None):
+        with tracing.client_span(method, url) as span, metrics.outbound("stripe_api", method) as call:
+            content, status_code, response_headers = super().request(method, url, headers, post_data)
+            call.status = status_code
+            span.set_attribute("http.status_code", status_code)
+        return content, status_code, response_headers
+
+
+stripe.default_http_client = TimedRequestsClient()
 
-# Start refund processor in a separate thread
+from process.message_queue import ping as ping_broker, setup_all_queues
 from process.refund_processor import start_consuming
-threading.Thread(target=start_consuming, daemon=True).start()
-logger.info("Stripe service started consuming refund requests")
+
+
+def consume_refunds():
+    # Exchanges are declared from the worker's consumer thread, not at import, so neither
+    # a preloading gunicorn master nor a slow broker holds up the server's start
+    if not setup_all_queues():
+        logger.error("Failed to setup Stripe AMQP queues")
+    start_consuming()
+
+# Start the refund processor in a separate thread of each worker; with a preloaded
+# app a thread started here would only run in the gunicorn master
+@serving.after_fork
+def start_refund_consumer():
+    threading.Thread(target=consume_refunds, daemon=True).start()
+    logger.info("Stripe service started consuming refund requests")
 
 # Register blueprints
 from endpoints.blueprint_registry import checkout_bp, refund_bp, status_bp, payment_bp
@@ -58,10 +87,14 @@ def list_routes():
         })
     return jsonify(routes)
 
-@app.route('/health', methods=['GET'])
-def health_check():
-    return jsonify({"status": "healthy"}), 200
+# /health and /ready served from background checks every HEALTH_CHECK_INTERVAL seconds; the refund
+# consumer needs the broker, an outage at Stripe is reported but affects every instance alike
+health_monitor = health.HealthMonitor("stripe")
+health_monitor.add_check("broker", ping_broker)
+health_monitor.add_check("stripe_api", health.http("https://api.stripe.com"), critical=False)
+health_monitor.init_app(app)
 
 if __name__ == "__main__":
     logger.info("Stripe service started (RabbitMQ disabled)")
+    serving.run_after_fork()
     app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
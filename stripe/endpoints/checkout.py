@@ -7,7 +7,6 @@ import logging
 
 # Configure Stripe
 stripe.api_key = Config.STRIPE_SECRET_KEY
-logging.basicConfig(level=logging.WARNING)
 logger = logging.getLogger(__name__)
 
 @checkout_bp.route('/create-checkout-session', methods=['POST', 'OPTIONS'])
@@ -17,7 +16,7 @@ def create_checkout_session():
 
     try:
         data = request.get_json()
-        logger.info(f"Received request data: {data}")
+        logger.debug("Received request data: %s", data)
 
         # Validate minimum required fields
         if not data.get('amount'):
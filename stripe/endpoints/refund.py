@@ -11,8 +11,6 @@ import os
 # Configure Stripe
 stripe.api_key = Config.STRIPE_SECRET_KEY
 
-# Setup logging
-logging.basicConfig(level=logging.WARNING)
 logger = logging.getLogger(__name__)
 
 @refund_bp.route('/refund-async', methods=['POST'])
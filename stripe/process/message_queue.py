@@ -39,6 +39,20 @@ def get_rabbitmq_connection():
         logger.error(f"Failed to connect to RabbitMQ: {str(e)}")
         return None
 
+def ping(timeout=2):
+    """A single quick connection attempt, for health checks; raises when the broker is unreachable"""
+    connection = pika.BlockingConnection(
+        pika.ConnectionParameters(
+            host=amqp_host,
+            port=amqp_port,
+            credentials=pika.PlainCredentials(amqp_user, amqp_password),
+            connection_attempts=1,
+            socket_timeout=timeout,
+            blocked_connection_timeout=timeout
+        )
+    )
+    connection.close()
+
 def setup_all_queues():
     """Set up all queues needed by the system"""
     connection = get_rabbitmq_connection()
@@ -9,6 +9,7 @@ import os
 # Fix imports by adding the correct paths
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
 from config import Config
+from common import log, tracing
 
 # Configure Stripe
 stripe.api_key = Config.STRIPE_SECRET_KEY
@@ -19,22 +20,22 @@ logger = logging.getLogger(__name__)
 # Import this function after we've setup the proper paths
 from .message_queue import get_rabbitmq_connection
 
+@tracing.consumer("refund.request")
 def process_refund_callback(ch, method, properties, body):
     try:
         refund_request = json.loads(body)
-        logger.info("=============== Processing Refund ===============")
-        logger.info(f"Refund request: {refund_request}")
+        logger.debug("Refund request: %s", log.body(refund_request))
 
         # Verify payment intent exists
         payment_intent = stripe.PaymentIntent.retrieve(refund_request['payment_intent_id'])
-        logger.info(f"Found payment intent: {payment_intent.id}")
+        logger.info("Found payment intent: %s", payment_intent.id)
 
         # Process refund
         refund = stripe.Refund.create(
             payment_intent=refund_request['payment_intent_id'],
             amount=payment_intent.amount
         )
-        logger.info(f"Refund created: {refund.id}, Status: {refund.status}")
+        logger.info("Refund created: %s, Status: %s", refund.id, refund.status)
 
         ch.basic_ack(delivery_tag=method.delivery_tag)
         logger.info("Refund processing completed successfully")
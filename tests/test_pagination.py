@@ -0,0 +1,62 @@
+import os
+import sys
+from datetime import datetime
+
+import pytest
+from flask import Flask
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '../'))
+sys.path.append(ROOT)
+
+from common.pagination import (  # noqa: E402
+    MAX_PAGE_SIZE, InvalidCursor, Page, decode_cursor, encode_cursor, keyset_query, page_request
+)
+
+START = datetime(2024, 5, 1, 12, 0, 0)
+
+
+def test_cursor_round_trips():
+    timestamp = datetime(2024, 5, 1, 12, 30, 15, 123456)
+    token = encode_cursor(timestamp, "ord-42")
+
+    assert "=" not in token
+    assert decode_cursor(token) == (timestamp, "ord-42")
+
+
+def test_cursor_key_is_always_a_string():
+    assert decode_cursor(encode_cursor(START, 42)) == (START, "42")
+
+
+@pytest.mark.parametrize("token", ["", "not a cursor", encode_cursor(START, "a")[:-3]])
+def test_malformed_cursor_is_rejected(token):
+    with pytest.raises(InvalidCursor):
+        decode_cursor(token)
+
+
+def test_keyset_query_first_page():
+    query, params = keyset_query("SELECT * FROM orders", "created_at", "order_id", Page(10, None))
+
+    assert query == "SELECT * FROM orders ORDER BY created_at DESC, order_id DESC LIMIT %s"
+    assert params == [11]
+
+
+def test_keyset_query_seeks_past_the_cursor():
+    query, params = keyset_query("SELECT * FROM orders", "created_at", "order_id",
+                                 Page(10, (START, "ord-1")), ["customer_id = %s"], ["c1"])
+
+    assert query == ("SELECT * FROM orders WHERE customer_id = %s AND (created_at, order_id) < (%s, %s)"
+                     " ORDER BY created_at DESC, order_id DESC LIMIT %s")
+    assert params == ["c1", START, "ord-1", 11]
+
+
+def test_page_request_is_none_without_pagination_arguments():
+    with Flask(__name__).test_request_context("/orders"):
+        assert page_request() is None
+
+
+def test_page_request_clamps_limit_and_decodes_cursor():
+    token = encode_cursor(START, "ord-1")
+    with Flask(__name__).test_request_context(f"/orders?limit={MAX_PAGE_SIZE + 1}&cursor={token}"):
+        assert page_request() == Page(MAX_PAGE_SIZE, (START, "ord-1"))
+    with Flask(__name__).test_request_context("/orders?limit=-5"):
+        assert page_request().limit == 1
@@ -0,0 +1,64 @@
+import os
+import sys
+import json
+from types import SimpleNamespace
+
+import pytest
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '../'))
+STRIPE_DIR = os.path.join(ROOT, "stripe")
+
+
+@pytest.fixture(scope="module")
+def refund_processor():
+    # The service runs from stripe/, where `stripe` is the library rather than this repo's stripe/ directory
+    saved = sys.path[:]
+    sys.path[:] = [STRIPE_DIR] + [p for p in saved if os.path.abspath(p or ".") != ROOT] + [ROOT]
+    try:
+        stripe = pytest.importorskip("stripe")
+        if not hasattr(stripe, "Refund"):
+            pytest.skip("the stripe library is not installed")
+        pytest.importorskip("pika")
+        from process import refund_processor
+        yield refund_processor
+    finally:
+        sys.path[:] = saved
+
+
+class Channel:
+    def __init__(self):
+        self.acked = []
+        self.nacked = []
+
+    def basic_ack(self, delivery_tag):
+        self.acked.append(delivery_tag)
+
+    def basic_nack(self, delivery_tag, requeue):
+        self.nacked.append(delivery_tag)
+
+
+def test_refund_message_is_refunded_and_acked(refund_processor, monkeypatch):
+    stripe = refund_processor.stripe
+    refunds = []
+    monkeypatch.setattr(stripe.PaymentIntent, "retrieve",
+                        lambda payment_intent_id: SimpleNamespace(id=payment_intent_id, amount=5000))
+    monkeypatch.setattr(stripe.Refund, "create",
+                        lambda **kwargs: refunds.append(kwargs) or SimpleNamespace(id="re_1", status="pending"))
+
+    channel = Channel()
+    body = json.dumps({"payment_intent_id": "pi_1", "amount": 5000, "customer_email": "a@example.com"})
+    refund_processor.process_refund_callback(channel, SimpleNamespace(delivery_tag=7, routing_key="refund.request"),
+                                             SimpleNamespace(headers=None), body)
+
+    assert refunds == [{"payment_intent": "pi_1", "amount": 5000}]
+    assert channel.acked == [7]
+    assert channel.nacked == []
+
+
+def test_malformed_message_is_nacked(refund_processor):
+    channel = Channel()
+    refund_processor.process_refund_callback(channel, SimpleNamespace(delivery_tag=8, routing_key="refund.request"),
+                                             SimpleNamespace(headers=None), b"not json")
+
+    assert channel.acked == []
+    assert channel.nacked == [8]
@@ -0,0 +1,213 @@
+import os
+import sys
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import pytest
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '../'))
+sys.path.append(ROOT)
+
+from common import sharding  # noqa: E402
+from common.pagination import Page, decode_cursor, merge_pages  # noqa: E402
+from common.sharding import HashRing, ShardSet  # noqa: E402
+
+SHARDS = ["db-0:5432/orders", "db-1:5432/orders", "db-2:5432/orders"]
+KEYS = [f"customer-{i}" for i in range(5000)]
+START = datetime(2024, 5, 1, 12, 0, 0)
+PROBE = "SELECT 1 FROM orders WHERE order_id = %s"
+
+
+def placement(ring):
+    return {key: ring.lookup(key) for key in KEYS}
+
+
+def test_placement_is_stable_across_rings():
+    # Every worker and every restart builds its own ring; they must agree on where a key lives
+    assert placement(HashRing(SHARDS)) == placement(HashRing(list(reversed(SHARDS))))
+
+
+def test_keys_are_spread_over_every_shard():
+    counts = {}
+    for shard in placement(HashRing(SHARDS)).values():
+        counts[shard] = counts.get(shard, 0) + 1
+
+    assert set(counts) == set(SHARDS)
+    assert min(counts.values()) > len(KEYS) / len(SHARDS) / 2
+
+
+def test_adding_a_shard_only_moves_keys_onto_it():
+    before = placement(HashRing(SHARDS))
+    new_shard = "db-3:5432/orders"
+    after = placement(HashRing(SHARDS + [new_shard]))
+
+    moved = [key for key in KEYS if before[key] != after[key]]
+    assert all(after[key] == new_shard for key in moved)
+    # About a quarter of the keys should move; a full reshuffle would move three quarters
+    assert len(KEYS) / 8 < len(moved) < len(KEYS) / 2
+
+
+def test_removing_a_shard_only_moves_its_keys():
+    before = placement(HashRing(SHARDS))
+    after = placement(HashRing(SHARDS[:-1]))
+
+    for key in KEYS:
+        if before[key] != SHARDS[-1]:
+            assert after[key] == before[key]
+
+
+def test_integer_and_string_keys_land_together():
+    ring = HashRing(SHARDS)
+    assert ring.lookup(1234) == ring.lookup("1234")
+
+
+class StubCursor:
+    def __init__(self, pool):
+        self.pool = pool
+        self.row = None
+
+    def execute(self, query, params=None):
+        self.pool.executed.append(query)
+        if query.startswith("INSERT INTO shard_directory"):
+            entity_id, shard = params
+            if entity_id in self.pool.directory:
+                raise Exception("duplicate key value violates unique constraint")
+            self.pool.directory[entity_id] = shard
+        elif query.startswith("DELETE FROM shard_directory"):
+            self.pool.directory.pop(params[0], None)
+        elif query.startswith("SELECT shard FROM shard_directory"):
+            shard = self.pool.directory.get(params[0])
+            self.row = (shard,) if shard else None
+        elif query == PROBE:
+            self.row = (1,) if params[0] in self.pool.rows else None
+
+    def fetchone(self):
+        return self.row
+
+
+class StubPool:
+    """Stands in for a DatabasePool: a directory table and the ids of the rows it holds"""
+
+    sql_stats = None
+
+    def __init__(self, params=None):
+        self.db_params = dict(params or {})
+        self.directory = {}
+        self.rows = set()
+        self.executed = []
+
+    @contextmanager
+    def cursor(self):
+        yield StubCursor(self)
+
+    read_cursor = cursor
+
+
+@pytest.fixture
+def shard_set(monkeypatch):
+    monkeypatch.setattr(sharding, "DatabasePool", lambda service, params, **kwargs: StubPool(params))
+    params = [{"host": f"db-{i}", "port": 5432, "dbname": "orders"} for i in range(3)]
+    return ShardSet("order", StubPool(), params)
+
+
+def test_assign_records_the_owning_shard_first(shard_set):
+    with shard_set.assign("ord-1", "customer-7") as pool:
+        assert shard_set.directory.directory == {"ord-1": shard_set.name(pool)}
+
+    assert pool is shard_set.for_key("customer-7")
+    assert shard_set.ring.lookup("customer-7") == shard_set.name(pool)
+
+
+def test_assign_removes_the_directory_row_when_the_write_fails(shard_set):
+    with pytest.raises(RuntimeError):
+        with shard_set.assign("ord-1", "customer-7"):
+            raise RuntimeError("insert failed")
+
+    assert shard_set.directory.directory == {}
+
+
+def test_assign_rejects_an_id_taken_on_another_shard(shard_set):
+    shard_set.directory.directory["ord-1"] = SHARDS[0]
+
+    with pytest.raises(Exception, match="duplicate"):
+        with shard_set.assign("ord-1", "customer-7"):
+            pytest.fail("the with-block must not run")
+
+    assert shard_set.directory.directory == {"ord-1": SHARDS[0]}
+
+
+def test_locate_uses_the_directory_without_probing(shard_set):
+    shard_set.directory.directory["ord-1"] = SHARDS[1]
+
+    assert shard_set.locate("ord-1", PROBE) is shard_set.pools[SHARDS[1]]
+    assert all(not pool.executed for pool in shard_set.pools.values())
+
+
+def test_locate_probes_every_shard_on_a_directory_miss(shard_set):
+    shard_set.pools[SHARDS[2]].rows.add("ord-old")
+
+    assert shard_set.locate("ord-old", PROBE) is shard_set.pools[SHARDS[2]]
+    assert all(pool.executed == [PROBE] for pool in shard_set.pools.values())
+
+
+def test_locate_returns_none_for_an_unknown_id(shard_set):
+    assert shard_set.locate("ord-missing", PROBE) is None
+
+
+def test_unsharded_set_routes_everything_to_the_directory():
+    directory = StubPool()
+    shard_set = ShardSet("order", directory)
+
+    with shard_set.assign("ord-1", "customer-7") as pool:
+        assert pool is directory
+    assert shard_set.locate("ord-1", PROBE) is directory
+    assert directory.directory == {} and directory.executed == []
+
+
+def cursor_key(row):
+    return row["created_at"], row["id"]
+
+
+def rows(*offsets_and_ids):
+    """Rows newest first, as each shard's keyset_query() returns them"""
+    result = [{"created_at": START + timedelta(seconds=offset), "id": key} for offset, key in offsets_and_ids]
+    return sorted(result, key=cursor_key, reverse=True)
+
+
+def test_merge_pages_interleaves_shards_newest_first():
+    shard_a = rows((50, "a1"), (30, "a2"), (10, "a3"))
+    shard_b = rows((40, "b1"), (20, "b2"))
+
+    page, next_cursor = merge_pages([shard_a, shard_b], Page(10, None), cursor_key)
+
+    assert [row["id"] for row in page] == ["a1", "b1", "a2", "b2", "a3"]
+    assert next_cursor is None
+
+
+def test_merge_pages_breaks_timestamp_ties_by_id_descending():
+    shard_a = rows((10, "x2"), (10, "x0"))
+    shard_b = rows((10, "x3"), (10, "x1"))
+
+    page, _ = merge_pages([shard_a, shard_b], Page(10, None), cursor_key)
+
+    assert [row["id"] for row in page] == ["x3", "x2", "x1", "x0"]
+
+
+def test_merge_pages_cuts_to_limit_and_points_the_cursor_at_the_last_row():
+    shard_a = rows((50, "a1"), (30, "a2"), (10, "a3"))
+    shard_b = rows((40, "b1"), (20, "b2"))
+
+    page, next_cursor = merge_pages([shard_a, shard_b], Page(3, None), cursor_key)
+
+    assert [row["id"] for row in page] == ["a1", "b1", "a2"]
+    assert decode_cursor(next_cursor) == (START + timedelta(seconds=30), "a2")
+
+
+def test_merge_pages_matches_a_single_sorted_list():
+    shards = [rows(*[(offset, f"s{shard}-{offset}") for offset in range(shard, 60, 3)]) for shard in range(3)]
+    everything = sorted((row for shard in shards for row in shard), key=cursor_key, reverse=True)
+
+    page, next_cursor = merge_pages(shards, Page(25, None), cursor_key)
+
+    assert page == everything[:25]
+    assert decode_cursor(next_cursor) == cursor_key(everything[24])